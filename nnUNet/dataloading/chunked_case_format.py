@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import struct
+import zlib
+from multiprocessing import Pool
+from typing import Dict, Sequence, Tuple, Union
+
+import numpy as np
+
+MAGIC = b'NNUCHK1\0'
+CHUNKED_SUFFIX = '.chk'
+DEFAULT_CHUNK_SHAPE = (64, 64, 64)
+
+
+def chunked_file(data_file: str) -> str:
+    """
+    Path of the chunked file of a case, next to its .npz data_file.
+    """
+    return data_file[:-4] + CHUNKED_SUFFIX
+
+
+def write_chunked_case(path: str, arrays: Dict[str, np.ndarray], chunk_shape: Sequence[int] = DEFAULT_CHUNK_SHAPE,
+                       compression_level: int = 1) -> None:
+    """
+    Write (channels, *spatial) arrays (e.g. 'data' and 'seg') into one file of zlib-compressed chunks. Each chunk holds
+    all channels of a chunk_shape block, so a bounding box read decompresses only the chunks it overlaps.
+
+    Layout: MAGIC, uint64 header length, JSON header (shape, dtype, chunk shape and the offset and length of every
+    chunk of every array, chunks in C order of the chunk grid), then the compressed chunks.
+    """
+    header = {'version': 1, 'arrays': {}}
+    blobs = []
+    position = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        spatial = array.shape[1:]
+        cs = tuple(int(min(c, s)) if s > 0 else int(c) for c, s in zip(chunk_shape, spatial))
+        grid = tuple(int(np.ceil(s / c)) for s, c in zip(spatial, cs))
+        offsets, lengths = [], []
+        for idx in np.ndindex(*grid):
+            slicer = (slice(None),) + tuple(slice(i * c, min((i + 1) * c, s)) for i, c, s in zip(idx, cs, spatial))
+            blob = zlib.compress(np.ascontiguousarray(array[slicer]).tobytes(), compression_level)
+            offsets.append(position)
+            lengths.append(len(blob))
+            blobs.append(blob)
+            position += len(blob)
+        header['arrays'][name] = {'shape': list(array.shape), 'dtype': array.dtype.str, 'chunk_shape': list(cs),
+                                  'grid': list(grid), 'offsets': offsets, 'lengths': lengths}
+    header_bytes = json.dumps(header).encode()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def read_chunked_header(path: str) -> dict:
+    """
+    Header of a chunked file (shapes, dtypes and chunk table) without reading any voxel.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a chunked case file')
+        (length,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length))
+    header['data_start'] = len(MAGIC) + 8 + length
+    return header
+
+
+class ChunkedCase(object):
+    """
+    Reader of a chunked case file. Only the header is read on construction; read_into decompresses the chunks
+    overlapping a bounding box, so the I/O of a patch read scales with the patch size rather than the volume size.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.header = read_chunked_header(path)
+        self.arrays = self.header['arrays']
+
+    def shape(self, name: str) -> Tuple[int, ...]:
+        return tuple(self.arrays[name]['shape'])
+
+    def _read_chunk(self, f, meta: dict, idx: Tuple[int, ...], chunk_lbs, chunk_ubs) -> np.ndarray:
+        k = int(np.ravel_multi_index(idx, meta['grid']))
+        f.seek(self.header['data_start'] + meta['offsets'][k])
+        buffer = zlib.decompress(f.read(meta['lengths'][k]))
+        chunk_shape = (meta['shape'][0],) + tuple(ub - lb for lb, ub in zip(chunk_lbs, chunk_ubs))
+        return np.frombuffer(buffer, dtype=np.dtype(meta['dtype'])).reshape(chunk_shape)
+
+    def read_into(self, name: str, out: np.ndarray, bbox_lbs: Sequence[int], bbox_ubs: Sequence[int],
+                  pad_value: Union[int, float] = 0) -> None:
+        """
+        Write array[:, bbox_lbs:bbox_ubs] into out (channels, *bbox size), padding the parts of the bbox outside of
+        the array with pad_value (same result as patch_buffers.crop_and_pad_into on the full array).
+        """
+        meta = self.arrays[name]
+        spatial, cs = meta['shape'][1:], meta['chunk_shape']
+        valid_lbs = [max(0, lb) for lb in bbox_lbs]
+        valid_ubs = [min(s, ub) for s, ub in zip(spatial, bbox_ubs)]
+        if list(valid_lbs) != list(bbox_lbs) or list(valid_ubs) != list(bbox_ubs):
+            out.fill(pad_value)
+        if any(ub <= lb for lb, ub in zip(valid_lbs, valid_ubs)):
+            return
+        chunk_ranges = [range(lb // c, (ub - 1) // c + 1) for lb, ub, c in zip(valid_lbs, valid_ubs, cs)]
+        with open(self.path, 'rb') as f:
+            for idx in np.ndindex(*[len(r) for r in chunk_ranges]):
+                idx = tuple(r[i] for r, i in zip(chunk_ranges, idx))
+                chunk_lbs = [i * c for i, c in zip(idx, cs)]
+                chunk_ubs = [min(lb + c, s) for lb, c, s in zip(chunk_lbs, cs, spatial)]
+                chunk = self._read_chunk(f, meta, idx, chunk_lbs, chunk_ubs)
+                inter_lbs = [max(a, b) for a, b in zip(chunk_lbs, valid_lbs)]
+                inter_ubs = [min(a, b) for a, b in zip(chunk_ubs, valid_ubs)]
+                target = (slice(None),) + tuple(slice(lb - b, ub - b)
+                                                for lb, ub, b in zip(inter_lbs, inter_ubs, bbox_lbs))
+                source = (slice(None),) + tuple(slice(lb - c, ub - c)
+                                                for lb, ub, c in zip(inter_lbs, inter_ubs, chunk_lbs))
+                out[target] = chunk[source]
+
+    def read(self, name: str) -> np.ndarray:
+        """
+        The whole array.
+        """
+        shape = self.shape(name)
+        out = np.empty(shape, dtype=np.dtype(self.arrays[name]['dtype']))
+        self.read_into(name, out, [0] * (len(shape) - 1), shape[1:])
+        return out
+
+
+def convert_npz_case(npz_file: str, chunk_shape: Sequence[int] = DEFAULT_CHUNK_SHAPE, compression_level: int = 1,
+                     overwrite_existing: bool = False) -> str:
+    """
+    Convert a preprocessed <case>.npz (data and seg) to <case>.chk next to it, unless it is up to date.
+    """
+    target = chunked_file(npz_file)
+    if not overwrite_existing and os.path.isfile(target) and os.path.getmtime(target) >= os.path.getmtime(npz_file):
+        return target
+    with np.load(npz_file) as npz:
+        arrays = {'data': npz['data'], 'seg': npz['seg']}
+    write_chunked_case(target, arrays, chunk_shape, compression_level)
+    return target
+
+
+def convert_npz_folder(folder: str, num_processes: int = 8, chunk_shape: Sequence[int] = DEFAULT_CHUNK_SHAPE,
+                       compression_level: int = 1, overwrite_existing: bool = False) -> list:
+    """
+    Convert every preprocessed case of a folder (e.g. nnUNet_preprocessed/DatasetXXX/nnUNetPlans_3d_fullres).
+    """
+    npz_files = sorted(os.path.join(folder, i) for i in os.listdir(folder)
+                       if i.endswith('.npz') and i.find('segFromPrevStage') == -1)
+    with Pool(num_processes) as pool:
+        return pool.starmap(convert_npz_case, [(f, chunk_shape, compression_level, overwrite_existing)
+                                               for f in npz_files])
+
+
+def is_chunked_folder(folder: str) -> bool:
+    """
+    True if every preprocessed case of the folder has an up-to-date chunked file, in which case unpacking the .npz
+    files to .npy is not needed.
+    """
+    npz_files = [os.path.join(folder, i) for i in os.listdir(folder)
+                 if i.endswith('.npz') and i.find('segFromPrevStage') == -1]
+    return len(npz_files) > 0 and all(
+        os.path.isfile(chunked_file(f)) and os.path.getmtime(chunked_file(f)) >= os.path.getmtime(f)
+        for f in npz_files)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert preprocessed nnU-Net cases to the chunked format.')
+    parser.add_argument('folder', help='Folder with the preprocessed .npz cases, e.g. '
+                                       'nnUNet_preprocessed/Dataset797_TotalSegmentator_plus_TCIA/nnUNetPlans_3d_fullres')
+    parser.add_argument('-np', '--num_processes', type=int, default=8)
+    parser.add_argument('--chunk_shape', type=int, nargs='+', default=list(DEFAULT_CHUNK_SHAPE))
+    parser.add_argument('--compression_level', type=int, default=1)
+    parser.add_argument('--overwrite_existing', action='store_true')
+    args = parser.parse_args()
+    converted = convert_npz_folder(args.folder, args.num_processes, args.chunk_shape, args.compression_level,
+                                   args.overwrite_existing)
+    print(f'{len(converted)} cases in chunked format')
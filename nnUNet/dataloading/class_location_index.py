@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import pickle
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+INDEX_FOLDER_NAME = 'class_location_index'
+
+
+def _class_key_to_json(key: Union[int, Tuple[int, ...]]):
+    return list(key) if isinstance(key, tuple) else int(key)
+
+
+def _class_key_from_json(key) -> Union[int, Tuple[int, ...]]:
+    return tuple(key) if isinstance(key, list) else key
+
+
+def build_class_location_index(preprocessed_folder: str, output_folder: str = None) -> str:
+    """
+    Collect the class_locations of every case of a preprocessed nnU-Net folder (the properties pickles next to the
+    .npz files) into a compact index: for every class, one flat (n_voxels, dim) uint16 array with the spatial
+    coordinates of all cases and an int64 offsets array of length n_cases + 1, so that the locations of case i are
+    coords[offsets[i]:offsets[i + 1]]. The channel column of nnU-Net's (n, 1 + dim) locations is dropped.
+
+    Written to preprocessed_folder/class_location_index unless output_folder is given. Returns the index folder.
+    """
+    output_folder = output_folder or os.path.join(preprocessed_folder, INDEX_FOLDER_NAME)
+    cases = sorted(i[:-4] for i in os.listdir(preprocessed_folder)
+                   if i.endswith('.npz') and i.find('segFromPrevStage') == -1)
+    classes: List[Union[int, Tuple[int, ...]]] = []
+    coords: Dict[Union[int, Tuple[int, ...]], List[np.ndarray]] = {}
+    counts: Dict[Union[int, Tuple[int, ...]], List[int]] = {}
+    dim = None
+    for n, case in enumerate(cases):
+        with open(os.path.join(preprocessed_folder, case + '.pkl'), 'rb') as f:
+            class_locations = pickle.load(f)['class_locations']
+        for c, locations in class_locations.items():
+            if c not in coords:
+                classes.append(c)
+                coords[c], counts[c] = [], [0] * n
+            locations = np.asarray(locations)
+            if len(locations) > 0:
+                dim = locations.shape[1] - 1 if dim is None else dim
+                if locations[:, 1:].max() > np.iinfo(np.uint16).max or locations.min() < 0:
+                    raise ValueError(f'class locations of {case} do not fit into uint16')
+                coords[c].append(locations[:, 1:].astype(np.uint16))
+            counts[c].append(len(locations))
+        for c in classes:
+            if c not in class_locations:
+                counts[c].append(0)
+
+    os.makedirs(output_folder, exist_ok=True)
+    dim = dim or 3
+    for k, c in enumerate(classes):
+        flat = np.concatenate(coords[c]) if coords[c] else np.zeros((0, dim), dtype=np.uint16)
+        np.save(os.path.join(output_folder, f'class_{k}_coords.npy'), flat)
+        np.save(os.path.join(output_folder, f'class_{k}_offsets.npy'), np.concatenate(([0], np.cumsum(counts[c]))))
+    with open(os.path.join(output_folder, 'index.json'), 'w') as f:
+        json.dump({'cases': cases, 'classes': [_class_key_to_json(c) for c in classes], 'dim': dim}, f)
+    return output_folder
+
+
+class ClassLocationIndex(object):
+    """
+    Read-only, memory-mapped view of an index written by build_class_location_index. The arrays are shared through
+    the page cache by all augmenter workers; pickling the index only transfers its folder, and the memory maps are
+    opened again in the receiving process.
+    """
+    def __init__(self, folder: str):
+        self.folder = folder
+        with open(os.path.join(folder, 'index.json'), 'r') as f:
+            meta = json.load(f)
+        self.cases = meta['cases']
+        self.classes = [_class_key_from_json(c) for c in meta['classes']]
+        self.dim = meta['dim']
+        self.case_to_row = {c: i for i, c in enumerate(self.cases)}
+        self._open()
+
+    def _open(self):
+        self.coords = [np.load(os.path.join(self.folder, f'class_{k}_coords.npy'), mmap_mode='r')
+                       for k in range(len(self.classes))]
+        self.offsets = [np.load(os.path.join(self.folder, f'class_{k}_offsets.npy'), mmap_mode='r')
+                        for k in range(len(self.classes))]
+
+    def __getstate__(self):
+        return {'folder': self.folder}
+
+    def __setstate__(self, state):
+        self.__init__(state['folder'])
+
+    def __contains__(self, case: str) -> bool:
+        return case in self.case_to_row
+
+    def __getitem__(self, case: str) -> Dict[Union[int, Tuple[int, ...]], np.ndarray]:
+        """
+        class_locations of a case as (n, dim) uint16 views of the memory maps, no copy.
+        """
+        row = self.case_to_row[case]
+        return {c: self.coords[k][self.offsets[k][row]:self.offsets[k][row + 1]] for k, c in enumerate(self.classes)}
+
+    def sample(self, case: str, selected_class: Union[int, Tuple[int, ...]]) -> Union[np.ndarray, None]:
+        """
+        One random location of selected_class in case (global numpy random state), or None if there is none.
+        """
+        k = self.classes.index(selected_class)
+        row = self.case_to_row[case]
+        start, end = self.offsets[k][row], self.offsets[k][row + 1]
+        if end == start:
+            return None
+        return np.asarray(self.coords[k][start + np.random.randint(end - start)])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the compact class location index of a preprocessed folder.')
+    parser.add_argument('preprocessed_folder', help='Folder with the preprocessed .npz/.pkl cases, e.g. '
+                                                    'nnUNet_preprocessed/Dataset797_TotalSegmentator_plus_TCIA/'
+                                                    'nnUNetPlans_3d_fullres')
+    parser.add_argument('-o', '--output_folder', default=None, help=f'Defaults to <folder>/{INDEX_FOLDER_NAME}')
+    args = parser.parse_args()
+    print('Index written to', build_class_location_index(args.preprocessed_folder, args.output_folder))
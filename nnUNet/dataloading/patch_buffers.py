@@ -0,0 +1,21 @@
+from typing import Sequence
+
+import numpy as np
+
+
+def crop_and_pad_into(out: np.ndarray, array: np.ndarray, bbox_lbs: Sequence[int], bbox_ubs: Sequence[int],
+                      pad_value: float) -> None:
+    """
+    Write the crop array[:, bbox_lbs:bbox_ubs] into the preallocated ``out`` (channels, *patch_size), padding the
+    parts of the bounding box that lie outside of ``array`` with ``pad_value``. Equivalent to slicing the valid part
+    of the bounding box and np.pad-ing it, without allocating the cropped or padded arrays.
+    """
+    shape = array.shape[1:]
+    valid_lbs = [max(0, lb) for lb in bbox_lbs]
+    valid_ubs = [min(s, ub) for s, ub in zip(shape, bbox_ubs)]
+    if any(lb != vlb for lb, vlb in zip(bbox_lbs, valid_lbs)) or any(ub != vub for ub, vub in zip(bbox_ubs, valid_ubs)):
+        out.fill(pad_value)
+    source = (slice(0, array.shape[0]),) + tuple(slice(lb, ub) for lb, ub in zip(valid_lbs, valid_ubs))
+    target = (slice(0, array.shape[0]),) + tuple(slice(vlb - lb, vub - lb)
+                                                 for lb, vlb, vub in zip(bbox_lbs, valid_lbs, valid_ubs))
+    out[target] = array[source]
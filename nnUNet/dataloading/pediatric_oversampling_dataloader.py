@@ -1,9 +1,18 @@
+import os
 from typing import Union, Tuple, List, Dict
 
 from batchgenerators.dataloading.data_loader import DataLoader
 import numpy as np
+import torch
+import torch.distributed as dist
 from batchgenerators.utilities.file_and_folder_operations import *
+from threadpoolctl import threadpool_limits
+from nnunetv2.training.dataloading.chunked_case_format import ChunkedCase, chunked_file
+from nnunetv2.training.dataloading.class_location_index import ClassLocationIndex
 from nnunetv2.training.dataloading.nnunet_dataset import nnUNetDataset
+from nnunetv2.training.dataloading.patch_buffers import crop_and_pad_into
+from nnunetv2.training.dataloading.pediatric_sampling import AliasSampler, GlobalBatchSampler, cohort_weights, \
+    split_cohorts
 from nnunetv2.utilities.label_handling.label_handling import LabelManager
 
 
@@ -20,8 +29,14 @@ class nnUNetDataLoaderPediatric(DataLoader):
                  probabilistic_oversampling: bool = False,
                  transforms=None,
                  class_weights: Dict[int, float] = None,
-                 pediatric_oversampling_ratio: float = 4.0):
-        super().__init__(data, batch_size, 1, None, True, False, True, sampling_probabilities)
+                 pediatric_oversampling_ratio: float = 4.0,
+                 case_weights: Dict[str, float] = None,
+                 pediatric_identifier: str = "Pediatric",
+                 class_location_index: Union[str, ClassLocationIndex] = None,
+                 global_batch_size: int = None,
+                 sampling_seed: int = 0,
+                 num_augmenter_workers: int = 1):
+        super().__init__(data, batch_size, num_augmenter_workers, None, True, False, True, sampling_probabilities)
         self.indices = list(data.keys())
 
         self.oversample_foreground_percent = oversample_foreground_percent
@@ -35,6 +50,8 @@ class nnUNetDataLoaderPediatric(DataLoader):
             self.need_to_pad += pad_sides
         self.num_channels = None
         self.pad_sides = pad_sides
+        # headers of the cases in chunked format (see chunked_case_format.py), read once per worker
+        self._chunked_cases = {}
         self.data_shape, self.seg_shape = self.determine_shapes()
         self.sampling_probabilities = sampling_probabilities
         self.annotated_classes_key = tuple(label_manager.all_labels)
@@ -44,6 +61,55 @@ class nnUNetDataLoaderPediatric(DataLoader):
         self.transforms = transforms
         self.pediatric_oversampling_ratio = pediatric_oversampling_ratio
 
+        # The cohorts and the sampling table are fixed for the lifetime of the loader. The data file names are read
+        # from the dataset's index so that no properties pickle has to be loaded
+        index = getattr(self._data, 'dataset', self._data)
+        data_files = [index[k]['data_file'] for k in self.indices]
+        self.is_pediatric = split_cohorts(data_files, pediatric_identifier)
+        per_case = None if case_weights is None else [case_weights.get(k, 1.0) for k in self.indices]
+        self.case_sampler = AliasSampler(cohort_weights(self.is_pediatric, pediatric_oversampling_ratio, per_case))
+
+        # DDP-aware sampling: with global_batch_size set, the global batch of every step is drawn once from a seed
+        # shared by all ranks and split across them as in nnUNetTrainer._set_batch_size_and_oversample, so each step
+        # has the expected pediatric share and no case is drawn twice. The augmenter worker with thread_id w draws
+        # the steps w, w + n, w + 2n, ... (n = num_augmenter_workers), so the workers of a rank do not repeat steps.
+        # The batches must be consumed in round-robin worker order (MultiThreadedAugmenter or SingleThreadedAugmenter,
+        # not NonDetMultiThreadedAugmenter), so that the i-th batch of every rank is its slice of global step i
+        self.global_sampler = None
+        self._step = 0
+        if global_batch_size is not None:
+            is_ddp = dist.is_available() and dist.is_initialized()
+            self.global_sampler = GlobalBatchSampler(self.is_pediatric, pediatric_oversampling_ratio, global_batch_size,
+                                                     dist.get_world_size() if is_ddp else 1,
+                                                     dist.get_rank() if is_ddp else 0, sampling_seed, per_case)
+            assert self.global_sampler.batch_size == batch_size, \
+                f'batch_size {batch_size} is not the share of this rank of the global batch size {global_batch_size}'
+
+        # compact class locations (see class_location_index.py). When set, the properties pickles are not loaded
+        # during training. Pickling the index only transfers its folder, every worker memory-maps it again
+        if isinstance(class_location_index, str):
+            class_location_index = ClassLocationIndex(class_location_index)
+        if class_location_index is not None:
+            missing = [k for k in self.indices if k not in class_location_index]
+            if len(missing) > 0:
+                raise ValueError(f'the class location index in {class_location_index.folder} does not cover '
+                                 f'{len(missing)} of the {len(self.indices)} cases of this loader (e.g. {missing[0]}). '
+                                 f'It is probably stale, rebuild it with class_location_index.py')
+            # a case preprocessed again after the index was built keeps its old coordinates in the index
+            index_mtime = os.path.getmtime(join(class_location_index.folder, 'index.json'))
+            for k in self.indices:
+                entry = index[k]
+                properties_file = entry['properties_file'] if 'properties_file' in entry.keys() \
+                    else entry['data_file'][:-4] + '.pkl'
+                if isfile(properties_file) and os.path.getmtime(properties_file) > index_mtime:
+                    raise ValueError(f'the class location index in {class_location_index.folder} is older than the '
+                                     f'properties of {k}, rebuild it with class_location_index.py')
+        self.class_location_index = class_location_index
+
+        # batch buffers, allocated on first use (i.e. in each augmenter worker) and reused for every batch
+        self._data_buffer = None
+        self._seg_buffer = None
+
     def _oversample_last_XX_percent(self, sample_idx: int) -> bool:
         return not sample_idx < round(self.batch_size * (1 - self.oversample_foreground_percent))
 
@@ -51,40 +117,33 @@ class nnUNetDataLoaderPediatric(DataLoader):
         return np.random.uniform() < self.oversample_foreground_percent
 
     def determine_shapes(self):
-        data, seg, properties = self._data.load_case(self.indices[0])
-        num_color_channels = data.shape[0]
+        chunked = self._get_chunked_case(self.indices[0])
+        if chunked is not None:
+            # the channel counts are in the header, no voxel is read
+            num_color_channels, num_seg_channels = chunked.shape('data')[0], chunked.shape('seg')[0]
+        else:
+            data, seg, properties = self._data.load_case(self.indices[0])
+            num_color_channels, num_seg_channels = data.shape[0], seg.shape[0]
 
         data_shape = (self.batch_size, num_color_channels, *self.patch_size)
-        seg_shape = (self.batch_size, seg.shape[0], *self.patch_size)
+        seg_shape = (self.batch_size, num_seg_channels, *self.patch_size)
         return data_shape, seg_shape
 
     def get_indices(self):
         """
-        Retrieve indices for training batches, with pediatric cases oversampled. 
-        Determines pediatric cases by checking for the substring "Pediatric" in case identifiers.
+        Retrieve indices for training batches, with pediatric cases oversampled.
+        Pediatric cases (substring "Pediatric" in their data file) are identified once at construction. Each sample
+        is drawn in constant time from an alias table where the pediatric cohort weighs
+        pediatric_oversampling_ratio times its number of cases and the adult cohort its number of cases, cases
+        within a cohort being weighted by case_weights (uniform by default).
+        With global_batch_size set, this rank's slice of the step's global batch is returned instead (see
+        GlobalBatchSampler).
         """
-        all_indices = list(self._data.keys())
-        
-        # Find pediatric and adult indices based on substring "Pediatric"
-        pediatric_indices = [
-            idx for idx in all_indices if "Pediatric" in self._data[idx]["data_file"]
-        ]
-        adult_indices = [
-            idx for idx in all_indices if "Pediatric" not in self._data[idx]["data_file"]
-        ]
-
-        # Oversample pediatric cases
-        oversampled_pediatric_indices = np.random.choice(
-            pediatric_indices,
-            size=int(len(pediatric_indices) * self.pediatric_oversampling_ratio),
-            replace=True
-        ).tolist()
-
-        # Combine and shuffle indices
-        combined_indices = oversampled_pediatric_indices + adult_indices
-        np.random.shuffle(combined_indices)
-
-        return combined_indices[:self.batch_size]
+        if self.global_sampler is not None:
+            step = self.thread_id + self._step * self.number_of_threads_in_multithreaded
+            self._step += 1
+            return [self.indices[i] for i in self.global_sampler.sample(step)]
+        return [self.indices[i] for i in self.case_sampler.sample(self.batch_size)]
 
     def get_bbox(self, data_shape: np.ndarray, force_fg: bool, class_locations: Union[dict, None],
                  overwrite_class: Union[int, Tuple[int, ...]] = None, verbose: bool = False):
@@ -131,10 +190,125 @@ class nnUNetDataLoaderPediatric(DataLoader):
 
             if voxels_of_that_class is not None and len(voxels_of_that_class) > 0:
                 selected_voxel = voxels_of_that_class[np.random.choice(len(voxels_of_that_class))]
-                bbox_lbs = [max(lbs[i], selected_voxel[i + 1] - self.patch_size[i] // 2) for i in range(dim)]
+                # nnU-Net locations carry a leading channel column, the compact index does not
+                first_axis = len(selected_voxel) - dim
+                bbox_lbs = [max(lbs[i], int(selected_voxel[i + first_axis]) - self.patch_size[i] // 2)
+                            for i in range(dim)]
             else:
                 bbox_lbs = [np.random.randint(lbs[i], ubs[i] + 1) for i in range(dim)]
 
         bbox_ubs = [bbox_lbs[i] + self.patch_size[i] for i in range(dim)]
 
-        return bbox_lbs, bbox_ubs
\ No newline at end of file
+        return bbox_lbs, bbox_ubs
+
+    def _get_class_location_index(self) -> Union[ClassLocationIndex, None]:
+        if isinstance(self.class_location_index, str):
+            self.class_location_index = ClassLocationIndex(self.class_location_index)
+        return self.class_location_index
+
+    def _get_chunked_case(self, key) -> Union[ChunkedCase, None]:
+        """
+        Reader of the chunked file of a case, or None if the case is not in chunked format or is part of a cascade.
+        """
+        if key not in self._chunked_cases:
+            entry = self._data.dataset[key]
+            path = chunked_file(entry['data_file'])
+            self._chunked_cases[key] = ChunkedCase(path) if 'seg_from_prev_stage_file' not in entry.keys() and \
+                isfile(path) else None
+        return self._chunked_cases[key]
+
+    def _load_case_arrays(self, key):
+        """
+        data and seg of a case without its properties pickle (same file lookup as nnUNetDataset.load_case), served by
+        the shared case cache when the dataset is wrapped in a CachedCaseDataset.
+        """
+        if hasattr(self._data, 'load_case_arrays'):
+            return self._data.load_case_arrays(key, self._read_case_arrays)
+        return self._read_case_arrays(key)
+
+    def _read_case_arrays(self, key):
+        entry = self._data.dataset[key]
+        if 'seg_from_prev_stage_file' in entry.keys() or 'open_data_file' in entry.keys():
+            data, seg, _ = self._data.load_case(key)
+            return data, seg
+        if isfile(entry['data_file'][:-4] + ".npy"):
+            data = np.load(entry['data_file'][:-4] + ".npy", 'r')
+            seg = np.load(entry['data_file'][:-4] + "_seg.npy", 'r')
+        else:
+            with np.load(entry['data_file']) as npz:
+                data, seg = npz['data'], npz['seg']
+        return data, seg
+
+    def generate_train_batch(self):
+        selected_keys = self.get_indices()
+        class_location_index = self._get_class_location_index()
+        if self._data_buffer is None:
+            self._data_buffer = np.zeros(self.data_shape, dtype=np.float32)
+            self._seg_buffer = np.zeros(self.seg_shape, dtype=np.int16)
+        data_all, seg_all = self._data_buffer, self._seg_buffer
+        case_properties = []
+
+        for j, i in enumerate(selected_keys):
+            # oversampling foreground will improve stability of model training, especially if many patches are empty
+            # (Lung for example)
+            force_fg = self.get_do_oversample(j)
+            chunked = self._get_chunked_case(i)
+
+            if chunked is not None:
+                # only the header is needed here, the patch is decompressed below
+                if class_location_index is not None:
+                    class_locations = class_location_index[i]
+                else:
+                    properties = self._data[i]['properties']
+                    case_properties.append(properties)
+                    class_locations = properties['class_locations']
+                shape = chunked.shape('data')[1:]
+            else:
+                if class_location_index is not None:
+                    data, seg = self._load_case_arrays(i)
+                    class_locations = class_location_index[i]
+                else:
+                    data, seg, properties = self._data.load_case(i)
+                    case_properties.append(properties)
+                    class_locations = properties['class_locations']
+                # If we are doing the cascade then the segmentation from the previous stage will already have been
+                # loaded by self._data.load_case(i) (see nnUNetDataset.load_case)
+                shape = data.shape[1:]
+            bbox_lbs, bbox_ubs = self.get_bbox(shape, force_fg, class_locations)
+
+            # crop the valid part of the bbox straight into the batch buffers and pad the rest in place (data with 0,
+            # seg with -1), instead of allocating a cropped and a padded copy per case. Chunked cases only decompress
+            # the chunks overlapping the bbox
+            if chunked is not None:
+                chunked.read_into('data', data_all[j], bbox_lbs, bbox_ubs, 0)
+                chunked.read_into('seg', seg_all[j], bbox_lbs, bbox_ubs, -1)
+            else:
+                crop_and_pad_into(data_all[j], data, bbox_lbs, bbox_ubs, 0)
+                crop_and_pad_into(seg_all[j], seg, bbox_lbs, bbox_ubs, -1)
+
+        if self.transforms is not None:
+            with torch.no_grad():
+                with threadpool_limits(limits=1, user_api=None):
+                    # the tensors share memory with the buffers; the stacked outputs are new tensors
+                    data_tensor = torch.from_numpy(data_all)
+                    seg_tensor = torch.from_numpy(seg_all)
+                    images = []
+                    segs = []
+                    for b in range(self.batch_size):
+                        tmp = self.transforms(**{'image': data_tensor[b], 'segmentation': seg_tensor[b]})
+                        images.append(tmp['image'])
+                        segs.append(tmp['segmentation'])
+                    data_out = torch.stack(images)
+                    if isinstance(segs[0], list):
+                        seg_out = [torch.stack([s[i] for s in segs]) for i in range(len(segs[0]))]
+                    else:
+                        seg_out = torch.stack(segs)
+                    del segs, images
+            return {'data': data_out, 'target': seg_out, 'keys': selected_keys}
+
+        # the buffers are overwritten by the next batch. With a class location index no properties are loaded, so the
+        # batch has none (use the keys to look them up)
+        batch = {'data': data_all.copy(), 'seg': seg_all.copy(), 'keys': selected_keys}
+        if class_location_index is None:
+            batch['properties'] = case_properties
+        return batch
@@ -0,0 +1,150 @@
+from typing import Dict, List, Sequence, Union
+
+import numpy as np
+
+
+class AliasSampler(object):
+    """
+    Vose's alias method: draws indices with probability proportional to ``weights`` in constant time per
+    sample, after an O(N) table construction.
+    """
+    def __init__(self, weights: Union[Sequence[float], np.ndarray]):
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.ndim != 1 or len(weights) == 0:
+            raise ValueError('weights must be a non-empty 1d sequence')
+        if np.any(weights < 0) or not np.all(np.isfinite(weights)) or weights.sum() <= 0:
+            raise ValueError('weights must be finite, non-negative and not all zero')
+        n = len(weights)
+        self.probabilities = weights / weights.sum()
+        scaled = self.probabilities * n
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            s, g = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = g
+            scaled[g] = scaled[g] + scaled[s] - 1
+            (small if scaled[g] < 1 else large).append(g)
+        # leftovers are 1 up to rounding errors
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def __len__(self):
+        return len(self.prob)
+
+    def sample(self, size: int, rng: np.random.Generator = None) -> np.ndarray:
+        """
+        Draw ``size`` indices with replacement. Uses the global numpy random state unless ``rng`` is given, so that
+        the seeding of the data augmentation workers applies.
+        """
+        if rng is None:
+            columns = np.random.randint(0, len(self.prob), size)
+            coins = np.random.random_sample(size)
+        else:
+            columns = rng.integers(0, len(self.prob), size)
+            coins = rng.random(size)
+        return np.where(coins < self.prob[columns], columns, self.alias[columns])
+
+
+def cohort_weights(is_pediatric: Sequence[bool], pediatric_oversampling_ratio: float,
+                   case_weights: Sequence[float] = None) -> np.ndarray:
+    """
+    Per-case sampling weights reproducing the pediatric oversampling of nnUNetDataLoaderPediatric: the pediatric
+    cohort as a whole is drawn ``pediatric_oversampling_ratio`` times more often than its share of cases (pediatric
+    mass ratio * n_pediatric, adult mass n_adult). Within each cohort, cases are drawn proportionally to
+    ``case_weights`` (uniformly if None), so arbitrary weights do not change the effective pediatric ratio.
+    """
+    is_pediatric = np.asarray(is_pediatric, dtype=bool)
+    case_weights = np.ones(len(is_pediatric)) if case_weights is None else np.asarray(case_weights, dtype=np.float64)
+    if case_weights.shape != is_pediatric.shape:
+        raise ValueError('case_weights must have one entry per case')
+    weights = np.zeros(len(is_pediatric))
+    for cohort, mass in ((is_pediatric, pediatric_oversampling_ratio * is_pediatric.sum()),
+                         (~is_pediatric, (~is_pediatric).sum())):
+        total = case_weights[cohort].sum()
+        if total > 0:
+            weights[cohort] = mass * case_weights[cohort] / total
+    return weights
+
+
+def load_case_weights(csv_file: str, id_column: str = 'image_id', weight_column: str = 'weight') -> Dict[str, float]:
+    """
+    Read per-case sampling weights from a metadata CSV (e.g. a column derived from the age in
+    resources/TotalSegmentator/meta.csv or resources/TCIA/meta.csv).
+    """
+    import pandas as pd
+    df = pd.read_csv(csv_file, usecols=[id_column, weight_column])
+    return dict(zip(df[id_column].astype(str), df[weight_column].astype(float)))
+
+
+def split_cohorts(data_files: Sequence[str], pediatric_identifier: str = 'Pediatric') -> np.ndarray:
+    """
+    Boolean mask of the pediatric cases, identified by ``pediatric_identifier`` in their data file.
+    """
+    return np.array([pediatric_identifier in f for f in data_files], dtype=bool)
+
+
+def rank_batch_sizes(global_batch_size: int, world_size: int) -> List[int]:
+    """
+    Per-rank batch sizes of a global batch, split as in nnUNetTrainer._set_batch_size_and_oversample (the first
+    ``global_batch_size % world_size`` ranks get one more sample).
+    """
+    if global_batch_size < world_size:
+        raise ValueError('the global batch size must be at least the number of ranks')
+    return [global_batch_size // world_size + (1 if i < global_batch_size % world_size else 0)
+            for i in range(world_size)]
+
+
+class GlobalBatchSampler(object):
+    """
+    Rank-aware pediatric sampling for DDP. Every rank holds the same sampler (same cases, weights and ``seed``) and
+    draws the same global batch for a given step, from which it keeps its own slice, so that no communication is
+    needed. A global batch holds floor or ceil of global_batch_size * pediatric share pediatric cases (the share
+    being that of cohort_weights, exact in expectation), and no case twice unless its cohort has fewer cases than
+    draws. Within a cohort, cases are drawn one after the other without replacement, each draw proportional to the
+    weights of the cases not drawn yet, so a case's chance to be in a batch grows with its weight but is not exactly
+    proportional to it (heavy cases are under-represented when a cohort is small compared to the draws). The batch
+    is then shuffled so that the pediatric cases are spread over the ranks.
+    """
+    def __init__(self, is_pediatric: Sequence[bool], pediatric_oversampling_ratio: float, global_batch_size: int,
+                 world_size: int = 1, rank: int = 0, seed: int = 0, case_weights: Sequence[float] = None):
+        if not 0 <= rank < world_size:
+            raise ValueError(f'rank {rank} is not in a world of size {world_size}')
+        is_pediatric = np.asarray(is_pediatric, dtype=bool)
+        weights = cohort_weights(is_pediatric, pediatric_oversampling_ratio, case_weights)
+        if weights.sum() <= 0:
+            raise ValueError('weights must not be all zero')
+        self.pediatric_share = weights[is_pediatric].sum() / weights.sum()
+        self.cohorts = []
+        for cohort in (is_pediatric, ~is_pediatric):
+            total = weights[cohort].sum()
+            self.cohorts.append((np.flatnonzero(cohort), weights[cohort] / total if total > 0 else None))
+        self.global_batch_size = global_batch_size
+        self.seed = seed
+        sizes = rank_batch_sizes(global_batch_size, world_size)
+        self.batch_size = sizes[rank]
+        self.sample_id_low = sum(sizes[:rank])
+
+    def global_batch(self, step: int) -> np.ndarray:
+        """
+        Case indices of the global batch of ``step``, identical on every rank.
+        """
+        rng = np.random.default_rng([self.seed, step])
+        expected = self.global_batch_size * self.pediatric_share
+        n_pediatric = int(expected) + int(rng.random() < expected - int(expected))
+        parts = []
+        for (indices, probabilities), n in zip(self.cohorts, (n_pediatric, self.global_batch_size - n_pediatric)):
+            if n > 0:
+                replace = n > np.count_nonzero(probabilities)
+                parts.append(rng.choice(indices, size=n, replace=replace, p=probabilities))
+        batch = np.concatenate(parts)
+        rng.shuffle(batch)
+        return batch
+
+    def sample(self, step: int) -> np.ndarray:
+        """
+        This rank's part of the global batch of ``step``.
+        """
+        return self.global_batch(step)[self.sample_id_low:self.sample_id_low + self.batch_size]
@@ -0,0 +1,270 @@
+import os
+import sys
+import time
+import weakref
+from multiprocessing import Manager, shared_memory
+from typing import Dict, Tuple, Union
+
+import numpy as np
+
+
+def _attach(name: str, create: bool = False, size: int = 0) -> shared_memory.SharedMemory:
+    """
+    Open a shared memory segment without registering it with the resource tracker. Otherwise the tracker of every
+    process touching the segment would unlink it (and warn about a leak) when that process exits, destroying entries
+    other workers still use. The lifetime of the segments is managed by SharedCaseCache instead.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    from multiprocessing import resource_tracker
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def _unlink(name: str) -> None:
+    # SharedMemory.unlink would also unregister the (untracked) segment from the resource tracker before 3.13
+    try:
+        shared_memory._posixshmem.shm_unlink('/' + name)
+    except FileNotFoundError:
+        pass
+
+
+def _unlink_segments(entries, prefix: str) -> None:
+    """
+    Unlink the segments of a cache: those listed in its entries and, where the segments are visible as files
+    (/dev/shm on Linux), every segment with its prefix. The latter also catches segments the entries no longer list,
+    e.g. because the manager process is already gone at interpreter exit.
+    """
+    names = set()
+    try:
+        names.update(e['name'] for e in entries.values())
+        entries.clear()
+    except (OSError, EOFError):
+        pass
+    if os.path.isdir('/dev/shm'):
+        names.update(n for n in os.listdir('/dev/shm') if n.startswith(prefix + '_'))
+    for name in names:
+        _unlink(name)
+
+
+class SharedCaseCache(object):
+    """
+    Cross-process cache of preprocessed cases (data and seg arrays) in shared memory, with a byte budget and least
+    recently used eviction.
+
+    Create it in the main process before the augmenter workers start: the metadata (segment name, shapes, dtypes and
+    size of every entry, the last use of every entry, the bytes in use and an eviction generation) lives in a
+    multiprocessing Manager shared by all workers. A worker that misses a case loads it as usual and publishes it
+    with put; every worker then gets views on the same shared memory with get, without copy. get does not take the
+    lock and only rescans the entries for segments to drop once the eviction generation has changed. When the budget
+    is exceeded, put evicts down to (1 - eviction_headroom) of the budget, so that not every put has to collect the
+    last uses. Evicted segments are unlinked immediately; processes still holding a view keep their mapping until
+    they drop it. Call close in the main process at the end of training to unlink the remaining segments. If the
+    creating process exits without calling close (e.g. an exception ends training), the segments are unlinked at
+    interpreter exit. A process killed by a signal cannot clean up, its segments stay in /dev/shm as
+    nnunet_cache_<pid>_* until they are removed by hand.
+
+    The budget applies to one cache, i.e. to one process tree. With DDP every rank creates its own cache, so divide
+    the memory meant for caching by the number of ranks (nnUNetTrainer does).
+    """
+    def __init__(self, budget_bytes: int, manager=None, eviction_headroom: float = 0.1):
+        self.budget_bytes = int(budget_bytes)
+        self.eviction_headroom = eviction_headroom
+        self._manager = manager if manager is not None else Manager()
+        self._entries = self._manager.dict()
+        self._last_used = self._manager.dict()
+        self._lock = self._manager.Lock()
+        self._prefix = f'nnunet_cache_{os.getpid():x}_{time.monotonic_ns():x}'
+        self._counter = self._manager.Value('i', 0)
+        self._used = self._manager.Value('q', 0)
+        self._generation = self._manager.Value('i', 0)
+        self._attached: Dict[str, shared_memory.SharedMemory] = {}
+        # evicted segments this process still maps, and the eviction generation its view of the entries is from
+        self._evicted_attached = set()
+        self._seen_generation = 0
+        # segments are not tracked by the resource tracker (see _attach), so the creating process cleans up at exit
+        self._finalizer = weakref.finalize(self, _unlink_segments, self._entries, self._prefix)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the manager process belongs to the creating process, the proxies are enough in workers. Only the creating
+        # process unlinks the segments at exit
+        state['_manager'] = None
+        state['_attached'] = {}
+        state['_evicted_attached'] = set()
+        state['_finalizer'] = None
+        return state
+
+    @property
+    def used_bytes(self) -> int:
+        return self._used.value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _views(self, entry: dict) -> Tuple[np.ndarray, ...]:
+        shm = self._attached.get(entry['name'])
+        if shm is None:
+            shm = _attach(entry['name'])
+            self._attached[entry['name']] = shm
+        arrays, offset = [], 0
+        for shape, dtype in zip(entry['shapes'], entry['dtypes']):
+            array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+            array.flags.writeable = False
+            arrays.append(array)
+            offset += array.nbytes
+        return tuple(arrays)
+
+    def _release_evicted(self) -> None:
+        """
+        Close this process's mappings of evicted segments. The entries are only scanned when something was evicted
+        since the last scan; mappings that cannot be closed yet are retried on the next call without a scan.
+        """
+        if not self._attached:
+            return
+        generation = self._generation.value
+        if generation != self._seen_generation:
+            live = {e['name'] for e in self._entries.values()}
+            self._evicted_attached.update(n for n in self._attached if n not in live)
+            self._seen_generation = generation
+        for name in list(self._evicted_attached):
+            try:
+                self._attached[name].close()
+            except BufferError:
+                # a view of the segment is still in use, try again later
+                continue
+            del self._attached[name]
+            self._evicted_attached.discard(name)
+
+    def _evict(self, target_bytes: int) -> None:
+        """
+        Evict least recently used entries until at most target_bytes are in use. To be called with the lock held.
+        """
+        used = self._used.value
+        last_used = dict(self._last_used)
+        for old_key in sorted(last_used, key=last_used.get):
+            if used <= target_bytes:
+                break
+            old = self._entries.pop(old_key, None)
+            self._last_used.pop(old_key, None)
+            if old is None:
+                # a get touched the key after its eviction
+                continue
+            _unlink(old['name'])
+            used -= old['nbytes']
+        self._used.value = used
+        self._generation.value += 1
+
+    def get(self, key: str) -> Union[Tuple[np.ndarray, ...], None]:
+        """
+        Read-only views of the cached arrays of key, or None on a miss.
+        """
+        # workers that only read must also drop their mappings of evicted segments, or the memory is never freed
+        self._release_evicted()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._last_used[key] = time.monotonic_ns()
+        try:
+            return self._views(entry)
+        except FileNotFoundError:
+            # evicted between the lookup and the attach
+            return None
+
+    def put(self, key: str, *arrays: np.ndarray) -> bool:
+        """
+        Copy arrays into a new shared memory segment for key, evicting least recently used entries to stay within
+        the budget. Returns False if the case alone exceeds the budget.
+        """
+        arrays = [np.ascontiguousarray(a) for a in arrays]
+        nbytes = sum(a.nbytes for a in arrays)
+        if nbytes > self.budget_bytes or nbytes == 0:
+            return False
+        with self._lock:
+            if key in self._entries:
+                return True
+            if self._used.value + nbytes > self.budget_bytes:
+                self._evict(min(self.budget_bytes - nbytes, int(self.budget_bytes * (1 - self.eviction_headroom))))
+
+            self._counter.value += 1
+            name = f'{self._prefix}_{self._counter.value:x}'
+            shm = _attach(name, create=True, size=nbytes)
+            offset = 0
+            for a in arrays:
+                np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf, offset=offset)[...] = a
+                offset += a.nbytes
+            self._attached[name] = shm
+            self._entries[key] = {'name': name, 'shapes': [a.shape for a in arrays],
+                                  'dtypes': [a.dtype.str for a in arrays], 'nbytes': nbytes}
+            self._last_used[key] = time.monotonic_ns()
+            self._used.value += nbytes
+        self._release_evicted()
+        return True
+
+    def close(self) -> None:
+        """
+        Unlink every cached segment. To be called once, by the process that created the cache.
+        """
+        with self._lock:
+            _unlink_segments(self._entries, self._prefix)
+            self._last_used.clear()
+            self._used.value = 0
+            self._generation.value += 1
+        if self._finalizer is not None:
+            self._finalizer.detach()
+        self._release_evicted()
+
+
+class CachedCaseDataset(object):
+    """
+    Wraps an nnUNetDataset so that load_case serves data and seg from a SharedCaseCache. Properties are still read
+    from the wrapped dataset. Everything else is delegated to the wrapped dataset, so the wrapper can replace it in
+    any nnU-Net data loader.
+    """
+    def __init__(self, dataset, cache: SharedCaseCache):
+        self.dataset_wrapped = dataset
+        self.cache = cache
+
+    def __getattr__(self, item):
+        if item in ('dataset_wrapped', 'cache'):
+            raise AttributeError(item)
+        return getattr(self.dataset_wrapped, item)
+
+    def __getitem__(self, key):
+        return self.dataset_wrapped[key]
+
+    def __len__(self):
+        return len(self.dataset_wrapped)
+
+    def __contains__(self, key):
+        return key in self.dataset_wrapped
+
+    def keys(self):
+        return self.dataset_wrapped.keys()
+
+    def load_case_arrays(self, key, load_fn=None):
+        """
+        data and seg of key from the cache, loading them with load_fn (default: the wrapped dataset's load_case) and
+        publishing them on a miss.
+        """
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        if load_fn is None:
+            data, seg, _ = self.dataset_wrapped.load_case(key)
+        else:
+            data, seg = load_fn(key)
+        self.cache.put(key, data, seg)
+        return data, seg
+
+    def load_case(self, key):
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached[0], cached[1], self.dataset_wrapped[key]['properties']
+        data, seg, properties = self.dataset_wrapped.load_case(key)
+        self.cache.put(key, data, seg)
+        return data, seg, properties
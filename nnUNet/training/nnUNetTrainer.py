@@ -50,9 +50,13 @@ from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
 from nnunetv2.inference.sliding_window_prediction import compute_gaussian
 from nnunetv2.paths import nnUNet_preprocessed, nnUNet_results
 from nnunetv2.training.data_augmentation.compute_initial_patch_size import get_patch_size
+from nnunetv2.training.dataloading.chunked_case_format import is_chunked_folder
+from nnunetv2.training.dataloading.class_location_index import INDEX_FOLDER_NAME
 from nnunetv2.training.dataloading.data_loader_2d import nnUNetDataLoader2D
 from nnunetv2.training.dataloading.data_loader_3d import nnUNetDataLoader3D
 from nnunetv2.training.dataloading.nnunet_dataset import nnUNetDataset
+from nnunetv2.training.dataloading.pediatric_oversampling_dataloader import nnUNetDataLoaderPediatric
+from nnunetv2.training.dataloading.shared_case_cache import CachedCaseDataset, SharedCaseCache
 from nnunetv2.training.dataloading.utils import get_case_identifiers, unpack_dataset
 from nnunetv2.training.logging.nnunet_logger import nnUNetLogger
 from nnunetv2.training.loss.compound_losses import DC_and_CE_loss, DC_and_BCE_loss
@@ -147,6 +151,18 @@ class nnUNetTrainer(object):
         self.initial_lr = 1e-2
         self.weight_decay = 3e-5
         self.oversample_foreground_percent = 0.33
+        # > 0 enables a cache of the training cases in shared memory, shared by all augmenter workers (total over all
+        # DDP ranks)
+        self.shared_case_cache_gb = 0
+        self.shared_case_cache = None
+        # True builds nnUNetDataLoaderPediatric (instead of nnUNetDataLoader3D) for training and validation of 3d
+        # configurations. It reads cases in chunked format (chunked_case_format.py) patch by patch, so unpacking is
+        # skipped when the preprocessed folder is chunked
+        self.use_pediatric_dataloader = False
+        self.pediatric_oversampling_ratio = 4.0
+        # the global batch of every training step is drawn from this seed on all DDP ranks and split across them
+        # (GlobalBatchSampler in pediatric_sampling.py). Must be identical on every rank
+        self.pediatric_sampling_seed = 12345
         self.num_iterations_per_epoch = 250
         self.num_val_iterations_per_epoch = 50
         self.num_epochs = 1000
@@ -617,6 +633,9 @@ class nnUNetTrainer(object):
                                     num_images_properties_loading_threshold=0)
         return dataset_tr, dataset_val
 
+    def _uses_pediatric_dataloader(self) -> bool:
+        return self.use_pediatric_dataloader and len(self.configuration_manager.patch_size) == 3
+
     def get_dataloaders(self):
         patch_size = self.configuration_manager.patch_size
         dim = len(patch_size)
@@ -650,8 +669,43 @@ class nnUNetTrainer(object):
                                                         ignore_label=self.label_manager.ignore_label)
 
         dataset_tr, dataset_val = self.get_tr_and_val_datasets()
+        if self.shared_case_cache_gb > 0:
+            # created here, before the augmenter workers are started, so that they all share it. Every DDP rank has
+            # its own cache, so shared_case_cache_gb is the total over all ranks
+            world_size = dist.get_world_size() if self.is_ddp else 1
+            self.shared_case_cache = SharedCaseCache(int(self.shared_case_cache_gb * 1024 ** 3 / world_size))
+            dataset_tr = CachedCaseDataset(dataset_tr, self.shared_case_cache)
 
-        if dim == 2:
+        allowed_num_processes = get_allowed_n_proc_DA()
+        if self._uses_pediatric_dataloader():
+            # the training loader draws each step's global batch once for all ranks (seeded by the epoch we start
+            # from, so that a continued training does not replay the first steps) and keeps this rank's slice.
+            # Validation cases are drawn uniformly (ratio 1), so that the pseudo dice is not biased towards children.
+            # The class location index of the preprocessed folder (class_location_index.py), if it was built, replaces
+            # the properties pickles for foreground sampling
+            class_location_index = join(self.preprocessed_dataset_folder, INDEX_FOLDER_NAME)
+            if not isfile(join(class_location_index, 'index.json')):
+                class_location_index = None
+            dl_tr = nnUNetDataLoaderPediatric(dataset_tr, self.batch_size,
+                                              initial_patch_size,
+                                              self.configuration_manager.patch_size,
+                                              self.label_manager,
+                                              oversample_foreground_percent=self.oversample_foreground_percent,
+                                              sampling_probabilities=None, pad_sides=None, transforms=tr_transforms,
+                                              pediatric_oversampling_ratio=self.pediatric_oversampling_ratio,
+                                              global_batch_size=self.configuration_manager.batch_size,
+                                              sampling_seed=self.pediatric_sampling_seed + self.current_epoch,
+                                              num_augmenter_workers=max(1, allowed_num_processes),
+                                              class_location_index=class_location_index)
+            dl_val = nnUNetDataLoaderPediatric(dataset_val, self.batch_size,
+                                               self.configuration_manager.patch_size,
+                                               self.configuration_manager.patch_size,
+                                               self.label_manager,
+                                               oversample_foreground_percent=self.oversample_foreground_percent,
+                                               sampling_probabilities=None, pad_sides=None, transforms=val_transforms,
+                                               pediatric_oversampling_ratio=1.0,
+                                               class_location_index=class_location_index)
+        elif dim == 2:
             dl_tr = nnUNetDataLoader2D(dataset_tr, self.batch_size,
                                        initial_patch_size,
                                        self.configuration_manager.patch_size,
@@ -678,20 +732,31 @@ class nnUNetTrainer(object):
                                         oversample_foreground_percent=self.oversample_foreground_percent,
                                         sampling_probabilities=None, pad_sides=None, transforms=val_transforms)
 
-        allowed_num_processes = get_allowed_n_proc_DA()
         if allowed_num_processes == 0:
             mt_gen_train = SingleThreadedAugmenter(dl_tr, None)
             mt_gen_val = SingleThreadedAugmenter(dl_val, None)
         else:
-            mt_gen_train = NonDetMultiThreadedAugmenter(data_loader=dl_tr, transform=None,
-                                                        num_processes=allowed_num_processes,
-                                                        num_cached=max(6, allowed_num_processes // 2), seeds=None,
-                                                        pin_memory=self.device.type == 'cuda', wait_time=0.002)
+            if self._uses_pediatric_dataloader():
+                # the deterministic augmenter returns the batches of its workers in round-robin order, so that the
+                # i-th batch of every rank is its slice of the same global step
+                mt_gen_train = MultiThreadedAugmenter(dl_tr, None, allowed_num_processes,
+                                                      num_cached_per_queue=max(2, 6 // allowed_num_processes),
+                                                      seeds=None, pin_memory=self.device.type == 'cuda',
+                                                      wait_time=0.002)
+            else:
+                mt_gen_train = NonDetMultiThreadedAugmenter(data_loader=dl_tr, transform=None,
+                                                            num_processes=allowed_num_processes,
+                                                            num_cached=max(6, allowed_num_processes // 2), seeds=None,
+                                                            pin_memory=self.device.type == 'cuda', wait_time=0.002)
             mt_gen_val = NonDetMultiThreadedAugmenter(data_loader=dl_val,
                                                       transform=None, num_processes=max(1, allowed_num_processes // 2),
                                                       num_cached=max(3, allowed_num_processes // 4), seeds=None,
                                                       pin_memory=self.device.type == 'cuda',
                                                       wait_time=0.002)
+        if getattr(dl_tr, 'global_sampler', None) is not None:
+            assert not isinstance(mt_gen_train, NonDetMultiThreadedAugmenter), \
+                'global pediatric sampling needs batches in step order (MultiThreadedAugmenter or ' \
+                'SingleThreadedAugmenter), NonDetMultiThreadedAugmenter would misalign the steps of the ranks'
         # # let's get this party started
         _ = next(mt_gen_train)
         _ = next(mt_gen_val)
@@ -913,8 +978,13 @@ class nnUNetTrainer(object):
         self.print_plans()
         empty_cache(self.device)
 
-        # maybe unpack
-        if self.unpack_dataset and self.local_rank == 0:
+        # maybe unpack. Not needed when every loader is nnUNetDataLoaderPediatric and the cases were converted to the
+        # chunked format (chunked_case_format.py): it reads them patch by patch. The stock loaders do not read chunked
+        # files and would decompress the whole .npz of every sample
+        if self.unpack_dataset and self.local_rank == 0 and self._uses_pediatric_dataloader() and \
+                is_chunked_folder(self.preprocessed_dataset_folder):
+            self.print_to_log_file('dataset is in chunked format, skipping unpacking')
+        elif self.unpack_dataset and self.local_rank == 0:
             self.print_to_log_file('unpacking dataset...')
             unpack_dataset(self.preprocessed_dataset_folder, unpack_segmentation=True, overwrite_existing=False,
                            num_processes=max(1, round(get_allowed_n_proc_DA() // 2)), verify_npy=True)
@@ -961,6 +1031,8 @@ class nnUNetTrainer(object):
                     isinstance(self.dataloader_train, (NonDetMultiThreadedAugmenter, MultiThreadedAugmenter)):
                 self.dataloader_val._finish()
             sys.stdout = old_stdout
+        if self.shared_case_cache is not None:
+            self.shared_case_cache.close()
 
         empty_cache(self.device)
         self.print_to_log_file("Training done.")
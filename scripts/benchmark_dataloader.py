@@ -0,0 +1,297 @@
+"""
+Benchmark the training data loaders: ``nnUNetDataLoaderPediatric`` against nnU-Net's ``nnUNetDataLoader3D``.
+
+A synthetic preprocessed dataset is built from the ``3d_fullres`` configuration of an
+``nnUNetPlans.json`` (patch size, batch size, median image size) and its ``dataset.json``
+(labels): blocky label maps with CT-like intensities, a share of the cases named as pediatric
+cases. The dataset is written twice, unpacked to ``.npy`` as nnU-Net training does and in the
+chunked format of ``chunked_case_format.py``, each folder with its class location index.
+
+Every loader variant draws N batches with the trainer's training transforms, in process and
+with ``NonDetMultiThreadedAugmenter`` workers, on CPU only. The script reports the throughput
+and the time per batch spent in each stage of ``generate_train_batch``: index selection, case
+load (for chunked cases ``ChunkedCase.read_into``, i.e. reading and decompressing the chunks
+covering the bbox straight into the batch buffers), crop/pad (the remainder: bbox selection,
+cropping and padding) and transforms. With workers, the stage times are measured in the workers
+and overlap in wall time.
+
+Requires nnunetv2 with the files of ``nnUNet/dataloading`` copied to
+``nnunetv2/training/dataloading``.
+
+Usage:
+    python scripts/benchmark_dataloader.py [--plans nnUNet/preprocessing/Dataset797_.../nnUNetPlans.json]
+        [--num-cases 8] [--batches 20] [--processes 0,4] [--output results.csv]
+"""
+
+import argparse
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_PLANS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "nnUNet", "preprocessing",
+                             "Dataset797_TotalSegmentator_plus_TCIA", "nnUNetPlans.json")
+CONFIGURATION = "3d_fullres"
+STAGES = ("index selection", "case load", "crop/pad", "transforms")
+VARIANTS = [
+    # (loader, dataset folder, use the class location index)
+    ("nnUNetDataLoader3D", "unpacked", False),
+    ("nnUNetDataLoaderPediatric", "unpacked", False),
+    ("nnUNetDataLoaderPediatric", "unpacked", True),
+    ("nnUNetDataLoaderPediatric", "chunked", True),
+]
+
+
+def load_plans_configuration(plans_file: str, configuration: str = CONFIGURATION) -> tuple:
+    """Plans, configuration and dataset.json (read next to the plans file) of a shipped dataset."""
+    with open(plans_file) as f:
+        plans = json.load(f)
+    with open(os.path.join(os.path.dirname(plans_file), "dataset.json")) as f:
+        dataset_json = json.load(f)
+    return plans, plans["configurations"][configuration], dataset_json
+
+
+def synthetic_case(shape: tuple, num_labels: int, rng: np.random.Generator) -> tuple:
+    """(1, *shape) float32 image and int8 segmentation with blocky organs and CT-like intensities."""
+    coarse_shape = [max(1, s // 16) + 1 for s in shape]
+    coarse = rng.integers(0, num_labels, size=coarse_shape, dtype=np.int8)
+    coarse[rng.random(coarse_shape) < 0.5] = 0
+    seg = np.kron(coarse, np.ones((16, 16, 16), dtype=np.int8))[tuple(slice(0, s) for s in shape)]
+    data = rng.normal(0, 0.2, size=shape).astype(np.float32)
+    data += (seg.astype(np.float32) - num_labels / 2) / num_labels
+    return data[None], seg[None]
+
+
+def class_locations(seg: np.ndarray, labels: list, rng: np.random.Generator, num_samples: int = 10000) -> dict:
+    """Up to num_samples random (channel, x, y, z) locations per foreground label, as in nnU-Net's properties."""
+    locations = {}
+    for label in labels:
+        coords = np.argwhere(seg == label)
+        if len(coords) > num_samples:
+            coords = coords[rng.choice(len(coords), num_samples, replace=False)]
+        locations[label] = coords
+    return locations
+
+
+def write_synthetic_dataset(folder: str, configuration: dict, dataset_json: dict, num_cases: int,
+                            pediatric_fraction: float = 0.25, seed: int = 0) -> list:
+    """Write num_cases preprocessed cases (.npz and .pkl) sized around the median image size of the configuration.
+
+    Returns
+    -------
+    list
+        Case identifiers; pediatric cases contain "Pediatric" like the cases of the PSAT datasets.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    labels = [v for v in dataset_json["labels"].values() if v > 0]
+    median_shape = np.array(configuration["median_image_size_in_voxels"])
+    patch_size = np.array(configuration["patch_size"])
+    identifiers = []
+    for i in range(num_cases):
+        identifier = f"Pediatric_{i:04d}" if i < round(num_cases * pediatric_fraction) else f"Adult_{i:04d}"
+        shape = tuple(int(s) for s in np.maximum(median_shape * rng.uniform(0.85, 1.15, 3), patch_size // 2))
+        data, seg = synthetic_case(shape, len(labels) + 1, rng)
+        np.savez_compressed(os.path.join(folder, identifier + ".npz"), data=data, seg=seg)
+        properties = {
+            "spacing": configuration["spacing"],
+            "shape_before_cropping": shape,
+            "bbox_used_for_cropping": [[0, s] for s in shape],
+            "shape_after_cropping_and_before_resampling": shape,
+            "class_locations": class_locations(seg, labels, rng),
+        }
+        with open(os.path.join(folder, identifier + ".pkl"), "wb") as f:
+            pickle.dump(properties, f)
+        identifiers.append(identifier)
+    return identifiers
+
+
+def prepare_folders(root: str, configuration: dict, dataset_json: dict, num_cases: int, processes: int) -> dict:
+    """The synthetic dataset unpacked to .npy and in chunked format, each with its class location index."""
+    from nnunetv2.training.dataloading.chunked_case_format import convert_npz_folder
+    from nnunetv2.training.dataloading.class_location_index import build_class_location_index
+    from nnunetv2.training.dataloading.utils import unpack_dataset
+
+    folders = {"unpacked": os.path.join(root, "unpacked"), "chunked": os.path.join(root, "chunked")}
+    write_synthetic_dataset(folders["unpacked"], configuration, dataset_json, num_cases)
+    os.makedirs(folders["chunked"])
+    for name in os.listdir(folders["unpacked"]):
+        shutil.copy2(os.path.join(folders["unpacked"], name), folders["chunked"])
+    unpack_dataset(folders["unpacked"], unpack_segmentation=True, overwrite_existing=False,
+                   num_processes=max(1, processes))
+    convert_npz_folder(folders["chunked"], num_processes=max(1, processes))
+    for folder in folders.values():
+        build_class_location_index(folder)
+    return folders
+
+
+def training_transforms(configuration_manager, label_manager) -> tuple:
+    """Training transforms and initial patch size, parametrized exactly as nnUNetTrainer does for this configuration."""
+    from nnunetv2.training.nnUNetTrainer.nnUNetTrainer import nnUNetTrainer
+
+    # the trainer methods only read these attributes
+    trainer = SimpleNamespace(configuration_manager=configuration_manager, enable_deep_supervision=True,
+                              print_to_log_file=lambda *args, **kwargs: None)
+    deep_supervision_scales = nnUNetTrainer._get_deep_supervision_scales(trainer)
+    rotation_for_DA, do_dummy_2d_data_aug, initial_patch_size, mirror_axes = \
+        nnUNetTrainer.configure_rotation_dummyDA_mirroring_and_inital_patch_size(trainer)
+    transforms = nnUNetTrainer.get_training_transforms(
+        configuration_manager.patch_size, rotation_for_DA, deep_supervision_scales, mirror_axes, do_dummy_2d_data_aug,
+        use_mask_for_norm=configuration_manager.use_mask_for_norm, is_cascaded=False,
+        foreground_labels=label_manager.foreground_labels,
+        regions=label_manager.foreground_regions if label_manager.has_regions else None,
+        ignore_label=label_manager.ignore_label)
+    return transforms, initial_patch_size
+
+
+def instrument(loader) -> None:
+    """Time the stages of loader.generate_train_batch; the seconds per stage are added to every batch."""
+    timings = defaultdict(float)
+
+    def timed(stage, fn):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timings[stage] += time.perf_counter() - start
+        return wrapper
+
+    loader.get_indices = timed("index selection", loader.get_indices)
+    loader._data.load_case = timed("case load", loader._data.load_case)
+    if hasattr(loader, "_load_case_arrays"):
+        loader._load_case_arrays = timed("case load", loader._load_case_arrays)
+    if hasattr(loader, "_get_chunked_case"):
+        # chunked cases are read patch by patch by the (cached) readers, time their reads as the case load
+        get_chunked_case = loader._get_chunked_case
+
+        def timed_get_chunked_case(key):
+            case = get_chunked_case(key)
+            if case is not None and not hasattr(case, "benchmark_timed"):
+                case.read_into = timed("case load", case.read_into)
+                case.benchmark_timed = True
+            return case
+
+        loader._get_chunked_case = timed_get_chunked_case
+    loader.transforms = timed("transforms", loader.transforms)
+    generate_train_batch = loader.generate_train_batch
+
+    def timed_generate_train_batch():
+        timings.clear()
+        start = time.perf_counter()
+        batch = generate_train_batch()
+        total = time.perf_counter() - start
+        batch["stage_seconds"] = {stage: timings[stage] for stage in STAGES if stage != "crop/pad"}
+        batch["stage_seconds"]["crop/pad"] = total - sum(batch["stage_seconds"].values())
+        return batch
+
+    loader.generate_train_batch = timed_generate_train_batch
+
+
+def build_loader(name: str, folder: str, use_index: bool, configuration: dict, configuration_manager, label_manager,
+                 transforms, initial_patch_size):
+    from nnunetv2.training.dataloading.data_loader_3d import nnUNetDataLoader3D
+    from nnunetv2.training.dataloading.nnunet_dataset import nnUNetDataset
+    from nnunetv2.training.dataloading.pediatric_oversampling_dataloader import nnUNetDataLoaderPediatric
+
+    dataset = nnUNetDataset(folder)
+    kwargs = dict(oversample_foreground_percent=0.33, sampling_probabilities=None, pad_sides=None,
+                  transforms=transforms)
+    if name == "nnUNetDataLoader3D":
+        return nnUNetDataLoader3D(dataset, configuration["batch_size"], initial_patch_size,
+                                  configuration_manager.patch_size, label_manager, **kwargs)
+    index = os.path.join(folder, "class_location_index") if use_index else None
+    return nnUNetDataLoaderPediatric(dataset, configuration["batch_size"], initial_patch_size,
+                                     configuration_manager.patch_size, label_manager, class_location_index=index,
+                                     **kwargs)
+
+
+def time_batches(loader, num_batches: int, processes: int) -> tuple:
+    """Wall time of num_batches batches after a warm-up batch, and the mean seconds per batch of every stage."""
+    from batchgenerators.dataloading.nondet_multi_threaded_augmenter import NonDetMultiThreadedAugmenter
+
+    if processes == 0:
+        generator, augmenter = loader, None
+    else:
+        augmenter = NonDetMultiThreadedAugmenter(data_loader=loader, transform=None, num_processes=processes,
+                                                 num_cached=max(6, processes // 2), seeds=None, pin_memory=False,
+                                                 wait_time=0.002)
+        generator = augmenter
+    try:
+        next(generator)
+        stage_seconds = defaultdict(float)
+        start = time.perf_counter()
+        for _ in range(num_batches):
+            batch = next(generator)
+            for stage, seconds in batch["stage_seconds"].items():
+                stage_seconds[stage] += seconds
+        elapsed = time.perf_counter() - start
+    finally:
+        if augmenter is not None:
+            augmenter._finish()
+    return elapsed, {stage: stage_seconds[stage] / num_batches for stage in STAGES}
+
+
+def run_benchmark(plans_file: str, num_cases: int = 8, num_batches: int = 20, processes: list = (0, 4),
+                  work_dir: str = None) -> pd.DataFrame:
+    """Time every loader variant in every process setting and return one row per (variant, processes)."""
+    from nnunetv2.utilities.plans_handling.plans_handler import PlansManager
+
+    plans, configuration, dataset_json = load_plans_configuration(plans_file)
+    plans_manager = PlansManager(plans)
+    configuration_manager = plans_manager.get_configuration(CONFIGURATION)
+    label_manager = plans_manager.get_label_manager(dataset_json)
+    transforms, initial_patch_size = training_transforms(configuration_manager, label_manager)
+
+    rows = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        folders = prepare_folders(tmp_dir, configuration, dataset_json, num_cases, max(processes))
+        for name, folder, use_index in VARIANTS:
+            for n in processes:
+                loader = build_loader(name, folders[folder], use_index, configuration, configuration_manager,
+                                      label_manager, transforms, initial_patch_size)
+                instrument(loader)
+                elapsed, stage_seconds = time_batches(loader, num_batches, n)
+                row = {
+                    "loader": name,
+                    "data": folder,
+                    "class_index": use_index,
+                    "processes": n,
+                    "batches": num_batches,
+                    "seconds": round(elapsed, 3),
+                    "batches_per_s": round(num_batches / elapsed, 3),
+                }
+                row.update({f"{stage}_ms": round(1000 * stage_seconds[stage], 1) for stage in STAGES})
+                rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def main() -> None:
+    # CPU only, whatever the machine
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    parser = argparse.ArgumentParser(description="Benchmark nnUNetDataLoaderPediatric against nnUNetDataLoader3D.")
+    parser.add_argument("--plans", default=DEFAULT_PLANS, help="nnUNetPlans.json with a 3d_fullres configuration.")
+    parser.add_argument("--num-cases", type=int, default=8, help="Number of synthetic cases.")
+    parser.add_argument("--batches", type=int, default=20, help="Batches timed per run, after one warm-up batch.")
+    parser.add_argument("--processes", default="0,4",
+                        help="Comma-separated numbers of augmenter workers (0: in the main process).")
+    parser.add_argument("--work-dir", default=None, help="Where to write the synthetic dataset (default: tmp).")
+    parser.add_argument("--output", help="Optional CSV file receiving the results.")
+    args = parser.parse_args()
+
+    df = run_benchmark(args.plans, args.num_cases, args.batches, [int(p) for p in args.processes.split(",")],
+                       args.work_dir)
+    print(df.to_string(index=False))
+    if args.output:
+        df.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
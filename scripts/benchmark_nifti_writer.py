@@ -0,0 +1,92 @@
+"""
+Benchmark NIfTI write throughput against file size for the writer settings of ``nifti_writer.py``.
+
+Synthetic label maps of increasing size are written with ``nib.save`` (reference) and with
+``save_nifti`` at several compression levels and thread counts. For every run the script
+reports the write time, the throughput in uncompressed MB/s and the compression ratio.
+
+Usage:
+    python scripts/benchmark_nifti_writer.py [--sizes 128,256,512] [--repeats 3] [--output results.csv]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+
+try:
+    from scripts.nifti_writer import save_nifti
+except ImportError:  # executed as a script from the scripts folder
+    from nifti_writer import save_nifti
+
+SETTINGS = [
+    # (name, file suffix, compression level, threads); level None means nib.save
+    ("nib.save", ".nii.gz", None, 1),
+    ("gzip-1", ".nii.gz", 1, 1),
+    ("gzip-1 x4 threads", ".nii.gz", 1, 4),
+    ("gzip-6", ".nii.gz", 6, 1),
+    ("gzip-6 x4 threads", ".nii.gz", 6, 4),
+    ("gzip-0 (stored)", ".nii.gz", 0, 1),
+    ("raw .nii", ".nii", 0, 1),
+]
+
+
+def synthetic_label_map(size: int, seed: int = 0) -> nib.Nifti1Image:
+    """Blocky 13-label volume of shape (size, size, size // 2), compressible like real label maps."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 14, size=(size // 8, size // 8, max(1, size // 16)), dtype=np.uint8)
+    data = np.kron(coarse, np.ones((8, 8, 8), dtype=np.uint8))[:, :, : size // 2]
+    data[rng.random(data.shape) < 0.2] = 0
+    img = nib.Nifti1Image(data, np.diag([1.0, 1.0, 2.0, 1.0]))
+    img.set_data_dtype(np.uint8)
+    return img
+
+
+def run_benchmark(sizes: list, repeats: int = 3) -> pd.DataFrame:
+    """Time every writer setting on every volume size and return one row per (size, setting)."""
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            img = synthetic_label_map(size)
+            raw_mb = img.dataobj.nbytes / 1e6
+            for name, suffix, level, threads in SETTINGS:
+                path = os.path.join(tmp_dir, f"bench{suffix}")
+                times = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    if name == "nib.save":
+                        nib.save(img, path)
+                    else:
+                        save_nifti(img, path, compression_level=level, threads=threads, label_map=True)
+                    times.append(time.perf_counter() - start)
+                seconds = min(times)
+                rows.append({
+                    "shape": "x".join(map(str, img.shape)),
+                    "raw_MB": round(raw_mb, 2),
+                    "setting": name,
+                    "seconds": round(seconds, 4),
+                    "MB_per_s": round(raw_mb / seconds, 1),
+                    "compression_ratio": round(img.dataobj.nbytes / os.path.getsize(path), 2),
+                })
+    return pd.DataFrame(rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark NIfTI label map write throughput.")
+    parser.add_argument("--sizes", default="128,256,512", help="Comma-separated in-plane volume sizes.")
+    parser.add_argument("--repeats", type=int, default=3, help="Repetitions per setting (best time is kept).")
+    parser.add_argument("--output", help="Optional CSV file receiving the results.")
+    args = parser.parse_args()
+
+    df = run_benchmark([int(s) for s in args.sizes.split(",")], repeats=args.repeats)
+    print(df.to_string(index=False))
+    if args.output:
+        df.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
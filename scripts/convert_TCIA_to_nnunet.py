@@ -0,0 +1,236 @@
+"""
+Convert the TCIA Pediatric-CT-SEG download into the nnU-Net raw dataset format (Dataset500_TCIA).
+
+The cases are described by ``resources/TCIA/meta.csv``: every subject has one CT and one
+RTSTRUCT row, whose ``File Location`` is relative to the TCIA download folder, and a ``split``
+column (``train``/``val`` cases go to ``imagesTr``/``labelsTr``, ``test`` cases to
+``imagesTs``/``labelsTs``).
+
+- Cases are converted in parallel by a process pool; each worker reads one CT series, rasterizes
+  its RTSTRUCT into the PSAT labels (see ``rtstruct_to_labelmap.py``) and writes
+  ``<case>_0000.nii.gz`` and ``<case>.nii.gz`` before moving on, so only the cases in flight
+  are held in memory.
+- A manifest (``.conversion_manifest.json`` in the dataset folder) records the status, timing,
+  split and input fingerprint of every case; reruns skip cases converted from unchanged DICOM
+  files.
+- ``dataset.json`` and a single-fold ``splits_final.json`` (``train``/``val`` columns) are
+  written at the end.
+
+Usage:
+    python scripts/convert_TCIA_to_nnunet.py <tcia_root> <output_dataset_dir>
+        [--meta resources/TCIA/meta.csv] [--workers N] [--force]
+
+Dependencies:
+    - pydicom
+    - nibabel
+    - numpy
+    - pandas
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+
+try:
+    from scripts.convert_icans import MANIFEST_NAME, input_fingerprint, load_manifest, save_manifest
+    from scripts.nifti_writer import save_nifti
+    from scripts.rtstruct_to_labelmap import PSAT_LABELS, ct_geometry, rasterize_rtstruct
+except ImportError:  # executed as a script from the scripts folder
+    from convert_icans import MANIFEST_NAME, input_fingerprint, load_manifest, save_manifest
+    from nifti_writer import save_nifti
+    from rtstruct_to_labelmap import PSAT_LABELS, ct_geometry, rasterize_rtstruct
+
+SPLIT_SUBSETS = {"train": "Tr", "val": "Tr", "test": "Ts"}
+
+DATASET_JSON = {
+    "name": "Pediatric_CT",
+    "description": "Segmentation of pediatric CT organs",
+    "reference": "TCIA",
+    "licence": "CC BY 4.0",
+    "release": "2.0",
+    "channel_names": {"0": "CT"},
+    "labels": {"background": 0, **PSAT_LABELS},
+    "file_ending": ".nii.gz",
+    "overwrite_image_reader_writer": "NibabelIOWithReorient",
+}
+
+
+def load_cases(meta_csv: str) -> list:
+    """Pair the CT and RTSTRUCT rows of ``meta.csv`` into one case per subject.
+
+    Returns
+    -------
+    list
+        Dicts with ``case_id`` (the TCIA Subject ID), ``split``, ``ct`` and ``rtstruct`` (the
+        ``File Location`` of each series).
+    """
+    meta = pd.read_csv(meta_csv)
+    cases = []
+    for subject_id, rows in meta.groupby("Subject ID", sort=True):
+        locations = dict(zip(rows["Modality"], rows["File Location"]))
+        if "CT" not in locations or "RTSTRUCT" not in locations:
+            logging.warning(f"Skipping {subject_id}: CT or RTSTRUCT series missing from {meta_csv}")
+            continue
+        split = rows["split"].iloc[0]
+        if split not in SPLIT_SUBSETS:
+            raise ValueError(f"Unknown split '{split}' for {subject_id}")
+        cases.append({"case_id": subject_id, "split": split, "ct": locations["CT"], "rtstruct": locations["RTSTRUCT"]})
+    return cases
+
+
+def case_paths(case: dict, tcia_root: Path, output_dir: Path) -> dict:
+    """Input series folders and output files of a case."""
+    subset = SPLIT_SUBSETS[case["split"]]
+    return {
+        "ct": Path(tcia_root) / case["ct"],
+        "rtstruct": Path(tcia_root) / case["rtstruct"],
+        "image": Path(output_dir) / f"images{subset}" / f"{case['case_id']}_0000.nii.gz",
+        "label": Path(output_dir) / f"labels{subset}" / f"{case['case_id']}.nii.gz",
+    }
+
+
+def case_fingerprint(paths: dict) -> list:
+    """Fingerprints of the CT and RTSTRUCT series folders (see ``convert_icans.input_fingerprint``)."""
+    return input_fingerprint(paths["ct"]) + input_fingerprint(paths["rtstruct"])
+
+
+def read_ct_volume(ct_dir: Path) -> tuple:
+    """Read a CT series into a (column, row, slice) int16 volume in Hounsfield units.
+
+    Returns
+    -------
+    tuple
+        The volume and the sorted slice datasets.
+    """
+    import pydicom
+
+    datasets = [pydicom.dcmread(str(p)) for p in sorted(Path(ct_dir).glob("*.dcm"))]
+    if not datasets:
+        raise FileNotFoundError(f"No CT DICOM files in {ct_dir}")
+    datasets, _ = ct_geometry(datasets)
+    volume = np.empty((int(datasets[0].Columns), int(datasets[0].Rows), len(datasets)), dtype=np.int16)
+    for k, ds in enumerate(datasets):
+        slope, intercept = float(getattr(ds, "RescaleSlope", 1)), float(getattr(ds, "RescaleIntercept", 0))
+        volume[:, :, k] = np.round(ds.pixel_array.T * slope + intercept)
+    return volume, datasets
+
+
+def convert_case(case: dict, tcia_root: str, output_dir: str, compression_level: int = 1) -> dict:
+    """Convert one case and write its image and label map.
+
+    Returns
+    -------
+    dict
+        Manifest entry with ``status``, ``seconds``, ``error``, ``split``, ``input_fingerprint``
+        and the ``skipped`` structures without PSAT label.
+    """
+    import pydicom
+
+    start = time.perf_counter()
+    paths = case_paths(case, tcia_root, output_dir)
+    entry = {"split": case["split"], "input_fingerprint": case_fingerprint(paths), "error": None, "skipped": []}
+    try:
+        volume, datasets = read_ct_volume(paths["ct"])
+        rtstructs = sorted(paths["rtstruct"].glob("*.dcm"))
+        if not rtstructs:
+            raise FileNotFoundError(f"No RTSTRUCT DICOM file in {paths['rtstruct']}")
+        labels, affine, entry["skipped"] = rasterize_rtstruct(pydicom.dcmread(str(rtstructs[0])), datasets)
+        del datasets
+
+        # Remove the outputs of a previous conversion under another split
+        for subset in set(SPLIT_SUBSETS.values()) - {SPLIT_SUBSETS[case["split"]]}:
+            for stale in (f"images{subset}/{case['case_id']}_0000.nii.gz", f"labels{subset}/{case['case_id']}.nii.gz"):
+                Path(output_dir, stale).unlink(missing_ok=True)
+        save_nifti(nib.Nifti1Image(volume, affine), str(paths["image"]), compression_level=compression_level)
+        save_nifti(nib.Nifti1Image(labels, affine), str(paths["label"]), compression_level=compression_level,
+                   label_map=True)
+        entry["status"] = "done"
+    except Exception as e:
+        entry["status"] = "failed"
+        entry["error"] = f"{type(e).__name__}: {e}"
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def is_converted(entry: dict, case: dict, paths: dict) -> bool:
+    """Whether the manifest entry describes an up-to-date conversion of ``case``."""
+    return (entry is not None and entry["status"] == "done" and entry["split"] == case["split"]
+            and entry["input_fingerprint"] == case_fingerprint(paths)
+            and paths["image"].exists() and paths["label"].exists())
+
+
+def write_dataset_files(cases: list, output_dir: Path) -> None:
+    """Write ``dataset.json`` and the single-fold ``splits_final.json`` of the converted cases."""
+    dataset = dict(DATASET_JSON, numTraining=sum(SPLIT_SUBSETS[c["split"]] == "Tr" for c in cases))
+    (output_dir / "dataset.json").write_text(json.dumps(dataset, indent=4))
+    splits = [{"train": [c["case_id"] for c in cases if c["split"] == "train"],
+               "val": [c["case_id"] for c in cases if c["split"] == "val"]}]
+    (output_dir / "splits_final.json").write_text(json.dumps(splits, indent=4))
+
+
+def convert_dataset(meta_csv: str, tcia_root: str, output_dir: str, workers: int = None, force: bool = False,
+                    compression_level: int = 1) -> dict:
+    """Convert every case of ``meta_csv`` that is not already converted.
+
+    Returns
+    -------
+    dict
+        The updated manifest, keyed by case identifier.
+    """
+    output_dir = Path(output_dir)
+    for subset in ("imagesTr", "labelsTr", "imagesTs", "labelsTs"):
+        (output_dir / subset).mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+
+    cases = load_cases(meta_csv)
+    pending = [c for c in cases
+               if force or not is_converted(manifest.get(c["case_id"]), c, case_paths(c, tcia_root, output_dir))]
+    logging.info(f"{len(pending)} of {len(cases)} cases to convert")
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {executor.submit(convert_case, case, tcia_root, str(output_dir), compression_level): case["case_id"]
+                   for case in pending}
+        for future in as_completed(futures):
+            case_id = futures[future]
+            manifest[case_id] = entry = future.result()
+            save_manifest(manifest, manifest_path)
+            if entry["status"] == "done":
+                logging.info(f"{case_id}: converted in {entry['seconds']:.1f}s")
+            else:
+                logging.error(f"{case_id}: failed after {entry['seconds']:.1f}s: {entry['error']}")
+
+    write_dataset_files(cases, output_dir)
+    return manifest
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Convert the TCIA pediatric dataset to the nnU-Net format.")
+    parser.add_argument("tcia_root", help="TCIA download folder (the 'File Location' paths are relative to it).")
+    parser.add_argument("output_dir", nargs="?", default="nnUNet_raw/Dataset500_TCIA", help="nnU-Net dataset folder.")
+    parser.add_argument("--meta", default="resources/TCIA/meta.csv", help="TCIA metadata CSV with the split column.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of cases converted in parallel.")
+    parser.add_argument("--force", action="store_true", help="Convert already converted cases again.")
+    parser.add_argument("--compression-level", type=int, default=1, help="gzip level of the output files.")
+    args = parser.parse_args()
+
+    manifest = convert_dataset(args.meta, args.tcia_root, args.output_dir, args.workers, args.force,
+                               args.compression_level)
+    failed = sorted(c for c, e in manifest.items() if e["status"] != "done")
+    if failed:
+        logging.error(f"{len(failed)} cases failed: {', '.join(failed)}")
+        raise SystemExit(1)
+    logging.info("Conversion completed!")
+
+
+if __name__ == "__main__":
+    main()
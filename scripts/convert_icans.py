@@ -0,0 +1,247 @@
+"""
+Parallel, resumable conversion of the ICANS pediatric DICOM archive to the TotalSegmentator layout.
+
+Python driver replacing the sequential loop of ``convert_ICANS.sh``. For every patient folder
+containing ``CT/*.dcm`` and ``RTSTRUCT/*.dcm``, the CT series is converted with ``dcm2niix``
+to ``ct.nii.gz`` and the structures with ``dcmrtstruct2nii`` to ``segmentations/<name>.nii.gz``.
+
+- Patients are converted in parallel by a process pool.
+- A completion manifest (``.conversion_manifest.json`` in the output folder) records the
+  status, timing and error of every patient; reruns skip patients already converted from
+  unchanged inputs.
+- Each patient is converted into a staging folder that is renamed into place once complete,
+  so an output folder is either missing or complete.
+
+With ``--single-labelmap`` the RTSTRUCT is rasterized directly into one PSAT label volume,
+``segmentations/psat_labels.nii.gz`` (see ``rtstruct_to_labelmap.py``), instead of one mask
+per structure.
+
+With ``--index dicom_index.csv`` the archive is described by the persistent header index of
+``dicom_index.py``: only new or modified files are parsed, and the change detection, the
+RTSTRUCT lookup and the CT geometry of ``--single-labelmap`` come from the index instead of
+rescanning the patient folders.
+
+Usage:
+    python scripts/convert_icans.py <input_dir> <output_dir> [--workers N] [--force] [--single-labelmap]
+        [--index dicom_index.csv]
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+
+try:
+    from scripts.dicom_index import files_under, headers_from_index, series_files, update_index
+    from scripts.rtstruct_to_labelmap import rtstruct_to_labelmap_dir
+except ImportError:  # executed as a script from the scripts folder
+    from dicom_index import files_under, headers_from_index, series_files, update_index
+    from rtstruct_to_labelmap import rtstruct_to_labelmap_dir
+
+MANIFEST_NAME = ".conversion_manifest.json"
+
+
+def run_dcm2niix(ct_dir: Path, output_dir: Path) -> None:
+    """Convert a CT series to ``output_dir/ct.nii.gz`` with dcm2niix."""
+    subprocess.run(["dcm2niix", "-z", "y", "-f", "ct", "-o", str(output_dir), str(ct_dir)],
+                   check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    # Rename to ct.nii.gz if it's not already named so
+    if (output_dir / "ct_0000.nii.gz").exists():
+        os.replace(output_dir / "ct_0000.nii.gz", output_dir / "ct.nii.gz")
+
+
+def run_dcmrtstruct2nii(rtstruct_file: Path, ct_dir: Path, output_dir: Path, ct_headers: list = None) -> None:
+    """Convert the structures of an RTSTRUCT to ``output_dir/<structure>.nii.gz`` with dcmrtstruct2nii.
+
+    ``ct_headers`` is part of the RTSTRUCT converter interface and unused: dcmrtstruct2nii reads ``ct_dir``.
+    """
+    subprocess.run(["dcmrtstruct2nii", "convert", "-r", str(rtstruct_file), "-d", str(ct_dir),
+                    "-o", str(output_dir)],
+                   check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    # Rename files to match TotalSegmentator format: drop everything up to the first "-"
+    for seg_file in output_dir.glob("*.nii.gz"):
+        name = seg_file.name[: -len(".nii.gz")]
+        structure_name = name.split("-", 1)[1] if "-" in name else name
+        if structure_name != name:
+            os.replace(seg_file, output_dir / f"{structure_name}.nii.gz")
+
+
+def input_fingerprint(patient_dir: Path) -> list:
+    """Number of files, total size and latest mtime of the patient's DICOM files."""
+    stats = [p.stat() for p in patient_dir.rglob("*.dcm")]
+    return [len(stats), sum(s.st_size for s in stats), max((s.st_mtime_ns for s in stats), default=0)]
+
+
+def index_fingerprint(rows: pd.DataFrame) -> list:
+    """Same fingerprint as ``input_fingerprint``, computed from the DICOM index rows of a patient."""
+    return [len(rows), int(rows["size"].sum()), int(rows["mtime_ns"].max()) if len(rows) else 0]
+
+
+def convert_patient(patient_dir: Path, output_dir: Path,
+                    ct_converter: Callable = run_dcm2niix,
+                    rtstruct_converter: Callable = run_dcmrtstruct2nii,
+                    patient_index: pd.DataFrame = None) -> dict:
+    """Convert one patient into ``output_dir/<patient>`` through an atomically renamed staging folder.
+
+    Converters are called as ``ct_converter(ct_dir, output_dir)`` and
+    ``rtstruct_converter(rtstruct_file, ct_dir, output_dir, ct_headers=...)``. ``patient_index``
+    holds the patient's rows of the DICOM index; when given, the patient folder is not rescanned
+    and ``ct_headers`` carries the CT geometry (``None`` otherwise).
+
+    Returns
+    -------
+    dict
+        Manifest entry with ``status``, ``seconds``, ``error`` and ``input_fingerprint``.
+    """
+    patient_dir, output_dir = Path(patient_dir), Path(output_dir)
+    start = time.perf_counter()
+    final_dir = output_dir / patient_dir.name
+    staging_dir = output_dir / f".staging_{patient_dir.name}"
+    fingerprint = input_fingerprint(patient_dir) if patient_index is None else index_fingerprint(patient_index)
+    entry = {"input_fingerprint": fingerprint, "error": None, "rtstruct": False}
+    try:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        (staging_dir / "segmentations").mkdir(parents=True)
+
+        ct_dir = patient_dir / "CT"
+        ct_headers = None
+        if patient_index is None:
+            has_ct = any(ct_dir.glob("*.dcm"))
+            rtstructs = sorted((patient_dir / "RTSTRUCT").glob("*.dcm"))
+        else:
+            ct_rows = files_under(patient_index, ct_dir, "CT")
+            has_ct = len(ct_rows) > 0
+            rtstructs = sorted(Path(p) for p in files_under(patient_index, patient_dir / "RTSTRUCT", "RTSTRUCT")["path"])
+            if has_ct:
+                series_uid = ct_rows["SeriesInstanceUID"].mode()[0]
+                ordered = ct_rows.set_index("path").loc[series_files(ct_rows, series_uid)].reset_index()
+                ct_headers = headers_from_index(ordered)
+        if not has_ct:
+            raise FileNotFoundError(f"No CT DICOM files in {ct_dir}")
+        ct_converter(ct_dir, staging_dir)
+
+        if rtstructs:
+            rtstruct_converter(rtstructs[0], ct_dir, staging_dir / "segmentations", ct_headers=ct_headers)
+            entry["rtstruct"] = True
+        else:
+            logging.warning(f"No RTSTRUCT file found for patient: {patient_dir.name}")
+
+        # Swap the complete staging folder into place
+        if final_dir.exists():
+            old_dir = output_dir / f".old_{patient_dir.name}"
+            shutil.rmtree(old_dir, ignore_errors=True)
+            os.replace(final_dir, old_dir)
+            os.replace(staging_dir, final_dir)
+            shutil.rmtree(old_dir)
+        else:
+            os.replace(staging_dir, final_dir)
+        entry["status"] = "done"
+    except Exception as e:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        stderr = getattr(e, "stderr", None)
+        entry["status"] = "failed"
+        entry["error"] = f"{type(e).__name__}: {e}" + (f"\n{stderr.strip()[-2000:]}" if stderr else "")
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def load_manifest(path: Path) -> dict:
+    """Load the completion manifest, or start an empty one."""
+    if path.exists():
+        try:
+            return json.loads(path.read_text())
+        except ValueError as e:
+            logging.warning(f"Ignoring unreadable manifest {path}: {e}")
+    return {}
+
+
+def save_manifest(manifest: dict, path: Path) -> None:
+    """Atomically write the completion manifest."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=1, sort_keys=True))
+    os.replace(tmp_path, path)
+
+
+def convert_all(input_dir: str, output_dir: str, workers: int = None, force: bool = False,
+                ct_converter: Callable = run_dcm2niix,
+                rtstruct_converter: Callable = run_dcmrtstruct2nii, index_path: str = None) -> dict:
+    """Convert every patient folder of ``input_dir`` that is not already converted.
+
+    With ``index_path``, the persistent DICOM header index is updated first and used for the
+    change detection and by ``convert_patient`` instead of rescanning the patient folders.
+
+    Returns
+    -------
+    dict
+        The updated manifest, keyed by patient name.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+
+    index = update_index(input_dir, index_path, workers=max(workers or os.cpu_count(), 8)) if index_path else None
+
+    pending = []
+    for patient_dir in sorted(p for p in Path(input_dir).iterdir() if p.is_dir()):
+        patient_index = None if index is None else files_under(index, patient_dir)
+        fingerprint = input_fingerprint(patient_dir) if index is None else index_fingerprint(patient_index)
+        entry = manifest.get(patient_dir.name)
+        if (not force and entry is not None and entry["status"] == "done"
+                and entry["input_fingerprint"] == fingerprint
+                and (output_dir / patient_dir.name).exists()):
+            continue
+        pending.append((patient_dir, patient_index))
+
+    logging.info(f"{len(pending)} patients to convert")
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {
+            executor.submit(convert_patient, patient_dir, output_dir, ct_converter, rtstruct_converter,
+                            patient_index): patient_dir.name
+            for patient_dir, patient_index in pending
+        }
+        for future in as_completed(futures):
+            patient = futures[future]
+            manifest[patient] = future.result()
+            save_manifest(manifest, manifest_path)
+            entry = manifest[patient]
+            if entry["status"] == "done":
+                logging.info(f"{patient}: converted in {entry['seconds']:.1f}s")
+            else:
+                logging.error(f"{patient}: failed after {entry['seconds']:.1f}s: {entry['error']}")
+    return manifest
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Convert the ICANS DICOM archive to the TotalSegmentator layout.")
+    parser.add_argument("input_dir", nargs="?", default="ICANS_Pediatric", help="Folder of patient folders.")
+    parser.add_argument("output_dir", nargs="?", default="ICANS_TotalSegmentatorFormat", help="Output folder.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of patients converted in parallel.")
+    parser.add_argument("--force", action="store_true", help="Convert already converted patients again.")
+    parser.add_argument("--single-labelmap", action="store_true",
+                        help="Rasterize the RTSTRUCT into one PSAT label volume instead of one mask per structure.")
+    parser.add_argument("--index", default=None,
+                        help="Persistent DICOM header index (CSV, see dicom_index.py) used instead of rescanning.")
+    args = parser.parse_args()
+
+    rtstruct_converter = rtstruct_to_labelmap_dir if args.single_labelmap else run_dcmrtstruct2nii
+    manifest = convert_all(args.input_dir, args.output_dir, args.workers, args.force,
+                           rtstruct_converter=rtstruct_converter, index_path=args.index)
+    failed = sorted(p for p, e in manifest.items() if e["status"] != "done")
+    if failed:
+        logging.error(f"{len(failed)} patients failed: {', '.join(failed)}")
+        raise SystemExit(1)
+    logging.info("Conversion completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,22 @@
+import argparse
+import errno
+import hashlib
+import json
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import shutil
 import pandas as pd
 import matplotlib.pyplot as plt
-from typing import List
+from typing import Dict, List, Optional, Set
+
+LINK_MODES = ["copy", "hardlink", "symlink", "reflink"]
+
+# ioctl request cloning a whole file on copy-on-write filesystems (btrfs, XFS, ...), from linux/fs.h
+FICLONE = 0x40049409
+
+MANIFEST_NAME = ".materialization_manifest.json"
 
 def plot_and_save_distribution(df: pd.DataFrame, title: str, filename: str) -> None:
     """Plot age and gender distribution and save to file.
@@ -33,24 +46,198 @@ def create_directory_structure(base_path: Path, subdirs: List[str]) -> None:
     for subdir in subdirs:
         (base_path / subdir).mkdir(parents=True, exist_ok=True)
 
-def copy_selected_files(
-    original_base: Path, new_base: Path, subdirs: List[str], selected_image_ids: List[str]
-) -> None:
-    """Copy files matching selected image IDs from the original dataset to the new dataset."""
+def build_prefix_index(image_ids: List[str]) -> Dict[int, Set[str]]:
+    """Group image IDs by length so that a file name is matched with one set lookup per length."""
+    index: Dict[int, Set[str]] = {}
+    for image_id in image_ids:
+        index.setdefault(len(image_id), set()).add(image_id)
+    return index
+
+def match_image_id(file_name: str, prefix_index: Dict[int, Set[str]]) -> Optional[str]:
+    """Return the image ID that ``file_name`` starts with, or None."""
+    for length, ids in prefix_index.items():
+        if file_name[:length] in ids:
+            return file_name[:length]
+    return None
+
+def reflink(src: Path, dst: Path) -> None:
+    """Clone ``src`` into ``dst`` sharing its data blocks (copy-on-write filesystems only).
+
+    Raises ``OSError`` (EOPNOTSUPP) where ``fcntl`` is not available, so that callers fall back to copying.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform")
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            dst.unlink()
+            raise
+
+def materialize_file(src: Path, dst: Path, mode: str = "copy") -> None:
+    """Make ``src`` available at ``dst`` by copy, hard link, symbolic link or reflink.
+
+    Hard links and reflinks fall back to a copy when the filesystem does not support them
+    (e.g. across devices).
+    """
+    if dst.is_symlink() or dst.exists():
+        dst.unlink()
+    if mode == "symlink":
+        os.symlink(src.resolve(), dst)
+        return
+    try:
+        if mode == "hardlink":
+            os.link(src, dst)
+            return
+        if mode == "reflink":
+            reflink(src, dst)
+            return
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EPERM):
+            raise
+        logging.warning(f"Cannot {mode} {src} ({e.strerror}), copying instead")
+    shutil.copy(src, dst)
+
+def select_files(original_base: Path, subdirs: List[str], selected_image_ids: List[str]) -> List[Path]:
+    """Files of ``subdirs`` whose name starts with one of the selected image IDs."""
+    prefix_index = build_prefix_index(selected_image_ids)
+    selected = []
     for subdir in subdirs:
         original_dir = original_base / subdir
-        new_dir = new_base / subdir
-
         if not original_dir.exists():
             logging.warning(f"Directory {original_dir} does not exist. Skipping...")
             continue
+        selected.extend(f for f in sorted(original_dir.iterdir()) if match_image_id(f.name, prefix_index) is not None)
+    return selected
+
+def copy_selected_files(
+    original_base: Path, new_base: Path, subdirs: List[str], selected_image_ids: List[str], mode: str = "copy"
+) -> int:
+    """Materialize files matching selected image IDs from the original dataset in the new dataset.
+
+    ``mode`` is one of ``LINK_MODES``; links avoid duplicating the data on disk. Returns the
+    number of files materialized.
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f"Unknown mode '{mode}', expected one of {LINK_MODES}")
+    selected = select_files(original_base, subdirs, selected_image_ids)
+    for file_name in selected:
+        materialize_file(file_name, new_base / file_name.parent.name / file_name.name, mode)
+    return len(selected)
+
+def file_checksum(path: Path, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(path: Path) -> dict:
+    """Load the materialization manifest, or start an empty one."""
+    if path.exists():
+        try:
+            return json.loads(path.read_text())
+        except ValueError as e:
+            logging.warning(f"Ignoring unreadable manifest {path}: {e}")
+    return {}
+
+def save_manifest(manifest: dict, path: Path) -> None:
+    """Atomically write the materialization manifest."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=1, sort_keys=True))
+    os.replace(tmp_path, path)
+
+def is_materialized(entry: Optional[dict], src: Path, dst: Path, stat: os.stat_result, mode: str,
+                    checksum: bool) -> bool:
+    """Whether ``dst`` already holds the current version of ``src`` according to its manifest entry.
+
+    With ``checksum``, a source whose size or mtime changed is still considered unchanged if
+    its content hash matches the recorded one.
+    """
+    if entry is None or entry["source"] != str(src) or entry["mode"] != mode:
+        return False
+    if not (dst.is_symlink() or dst.exists()):
+        return False
+    if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    return checksum and entry.get("checksum") is not None and entry["checksum"] == file_checksum(src)
+
+def materialize_subset(
+    original_base: Path, new_base: Path, subdirs: List[str], selected_image_ids: List[str], mode: str = "copy",
+    workers: int = 8, checksum: bool = False, prune: bool = False,
+) -> dict:
+    """Incrementally materialize the selected files, transferring only missing or changed ones.
+
+    A manifest (``MANIFEST_NAME`` in ``new_base``) records the source path, size, mtime, mode
+    and, with ``checksum``, the SHA-256 of every materialized file. Transfers run on a bounded
+    thread pool of ``workers``. With ``prune``, files recorded in the manifest whose ID is no
+    longer selected are deleted.
+
+    Returns
+    -------
+    dict
+        Counts and bytes of the ``transferred``, ``skipped`` and ``pruned`` files.
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f"Unknown mode '{mode}', expected one of {LINK_MODES}")
+    manifest_path = new_base / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+    report = {key: 0 for key in ("transferred", "transferred_bytes", "skipped", "skipped_bytes",
+                                 "pruned", "pruned_bytes")}
+
+    pending, selected = [], set()
+    for src in select_files(original_base, subdirs, selected_image_ids):
+        key = f"{src.parent.name}/{src.name}"
+        dst = new_base / key
+        stat = src.stat()
+        selected.add(key)
+        if is_materialized(manifest.get(key), src, dst, stat, mode, checksum):
+            manifest[key].update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            report["skipped"] += 1
+            report["skipped_bytes"] += stat.st_size
+        else:
+            pending.append((key, src, dst, stat))
+
+    def transfer(item):
+        key, src, dst, stat = item
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        materialize_file(src, dst, mode)
+        entry = {"source": str(src), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "mode": mode,
+                 "checksum": file_checksum(src) if checksum else None}
+        return key, entry
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for key, entry in executor.map(transfer, pending):
+            manifest[key] = entry
+            report["transferred"] += 1
+            report["transferred_bytes"] += entry["size"]
+
+    if prune:
+        for key in sorted(set(manifest) - selected):
+            dst = new_base / key
+            if dst.is_symlink() or dst.exists():
+                dst.unlink()
+            report["pruned"] += 1
+            report["pruned_bytes"] += manifest.pop(key)["size"]
 
-        for file_name in original_dir.iterdir():
-            if any(file_name.name.startswith(image_id) for image_id in selected_image_ids):
-                shutil.copy(file_name, new_dir / file_name.name)
+    save_manifest(manifest, manifest_path)
+    return report
 
 def main() -> None:
     logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Create the TotalSegmentator subset of Dataset797.")
+    parser.add_argument("--link-mode", choices=LINK_MODES, default="copy",
+                        help="How selected files are materialized: full copy, hard link, symbolic link or reflink.")
+    parser.add_argument("--workers", type=int, default=8, help="Number of parallel file transfers.")
+    parser.add_argument("--checksum", action="store_true",
+                        help="Record SHA-256 checksums and use them to detect files that were touched but not changed.")
+    parser.add_argument("--prune", action="store_true",
+                        help="Delete previously materialized files whose ID left the subset CSV.")
+    args = parser.parse_args()
 
     # Paths
     base_path = Path("nnUNet_raw_data_base/Dataset297_TotalSegmentator")
@@ -65,8 +252,13 @@ def main() -> None:
     # Create new dataset directory structure
     create_directory_structure(new_base_path, subdirs)
 
-    # Copy relevant files
-    copy_selected_files(base_path, new_base_path, subdirs, selected_image_ids)
+    # Copy or link the missing or changed files
+    report = materialize_subset(base_path, new_base_path, subdirs, selected_image_ids, args.link_mode,
+                                args.workers, args.checksum, args.prune)
+    logging.info(f"{report['transferred']} files transferred ({report['transferred_bytes'] / 1e9:.2f} GB, "
+                 f"{args.link_mode}), {report['skipped']} up to date ({report['skipped_bytes'] / 1e9:.2f} GB skipped)")
+    if args.prune:
+        logging.info(f"{report['pruned']} files pruned ({report['pruned_bytes'] / 1e9:.2f} GB)")
 
     logging.info(f"Subset dataset created successfully at: {new_base_path}")
 
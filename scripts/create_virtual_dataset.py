@@ -0,0 +1,246 @@
+"""
+Assemble a preprocessed nnU-Net dataset (e.g. Dataset797_TotalSegmentator_plus_TCIA) from the
+preprocessed cases of existing datasets (e.g. Dataset297 and Dataset500) instead of
+preprocessing every case again.
+
+A preprocessed case only depends on the plans of the configuration: target spacing, transpose,
+resampling functions, normalization schemes and, for ``CTNormalization``, the foreground
+intensity properties used to clip and standardize the intensities. When these and the labels
+match between a source dataset and the target, the source's preprocessed files are linked
+(symbolic links) into the target folder. Cases from incompatible sources, or missing from every
+source, are listed for preprocessing, which ``--preprocess`` runs for those cases only.
+
+The target folder must already hold the planned ``nnUNetPlans.json`` and ``dataset.json``
+(``nnUNetv2_extract_fingerprint`` and ``nnUNetv2_plan_experiment``, without preprocessing).
+Since the CT normalization of the target is computed on the merged fingerprint, it usually
+differs from every source; ``--intensity-from <source>`` writes the foreground intensity
+properties of one source into the target plans so that its cases can be linked (the other
+cases are then preprocessed with the same normalization).
+
+A manifest, ``virtual_dataset_manifest.json``, records the source of every linked case, the
+compatibility verdict of every source and the cases left to preprocess.
+
+Usage:
+    python scripts/create_virtual_dataset.py <target_preprocessed_dir> <source_preprocessed_dir> [...]
+        --raw <target_raw_dir> [--configuration 3d_fullres] [--intensity-from <source_preprocessed_dir>]
+        [--preprocess] [--num-processes 8]
+"""
+
+import argparse
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+MANIFEST_NAME = "virtual_dataset_manifest.json"
+
+# Configuration entries that change the content of a preprocessed case
+CONFIGURATION_KEYS = [
+    "normalization_schemes", "use_mask_for_norm", "resampling_fn_data", "resampling_fn_seg",
+    "resampling_fn_data_kwargs", "resampling_fn_seg_kwargs",
+]
+# Foreground intensity properties used by CTNormalization
+CT_NORMALIZATION_KEYS = ["mean", "std", "percentile_00_5", "percentile_99_5"]
+
+
+def load_json(path: Path) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def plans_differences(target_plans: dict, source_plans: dict, configuration: str = "3d_fullres",
+                      rtol: float = 1e-5) -> list:
+    """List the plan entries that make preprocessed cases of ``source_plans`` unusable for ``target_plans``.
+
+    Returns
+    -------
+    list
+        Human readable differences; empty if the preprocessed cases are interchangeable.
+    """
+    if configuration not in source_plans["configurations"]:
+        return [f"configuration {configuration} missing from the source plans"]
+    target, source = target_plans["configurations"][configuration], source_plans["configurations"][configuration]
+    differences = []
+    if target_plans["transpose_forward"] != source_plans["transpose_forward"]:
+        differences.append(f"transpose_forward {source_plans['transpose_forward']} != {target_plans['transpose_forward']}")
+    if not np.allclose(target["spacing"], source["spacing"], rtol=rtol, atol=0):
+        differences.append(f"spacing {source['spacing']} != {target['spacing']}")
+    for key in CONFIGURATION_KEYS:
+        if target.get(key) != source.get(key):
+            differences.append(f"{key} {source.get(key)} != {target.get(key)}")
+
+    for channel, scheme in enumerate(target["normalization_schemes"]):
+        if scheme != "CTNormalization":
+            continue
+        target_props = target_plans["foreground_intensity_properties_per_channel"][str(channel)]
+        source_props = source_plans["foreground_intensity_properties_per_channel"].get(str(channel), {})
+        for key in CT_NORMALIZATION_KEYS:
+            if key not in source_props or not np.isclose(target_props[key], source_props[key], rtol=rtol, atol=0):
+                differences.append(f"channel {channel} intensity {key} {source_props.get(key)} != {target_props[key]}")
+    return differences
+
+
+def labels_differences(target_dataset: dict, source_dataset: dict) -> list:
+    """Differences between the label definitions of two ``dataset.json``."""
+    if target_dataset["labels"] != source_dataset["labels"]:
+        return [f"labels {source_dataset['labels']} != {target_dataset['labels']}"]
+    return []
+
+
+def adopt_intensity_properties(target_dir: str, source_dir: str) -> None:
+    """Overwrite the foreground intensity properties of the target plans with those of a source."""
+    plans_path = Path(target_dir) / "nnUNetPlans.json"
+    plans = load_json(plans_path)
+    source_plans = load_json(Path(source_dir) / "nnUNetPlans.json")
+    plans["foreground_intensity_properties_per_channel"] = source_plans["foreground_intensity_properties_per_channel"]
+    with open(plans_path, "w") as f:
+        json.dump(plans, f, indent=4)
+    logging.warning(f"Intensity normalization of {plans_path} taken from {source_dir}")
+
+
+def raw_case_ids(raw_dir: Path) -> list:
+    """Training case identifiers of a raw nnU-Net dataset (``imagesTr/<case>_0000<ending>``)."""
+    dataset = load_json(raw_dir / "dataset.json")
+    suffix = "_0000" + dataset["file_ending"]
+    return sorted(f.name[: -len(suffix)] for f in (raw_dir / "imagesTr").iterdir() if f.name.endswith(suffix))
+
+
+def case_files(data_dir: Path, case_id: str) -> list:
+    """Preprocessed files of a case (``.npz``/``.pkl`` and unpacked ``.npy``/``_seg.npy``)."""
+    names = [f"{case_id}.npz", f"{case_id}.pkl", f"{case_id}.npy", f"{case_id}_seg.npy"]
+    return [data_dir / name for name in names if (data_dir / name).exists()]
+
+
+def link(src: Path, dst: Path) -> None:
+    if dst.is_symlink() or dst.exists():
+        dst.unlink()
+    os.symlink(src.resolve(), dst)
+
+
+def create_virtual_dataset(target_dir: str, source_dirs: list, case_ids: list,
+                           configuration: str = "3d_fullres") -> dict:
+    """Link the preprocessed cases of compatible sources into ``target_dir``.
+
+    Parameters
+    ----------
+    target_dir : str
+        Preprocessed folder of the virtual dataset, holding its ``nnUNetPlans.json`` and ``dataset.json``.
+    source_dirs : list
+        Preprocessed folders of the source datasets, searched in order for each case.
+    case_ids : list
+        Cases of the virtual dataset.
+    configuration : str
+        Plans configuration whose preprocessed data are linked.
+
+    Returns
+    -------
+    dict
+        The manifest written to ``target_dir/virtual_dataset_manifest.json``.
+    """
+    target_dir = Path(target_dir)
+    target_plans = load_json(target_dir / "nnUNetPlans.json")
+    target_dataset = load_json(target_dir / "dataset.json")
+    data_identifier = target_plans["configurations"][configuration]["data_identifier"]
+    target_data = target_dir / data_identifier
+    target_data.mkdir(exist_ok=True)
+    (target_dir / "gt_segmentations").mkdir(exist_ok=True)
+
+    sources = {}
+    for source_dir in map(Path, source_dirs):
+        source_plans = load_json(source_dir / "nnUNetPlans.json")
+        differences = (plans_differences(target_plans, source_plans, configuration)
+                       + labels_differences(target_dataset, load_json(source_dir / "dataset.json")))
+        source_identifier = source_plans["configurations"].get(configuration, {}).get("data_identifier")
+        sources[str(source_dir)] = {"compatible": not differences, "differences": differences,
+                                    "data_dir": str(source_dir / source_identifier) if source_identifier else None}
+        if differences:
+            logging.warning(f"{source_dir.name} is not compatible with {target_dir.name}: {'; '.join(differences)}")
+
+    cases, to_preprocess = {}, []
+    file_ending = target_dataset["file_ending"]
+    for case_id in case_ids:
+        linked = False
+        for source_dir, source in sources.items():
+            if source["data_dir"] is None:
+                continue
+            files = case_files(Path(source["data_dir"]), case_id)
+            if not any(f.name in (f"{case_id}.npz", f"{case_id}.npy") for f in files) or not source["compatible"]:
+                continue
+            for f in files:
+                link(f, target_data / f.name)
+            gt = Path(source_dir) / "gt_segmentations" / f"{case_id}{file_ending}"
+            if gt.exists():
+                link(gt, target_dir / "gt_segmentations" / gt.name)
+            cases[case_id] = {"source": source_dir, "files": [f.name for f in files]}
+            linked = True
+            break
+        if not linked:
+            # Drop links left by a previous run to data that is no longer compatible
+            for f in case_files(target_data, case_id):
+                if f.is_symlink():
+                    f.unlink()
+            to_preprocess.append(case_id)
+
+    manifest = {"configuration": configuration, "data_identifier": data_identifier, "sources": sources,
+                "cases": cases, "to_preprocess": to_preprocess}
+    tmp_path = target_dir / (MANIFEST_NAME + ".tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=1))
+    os.replace(tmp_path, target_dir / MANIFEST_NAME)
+    logging.info(f"{len(cases)} cases linked, {len(to_preprocess)} cases to preprocess")
+    return manifest
+
+
+def preprocess_cases(target_dir: str, raw_dir: str, case_ids: list, configuration: str = "3d_fullres",
+                     num_processes: int = 8) -> None:
+    """Preprocess only ``case_ids`` into ``target_dir`` with the nnU-Net preprocessor of the target plans."""
+    import shutil
+    from multiprocessing import Pool
+
+    from nnunetv2.utilities.plans_handling.plans_handler import PlansManager
+
+    target_dir, raw_dir = Path(target_dir), Path(raw_dir)
+    plans_manager = PlansManager(str(target_dir / "nnUNetPlans.json"))
+    configuration_manager = plans_manager.get_configuration(configuration)
+    dataset_json = load_json(target_dir / "dataset.json")
+    preprocessor = configuration_manager.preprocessor_class(verbose=False)
+    output_dir = target_dir / configuration_manager.data_identifier
+    output_dir.mkdir(exist_ok=True)
+    file_ending = dataset_json["file_ending"]
+    num_channels = len(dataset_json["channel_names"])
+
+    jobs = []
+    for case_id in case_ids:
+        images = [str(raw_dir / "imagesTr" / f"{case_id}_{c:04d}{file_ending}") for c in range(num_channels)]
+        seg = raw_dir / "labelsTr" / f"{case_id}{file_ending}"
+        shutil.copy(seg, target_dir / "gt_segmentations" / seg.name)
+        jobs.append((str(output_dir / case_id), images, str(seg), plans_manager, configuration_manager, dataset_json))
+    with Pool(num_processes) as pool:
+        pool.starmap(preprocessor.run_case_save, jobs)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Link compatible preprocessed cases into a virtual nnU-Net dataset.")
+    parser.add_argument("target_dir", help="Preprocessed folder of the virtual dataset (with its plans).")
+    parser.add_argument("source_dirs", nargs="+", help="Preprocessed folders of the source datasets.")
+    parser.add_argument("--raw", required=True, help="Raw folder of the virtual dataset (lists its cases).")
+    parser.add_argument("--configuration", default="3d_fullres", help="Plans configuration.")
+    parser.add_argument("--intensity-from", default=None,
+                        help="Source whose foreground intensity properties replace those of the target plans.")
+    parser.add_argument("--preprocess", action="store_true", help="Preprocess the cases that cannot be linked.")
+    parser.add_argument("--num-processes", type=int, default=8, help="Processes used by --preprocess.")
+    args = parser.parse_args()
+
+    if args.intensity_from:
+        adopt_intensity_properties(args.target_dir, args.intensity_from)
+    manifest = create_virtual_dataset(args.target_dir, args.source_dirs, raw_case_ids(Path(args.raw)),
+                                      args.configuration)
+    if args.preprocess and manifest["to_preprocess"]:
+        preprocess_cases(args.target_dir, args.raw, manifest["to_preprocess"], args.configuration,
+                         args.num_processes)
+
+
+if __name__ == "__main__":
+    main()
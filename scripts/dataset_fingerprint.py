@@ -0,0 +1,251 @@
+"""
+Incremental, mergeable nnU-Net dataset fingerprints.
+
+``nnUNetv2_extract_fingerprint`` analyses every case of a dataset from scratch, even when the
+cases were already fingerprinted as part of another dataset (Dataset797 is made of Dataset297
+and Dataset500 cases). This script keeps one record per case instead:
+
+- spacing, shape after cropping to the nonzero region and relative size after cropping;
+- per channel, a mergeable sketch of the foreground intensities: voxel count, sum, sum of
+  squares, min, max and a fixed-width histogram (1 HU bins by default, exact for integer CT
+  data) from which percentiles are read.
+
+Records are cached (``fingerprint_cache.json``) with the size and mtime of the case's files,
+so rerunning after adding cases only analyses the new or modified ones, and records can be
+imported from the caches of other datasets. The records are merged into a
+``dataset_fingerprint.json`` with the same keys as nnU-Net's. As in nnU-Net, which samples the
+same number of foreground voxels from every case, each case contributes equally to the
+intensity statistics.
+
+Usage:
+    python scripts/dataset_fingerprint.py <raw_dataset_dir> <output_fingerprint.json>
+        [--cache <raw_dataset_dir>/fingerprint_cache.json] [--import-cache other_cache.json ...]
+        [--num-processes 8] [--bin-width 1]
+"""
+
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+from scipy.ndimage import binary_fill_holes
+
+CACHE_NAME = "fingerprint_cache.json"
+
+
+def crop_to_nonzero(data: np.ndarray, seg: np.ndarray) -> tuple:
+    """Crop (channels, x, y, z) arrays to the bounding box of the nonzero region, as nnU-Net does."""
+    nonzero = binary_fill_holes(np.any(data != 0, axis=0))
+    coords = np.nonzero(nonzero)
+    if len(coords[0]) == 0:
+        return data, seg
+    slicer = (slice(None),) + tuple(slice(c.min(), c.max() + 1) for c in coords)
+    return data[slicer], seg[slicer]
+
+
+def intensity_sketch(values: np.ndarray, bin_width: float = 1.0) -> dict:
+    """Mergeable summary of a set of intensities: moments, extrema and a fixed-width histogram."""
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if values.size == 0:
+        return {"count": 0, "bin_width": bin_width}
+    bins = np.floor(values / bin_width).astype(np.int64)
+    offset = int(bins.min())
+    return {
+        "count": int(values.size),
+        "sum": float(values.sum()),
+        "sum_sq": float(np.dot(values, values)),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "bin_width": bin_width,
+        "offset": offset,
+        "counts": np.bincount(bins - offset).tolist(),
+    }
+
+
+def merge_intensity_sketches(sketches: list) -> dict:
+    """Intensity statistics of the union of cases, each case weighing the same.
+
+    Returns
+    -------
+    dict
+        ``max``, ``mean``, ``median``, ``min``, ``percentile_00_5``, ``percentile_99_5`` and
+        ``std``, as in nnU-Net's ``foreground_intensity_properties_per_channel``.
+    """
+    sketches = [s for s in sketches if s["count"] > 0]
+    if not sketches:
+        return {key: float("nan") for key in ("max", "mean", "median", "min", "percentile_00_5",
+                                              "percentile_99_5", "std")}
+    bin_width = sketches[0]["bin_width"]
+    if any(s["bin_width"] != bin_width for s in sketches):
+        raise ValueError("Cannot merge intensity sketches with different bin widths")
+
+    mean = np.mean([s["sum"] / s["count"] for s in sketches])
+    second_moment = np.mean([s["sum_sq"] / s["count"] for s in sketches])
+    offset = min(s["offset"] for s in sketches)
+    weights = np.zeros(max(s["offset"] + len(s["counts"]) for s in sketches) - offset)
+    for s in sketches:
+        start = s["offset"] - offset
+        weights[start:start + len(s["counts"])] += np.asarray(s["counts"], dtype=np.float64) / s["count"]
+    cumulative = np.cumsum(weights) / len(sketches)
+    lowest, highest = min(s["min"] for s in sketches), max(s["max"] for s in sketches)
+
+    def quantile(q):
+        index = min(int(np.searchsorted(cumulative, q - 1e-12)), len(cumulative) - 1)
+        return float(np.clip((offset + index) * bin_width, lowest, highest))
+
+    return {
+        "max": highest,
+        "mean": float(mean),
+        "median": quantile(0.5),
+        "min": lowest,
+        "percentile_00_5": quantile(0.005),
+        "percentile_99_5": quantile(0.995),
+        "std": float(np.sqrt(max(second_moment - mean ** 2, 0.0))),
+    }
+
+
+def case_record(data: np.ndarray, seg: np.ndarray, spacing: list, bin_width: float = 1.0) -> dict:
+    """Fingerprint record of one case from its (channels, ...) image and (1, ...) segmentation."""
+    shape_before_crop = data.shape[1:]
+    data, seg = crop_to_nonzero(data, seg)
+    foreground = seg[0] > 0
+    return {
+        "spacing": [float(s) for s in spacing],
+        "shape_after_crop": [int(s) for s in data.shape[1:]],
+        "relative_size_after_cropping": float(np.prod(data.shape[1:]) / np.prod(shape_before_crop)),
+        "intensities": {str(c): intensity_sketch(data[c][foreground], bin_width) for c in range(data.shape[0])},
+    }
+
+
+def merge_records(records: list) -> dict:
+    """Merge case records into the content of nnU-Net's ``dataset_fingerprint.json``."""
+    channels = sorted(records[0]["intensities"], key=int) if records else []
+    return {
+        "foreground_intensity_properties_per_channel": {
+            c: merge_intensity_sketches([r["intensities"][c] for r in records]) for c in channels
+        },
+        "median_relative_size_after_cropping": float(np.median([r["relative_size_after_cropping"] for r in records])),
+        "shapes_after_crop": [r["shape_after_crop"] for r in records],
+        "spacings": [r["spacing"] for r in records],
+    }
+
+
+def load_case_nnunet(image_files: list, seg_file: str, dataset_json: dict) -> tuple:
+    """Read a case with the nnU-Net reader of the dataset (same axes and spacing as nnU-Net)."""
+    from nnunetv2.imageio.reader_writer_registry import determine_reader_writer_from_dataset_json
+
+    reader = determine_reader_writer_from_dataset_json(dataset_json, image_files[0])()
+    data, properties = reader.read_images(image_files)
+    seg, _ = reader.read_seg(seg_file)
+    return data, seg, properties["spacing"]
+
+
+def dataset_cases(raw_dir: Path) -> dict:
+    """Image and label files of the training cases of a raw nnU-Net dataset, by case identifier."""
+    dataset_json = json.loads((raw_dir / "dataset.json").read_text())
+    ending, channels = dataset_json["file_ending"], len(dataset_json["channel_names"])
+    suffix = "_0000" + ending
+    cases = {}
+    for image in sorted((raw_dir / "imagesTr").glob(f"*{suffix}")):
+        case_id = image.name[: -len(suffix)]
+        cases[case_id] = {
+            "images": [str(raw_dir / "imagesTr" / f"{case_id}_{c:04d}{ending}") for c in range(channels)],
+            "label": str(raw_dir / "labelsTr" / f"{case_id}{ending}"),
+        }
+    return cases
+
+
+def files_signature(files: dict) -> list:
+    """Name, size and mtime of the files of a case."""
+    paths = files["images"] + [files["label"]]
+    return [[os.path.basename(p), os.stat(p).st_size, os.stat(p).st_mtime_ns] for p in paths]
+
+
+def _analyze(files: dict, dataset_json: dict, bin_width: float, load_fn: Callable) -> dict:
+    data, seg, spacing = load_fn(files["images"], files["label"], dataset_json)
+    return case_record(np.asarray(data), np.asarray(seg), spacing, bin_width)
+
+
+def load_cache(path: Path) -> dict:
+    if path.exists():
+        try:
+            return json.loads(path.read_text())
+        except ValueError as e:
+            logging.warning(f"Ignoring unreadable fingerprint cache {path}: {e}")
+    return {}
+
+
+def update_records(raw_dir: str, cache_path: str = None, import_caches: list = (), num_processes: int = 8,
+                   bin_width: float = 1.0, load_fn: Callable = load_case_nnunet) -> dict:
+    """Return the records of every training case, analysing only the cases without a valid cached record.
+
+    A cached record is valid when the name, size and mtime of the case's files are unchanged.
+    Records imported from the caches of other datasets are matched on file name and size only,
+    since copied files get a new mtime.
+
+    Returns
+    -------
+    dict
+        Records by case identifier, in case order.
+    """
+    raw_dir = Path(raw_dir)
+    cache_path = Path(cache_path) if cache_path else raw_dir / CACHE_NAME
+    dataset_json = json.loads((raw_dir / "dataset.json").read_text())
+    cache = load_cache(cache_path)
+    imported = {}
+    for path in import_caches:
+        imported.update(load_cache(Path(path)))
+
+    records, pending = {}, {}
+    for case_id, files in dataset_cases(raw_dir).items():
+        signature = files_signature(files)
+        entry = cache.get(case_id)
+        if entry is not None and entry["signature"] == signature and entry["record_bin_width"] == bin_width:
+            records[case_id] = entry
+            continue
+        entry = imported.get(case_id)
+        if (entry is not None and entry["record_bin_width"] == bin_width
+                and [s[:2] for s in entry["signature"]] == [s[:2] for s in signature]):
+            records[case_id] = dict(entry, signature=signature)
+            continue
+        pending[case_id] = (files, signature)
+
+    logging.info(f"{len(records)} cached case records, {len(pending)} cases to analyse")
+    with ProcessPoolExecutor(max_workers=num_processes) as executor:
+        futures = {case_id: executor.submit(_analyze, files, dataset_json, bin_width, load_fn)
+                   for case_id, (files, _) in pending.items()}
+        for case_id, future in futures.items():
+            records[case_id] = {"signature": pending[case_id][1], "record_bin_width": bin_width,
+                                "record": future.result()}
+
+    records = {case_id: records[case_id] for case_id in sorted(records)}
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    tmp_path.write_text(json.dumps(records))
+    os.replace(tmp_path, cache_path)
+    return {case_id: entry["record"] for case_id, entry in records.items()}
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Incremental nnU-Net dataset fingerprint from cached case records.")
+    parser.add_argument("raw_dir", help="Raw nnU-Net dataset folder.")
+    parser.add_argument("output", help="Output dataset_fingerprint.json.")
+    parser.add_argument("--cache", default=None, help=f"Case record cache (default: <raw_dir>/{CACHE_NAME}).")
+    parser.add_argument("--import-cache", nargs="*", default=[],
+                        help="Caches of other datasets whose records are reused for the same cases.")
+    parser.add_argument("--num-processes", type=int, default=8, help="Processes analysing new cases.")
+    parser.add_argument("--bin-width", type=float, default=1.0, help="Histogram bin width of the intensity sketches.")
+    args = parser.parse_args()
+
+    records = update_records(args.raw_dir, args.cache, args.import_cache, args.num_processes, args.bin_width)
+    with open(args.output, "w") as f:
+        json.dump(merge_records(list(records.values())), f, indent=4)
+    logging.info(f"Fingerprint of {len(records)} cases saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Persistent, header-only index of a DICOM archive.
+
+Every DICOM file below a root folder is read without its pixel data (only the tags listed in
+``INDEX_TAGS``), in parallel, and stored in a CSV index together with its mtime and size.
+Rerunning the indexer only parses new or modified files. The index provides series UIDs,
+slice ordering, spacing, age and sex, and is used by the conversion scripts (sorted CT series,
+RTSTRUCT lookup) and to build the demographic metadata CSVs.
+
+Usage:
+    python scripts/dicom_index.py <dicom_root> [--index dicom_index.csv] [--workers 16]
+        [--metadata meta.csv]
+"""
+
+import argparse
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+INDEX_TAGS = [
+    "PatientID", "PatientAge", "PatientSex", "StudyInstanceUID", "StudyDate", "SeriesInstanceUID",
+    "SeriesDescription", "SOPInstanceUID", "Modality", "InstanceNumber", "ImagePositionPatient",
+    "ImageOrientationPatient", "PixelSpacing", "SliceThickness", "Rows", "Columns",
+]
+COLUMNS = ["path", "mtime_ns", "size"] + INDEX_TAGS + ["slice_position"]
+
+
+def _format_value(value):
+    """Flatten multi-valued tags to a backslash-separated string, as in the DICOM encoding."""
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)) or type(value).__name__ == "MultiValue":
+        return "\\".join(str(v) for v in value)
+    return str(value)
+
+
+def _floats(value) -> np.ndarray:
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return np.array([float(v) for v in str(value).split("\\")])
+
+
+def read_header(path: str) -> dict:
+    """Read the indexed tags of one DICOM file, skipping the pixel data."""
+    import pydicom
+
+    st = os.stat(path)
+    ds = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=INDEX_TAGS)
+    row = {"path": path, "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+    for tag in INDEX_TAGS:
+        row[tag] = _format_value(getattr(ds, tag, None))
+    row["slice_position"] = slice_position(row)
+    return row
+
+
+def slice_position(row: dict) -> float:
+    """Position of an image along its slice normal, used to order the slices of a series."""
+    position, orientation = _floats(row.get("ImagePositionPatient")), _floats(row.get("ImageOrientationPatient"))
+    if position is None or orientation is None:
+        return np.nan
+    return float(np.dot(np.cross(orientation[:3], orientation[3:]), position))
+
+
+def update_index(root: str, index_path: str = None, workers: int = 16) -> pd.DataFrame:
+    """Index every ``*.dcm`` file below ``root``, reusing the entries of unchanged files.
+
+    Parameters
+    ----------
+    root : str
+        Archive root.
+    index_path : str
+        CSV file holding the persistent index; read if it exists and rewritten afterwards.
+    workers : int
+        Number of threads reading headers.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per DICOM file with the columns of ``COLUMNS``.
+    """
+    previous = {}
+    if index_path and os.path.exists(index_path):
+        cached = pd.read_csv(index_path, dtype={tag: str for tag in INDEX_TAGS})
+        previous = {row["path"]: row for row in cached.to_dict("records")}
+
+    rows, to_read = [], []
+    for path in sorted(str(p) for p in Path(root).rglob("*.dcm")):
+        st = os.stat(path)
+        entry = previous.get(path)
+        if entry is not None and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            rows.append(entry)
+        else:
+            to_read.append(path)
+
+    logging.info(f"{len(rows)} DICOM headers reused, {len(to_read)} to read")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for path, result in zip(to_read, executor.map(_safe_read_header, to_read)):
+            if result is not None:
+                rows.append(result)
+
+    index = pd.DataFrame(rows, columns=COLUMNS).sort_values("path", ignore_index=True)
+    # Tags stay strings (missing as None), whether freshly read or loaded from the CSV
+    tags = index[INDEX_TAGS].astype(object)
+    index[INDEX_TAGS] = tags.where(tags.notna(), None)
+    if index_path:
+        tmp_path = f"{index_path}.tmp"
+        index.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, index_path)
+    return index
+
+
+def _safe_read_header(path: str):
+    try:
+        return read_header(path)
+    except Exception as e:
+        logging.warning(f"Skipping unreadable DICOM file {path}: {e}")
+        return None
+
+
+def series_files(index: pd.DataFrame, series_uid: str) -> list:
+    """Paths of a series' files, ordered along the slice normal (instance number as fallback)."""
+    rows = index[index["SeriesInstanceUID"] == series_uid]
+    keys = rows["slice_position"].where(rows["slice_position"].notna(),
+                                        pd.to_numeric(rows["InstanceNumber"], errors="coerce"))
+    return rows.assign(_key=keys).sort_values("_key")["path"].tolist()
+
+
+def files_under(index: pd.DataFrame, directory: str, modality: str = None) -> pd.DataFrame:
+    """Index rows of the files below ``directory``, optionally restricted to one modality."""
+    prefix = str(directory).rstrip(os.sep) + os.sep
+    rows = index[index["path"].str.startswith(prefix)]
+    return rows if modality is None else rows[rows["Modality"] == modality]
+
+
+def headers_from_index(rows: pd.DataFrame) -> list:
+    """Header-like objects exposing the geometry tags of indexed CT slices (no file access)."""
+    headers = []
+    for row in rows.to_dict("records"):
+        headers.append(SimpleNamespace(
+            ImagePositionPatient=list(_floats(row["ImagePositionPatient"])),
+            ImageOrientationPatient=list(_floats(row["ImageOrientationPatient"])),
+            PixelSpacing=list(_floats(row["PixelSpacing"])),
+            SliceThickness=float(row["SliceThickness"]) if pd.notna(row["SliceThickness"]) else 1.0,
+            Rows=int(float(row["Rows"])),
+            Columns=int(float(row["Columns"])),
+        ))
+    return headers
+
+
+def age_in_years(age: str):
+    """Convert a DICOM age string (e.g. ``010Y``, ``018M``) to whole years."""
+    if not isinstance(age, str) or len(age) < 2 or not age[:-1].isdigit():
+        return None
+    divisor = {"Y": 1, "M": 12, "W": 52, "D": 365}.get(age[-1].upper())
+    return int(age[:-1]) // divisor if divisor else None
+
+
+def build_metadata(index: pd.DataFrame) -> pd.DataFrame:
+    """One row per study with the ``Subject ID``, ``Study UID``, ``Study Date``, ``StudyAge`` and ``Sex`` columns."""
+    studies = index.dropna(subset=["StudyInstanceUID"]).groupby("StudyInstanceUID", sort=False).first()
+    return pd.DataFrame({
+        "Subject ID": studies["PatientID"].values,
+        "Study UID": studies.index.values,
+        "Study Date": studies["StudyDate"].values,
+        "StudyAge": [age_in_years(a) for a in studies["PatientAge"]],
+        "Sex": studies["PatientSex"].values,
+    }).sort_values("Subject ID", ignore_index=True)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Build a persistent header-only DICOM index.")
+    parser.add_argument("root", help="DICOM archive root.")
+    parser.add_argument("--index", default="dicom_index.csv", help="Persistent index CSV.")
+    parser.add_argument("--workers", type=int, default=16, help="Threads reading headers.")
+    parser.add_argument("--metadata", help="Optional CSV receiving the per-study age and sex metadata.")
+    args = parser.parse_args()
+
+    index = update_index(args.root, args.index, args.workers)
+    logging.info(f"Indexed {len(index)} files, {index['SeriesInstanceUID'].nunique()} series")
+    if args.metadata:
+        build_metadata(index).to_csv(args.metadata, index=False)
+        logging.info(f"Metadata saved to {args.metadata}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
 import os
 import argparse
+import hashlib
+import json
 import logging
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
-from scipy.stats import mannwhitneyu
+from scipy.stats import mannwhitneyu, norm, rankdata
+from functools import lru_cache
 
 def setup_logging():
     """Configure logging output."""
@@ -30,6 +36,31 @@ def parse_arguments():
         "--datasets", type=str, default="all",
         help="Comma-separated list of dataset numbers (e.g., '500,67,297') or 'all' to include all."
     )
+    parser.add_argument(
+        "--workers", type=int, default=8,
+        help="Number of threads used to read the patient-wise metric CSVs."
+    )
+    parser.add_argument(
+        "--cache-dir", type=str, default=os.path.join("analysis_output", ".csv_cache"),
+        help="Directory holding the binary cache of parsed metric CSVs."
+    )
+    parser.add_argument(
+        "--test", type=str, default="mannwhitneyu", choices=["mannwhitneyu", "wilcoxon", "permutation"],
+        help="Significance test: unpaired Mann-Whitney U against the pooled baselines, or a paired "
+             "Wilcoxon signed-rank / sign-flip permutation test against the best baseline per subject."
+    )
+    parser.add_argument(
+        "--permutations", type=int, default=10000,
+        help="Number of sign flips drawn by the paired permutation test."
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="Random seed of the paired permutation test."
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="Always parse the metric CSVs and recompute all statistics, ignoring the cache and registry."
+    )
     return parser.parse_args()
 
 def get_dataset_folders(base_dir: str, selected_datasets: set, dataset_map: dict) -> list:
@@ -54,13 +85,107 @@ def get_dataset_folders(base_dir: str, selected_datasets: set, dataset_map: dict
         return [d for d in all_folders if os.path.basename(d) in valid_folders]
     return all_folders
 
-def process_dataset_folder(dataset_path: str, results: dict) -> str:
+def csv_fingerprint(path: str) -> tuple:
+    """Return the (mtime in ns, size in bytes) pair used to detect changed CSV files."""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def load_metrics_csv(metrics_csv: str, cache_dir: str = None) -> pd.DataFrame:
+    """
+    Read a patient-wise metrics CSV, going through a binary cache when available.
+
+    The cache holds one pickle per CSV, keyed by the absolute CSV path and validated
+    against the file's mtime and size, so unchanged files are never parsed twice.
+
+    Parameters:
+        metrics_csv (str): Path to a ``patient_wise_metrics.csv`` file.
+        cache_dir (str): Directory of the binary cache, or None to disable caching.
+
+    Returns:
+        pd.DataFrame: The parsed metrics.
+    """
+    if cache_dir is None:
+        return pd.read_csv(metrics_csv)
+
+    fingerprint = csv_fingerprint(metrics_csv)
+    key = hashlib.sha1(os.path.abspath(metrics_csv).encode()).hexdigest()
+    cache_file = os.path.join(cache_dir, f"{key}.pkl")
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, "rb") as f:
+                cached = pickle.load(f)
+            if cached["fingerprint"] == fingerprint:
+                return cached["df"]
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable cache entry {cache_file}: {e}")
+
+    df = pd.read_csv(metrics_csv)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary file first so concurrent readers never see a partial entry
+    tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, "wb") as f:
+        pickle.dump({"fingerprint": fingerprint, "df": df}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+    return df
+
+def load_registry(registry_path: str) -> dict:
+    """
+    Load the persistent results registry, or start an empty one.
+
+    The registry records, per dataset folder, the trainer listing (keyed by the folder mtime),
+    each trainer's CSV fingerprint, and the statistical comparisons
+    together with the fingerprints they were computed from.
+    """
+    registry = {"datasets": {}, "trainers": {}, "comparisons": {}}
+    if os.path.exists(registry_path):
+        try:
+            with open(registry_path) as f:
+                registry.update(json.load(f))
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable registry {registry_path}: {e}")
+    return registry
+
+def save_registry(registry: dict, registry_path: str):
+    """Atomically write the results registry to disk."""
+    os.makedirs(os.path.dirname(registry_path) or ".", exist_ok=True)
+    tmp_path = f"{registry_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(registry, f, indent=1)
+    os.replace(tmp_path, registry_path)
+
+def list_trainer_folders(dataset_path: str, registry: dict = None) -> list:
+    """
+    List the trainer subfolders of a dataset folder.
+
+    When a registry is given, the listing recorded for an unchanged dataset folder (same mtime)
+    is reused instead of scanning the folder again.
+    """
+    dataset_name = os.path.basename(dataset_path)
+    mtime_ns = os.stat(dataset_path).st_mtime_ns
+    entry = registry["datasets"].get(dataset_name) if registry is not None else None
+    if entry is not None and entry["mtime_ns"] == mtime_ns:
+        return list(entry["trainers"])
+
+    with os.scandir(dataset_path) as it:
+        trainers = sorted(e.name for e in it if e.is_dir())
+    if registry is not None:
+        registry["datasets"][dataset_name] = {"mtime_ns": mtime_ns, "trainers": trainers}
+    return trainers
+
+def process_dataset_folder(dataset_path: str, results: dict, cache_dir: str = None,
+                           max_workers: int = 8, registry: dict = None) -> str:
     """
     Process a single dataset folder: read trainer subfolders and update the results dictionary.
+
+    The metric CSVs of all trainers are read concurrently by a thread pool.
     
     Parameters:
         dataset_path (str): Path to the dataset folder.
         results (dict): Nested dictionary to store dice values and later metrics.
+        cache_dir (str): Directory of the binary CSV cache, or None to disable caching.
+        max_workers (int): Number of threads used to read the CSVs.
+        registry (dict): Optional results registry (see ``load_registry``) receiving the
+            trainer listing and CSV fingerprints.
     
     Returns:
         str: The dataset name.
@@ -68,20 +193,22 @@ def process_dataset_folder(dataset_path: str, results: dict) -> str:
     dataset_name = os.path.basename(dataset_path)
     logging.info(f"Processing dataset: {dataset_name}")
     
-    trainer_folders = [
-        os.path.join(dataset_path, d) 
-        for d in os.listdir(dataset_path) 
-        if os.path.isdir(os.path.join(dataset_path, d))
-    ]
-    
-    for trainer_path in trainer_folders:
-        trainer_name = os.path.basename(trainer_path)
-        metrics_csv = os.path.join(trainer_path, "patient_wise_metrics.csv")
-        if not os.path.exists(metrics_csv):
+    metrics_files = {}
+    fingerprints = {}
+    for trainer_name in list_trainer_folders(dataset_path, registry):
+        metrics_csv = os.path.join(dataset_path, trainer_name, "patient_wise_metrics.csv")
+        try:
+            fingerprints[trainer_name] = list(csv_fingerprint(metrics_csv))
+        except FileNotFoundError:
             logging.warning(f"{metrics_csv} not found. Skipping trainer {trainer_name}.")
             continue
-        
-        df = pd.read_csv(metrics_csv)
+        metrics_files[trainer_name] = metrics_csv
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        frames = executor.map(lambda path: load_metrics_csv(path, cache_dir), metrics_files.values())
+        frames = dict(zip(metrics_files.keys(), frames))
+
+    for trainer_name, df in frames.items():
         # Identify dice columns (columns starting with "dice-")
         dice_columns = [col for col in df.columns if col.startswith("dice-")]
         if not dice_columns:
@@ -90,41 +217,316 @@ def process_dataset_folder(dataset_path: str, results: dict) -> str:
         for dice_col in dice_columns:
             # Crop ROI name to the first 4 characters for brevity
             roi = dice_col.split("-")[1][:4]
-            dice_values = df[dice_col].dropna().values
+            valid = df[dice_col].notna()
+            dice_values = df.loc[valid, dice_col].values
             
             # Initialize the nested dictionary structure as needed
-            results.setdefault(trainer_name, {}).setdefault(roi, {})[dataset_name] = {
-                "dice": dice_values
-            }
+            record = {"dice": dice_values}
+            # Keep the subject IDs aligned with the Dice values for paired comparisons
+            if "subject" in df.columns:
+                record["subjects"] = df.loc[valid, "subject"].astype(str).values
+            results.setdefault(trainer_name, {}).setdefault(roi, {})[dataset_name] = record
+
+    if registry is not None:
+        # The fingerprints are what compute_statistical_tests checks to reuse comparisons
+        registry["trainers"][dataset_name] = {
+            trainer_name: {"fingerprint": fingerprints[trainer_name]}
+            for trainer_name in frames
+        }
     return dataset_name
 
-def compute_statistical_tests(results: dict):
+def compute_baseline_pools(results: dict) -> dict:
+    """
+    Pool the Dice values of all baseline trainers once per ROI and dataset.
+
+    Baselines without any Dice value for an ROI and dataset are ignored, so an ROI and dataset
+    whose baselines are all empty has no pool and its comparisons are skipped.
+
+    Returns:
+        dict: Mapping of (roi, dataset) to a tuple holding the pooled baseline Dice values,
+              the best (maximum) baseline mean Dice score and the sorted baseline trainer names.
+    """
+    pooled = {}
+    for trainer, rois in results.items():
+        if not is_baseline(trainer):
+            continue
+        for roi, dataset_metrics in rois.items():
+            for dataset, metrics in dataset_metrics.items():
+                if len(metrics["dice"]) == 0:
+                    continue
+                pooled.setdefault((roi, dataset), []).append((trainer, metrics["dice"]))
+    return {
+        key: (
+            np.concatenate([d for _, d in members]),
+            max(np.mean(d) for _, d in members),
+            sorted(t for t, _ in members),
+        )
+        for key, members in pooled.items()
+    }
+
+def _mannwhitneyu_method(x: np.ndarray, y: np.ndarray) -> str:
+    """
+    Resolve scipy's "auto" method for a single comparison.
+
+    scipy picks the method once for a whole batch, so it is resolved per comparison here
+    to keep batched p-values identical to one-by-one calls.
+    """
+    if len(x) > 8 and len(y) > 8:
+        return "asymptotic"
+    values = np.concatenate([x, y])
+    return "asymptotic" if len(np.unique(values)) < len(values) else "exact"
+
+def _comparison_signature(registry: dict, trainer: str, dataset: str, baselines: list) -> list:
+    """Fingerprints of the trainer and baseline CSVs a comparison depends on."""
+    fingerprints = registry["trainers"].get(dataset, {})
+    return [
+        [name, fingerprints.get(name, {}).get("fingerprint")]
+        for name in [trainer] + baselines
+    ]
+
+def compute_statistical_tests(results: dict, registry: dict = None):
     """
     Compute p-values comparing each non-baseline trainer against the baseline for each ROI and dataset
     using the Mann–Whitney U test for non-normal data.
     Additionally, store the maximum baseline mean Dice score (i.e. the best performing baseline)
     among all baselines.
+
+    Baseline pools are built once per ROI and dataset, and all comparisons sharing a pool, a sample
+    size and a test method are evaluated in a single vectorized call.
+
+    When a registry is given, comparisons whose trainer and baseline CSV fingerprints are
+    unchanged are restored from it and only the remaining ones are recomputed; the registry
+    is then updated with the comparisons of the current results.
     Updates the results dictionary in place.
     """
+    baseline_pools = compute_baseline_pools(results)
+    previous = registry["comparisons"] if registry is not None else {}
+    comparisons = {}
+
+    batches = {}
+    for trainer, rois in results.items():
+        if is_baseline(trainer):
+            continue
+        for roi, dataset_metrics in rois.items():
+            for dataset, metrics in dataset_metrics.items():
+                if (roi, dataset) not in baseline_pools:
+                    continue
+                baseline_dice, _, baselines = baseline_pools[(roi, dataset)]
+                if registry is not None:
+                    signature = _comparison_signature(registry, trainer, dataset, baselines)
+                    cached = previous.get(dataset, {}).get(trainer, {}).get(roi)
+                    record = comparisons.setdefault(dataset, {}).setdefault(trainer, {})
+                    if cached is not None and cached["signature"] == signature:
+                        metrics["pvalue"] = cached["pvalue"]
+                        metrics["max_baseline"] = cached["max_baseline"]
+                        record[roi] = cached
+                        continue
+                    record[roi] = {"signature": signature}
+                method = _mannwhitneyu_method(metrics["dice"], baseline_dice)
+                key = (roi, dataset, len(metrics["dice"]), method)
+                batches.setdefault(key, []).append(trainer)
+
+    for (roi, dataset, _, method), trainers in batches.items():
+        baseline_dice, max_baseline, _ = baseline_pools[(roi, dataset)]
+        dice = np.stack([np.asarray(results[t][roi][dataset]["dice"], dtype=float) for t in trainers])
+        # Compute p-values using the Mann–Whitney U test, one row per trainer
+        _, pvalues = mannwhitneyu(dice, baseline_dice[np.newaxis, :], alternative='two-sided',
+                                  axis=1, method=method)
+        for trainer, pvalue in zip(trainers, np.atleast_1d(pvalues)):
+            results[trainer][roi][dataset]["pvalue"] = pvalue
+            # Get the best performing baseline mean Dice score
+            results[trainer][roi][dataset]["max_baseline"] = max_baseline
+            if registry is not None:
+                comparisons[dataset][trainer][roi].update(
+                    pvalue=float(pvalue), max_baseline=float(max_baseline)
+                )
+
+    if registry is not None:
+        num_reused = sum(
+            1 for dataset, trainers in comparisons.items() for trainer, rois in trainers.items()
+            for roi, rec in rois.items() if rec is previous.get(dataset, {}).get(trainer, {}).get(roi)
+        )
+        num_computed = sum(len(trainers) for trainers in batches.values())
+        logging.info(f"Statistical tests: {num_computed} computed, {num_reused} reused from registry")
+        # Replace the entries of every dataset present in the results, dropping stale trainers
+        datasets = {d for rois in results.values() for dataset_metrics in rois.values() for d in dataset_metrics}
+        for dataset in datasets:
+            registry["comparisons"][dataset] = comparisons.get(dataset, {})
+
+@lru_cache(maxsize=None)
+def _signed_rank_null_cdf(n: int) -> np.ndarray:
+    """Exact null CDF of the Wilcoxon signed-rank statistic for ``n`` untied, non-zero pairs."""
+    pmf = np.zeros(n * (n + 1) // 2 + 1)
+    pmf[0] = 1.0
+    for k in range(1, n + 1):
+        # Each rank k enters the positive sum with probability 1/2
+        pmf[k:] = (pmf[k:] + pmf[:-k]) / 2
+        pmf[:k] /= 2
+    return np.cumsum(pmf)
+
+def _signed_rank_tied_pvalue(ranks: np.ndarray, r_plus: float) -> float:
+    """
+    Exact two-sided p-value of the signed-rank statistic ``r_plus`` over the given (mid-)ranks,
+    each entering the positive sum with probability 1/2. Mid-ranks are halves, so the sums are
+    counted on doubled ranks.
+    """
+    doubled = np.rint(2 * ranks).astype(int)
+    pmf = np.zeros(doubled.sum() + 1)
+    pmf[0] = 1.0
+    for k in doubled:
+        pmf[k:] = (pmf[k:] + pmf[:-k]) / 2
+        pmf[:k] /= 2
+    cdf = np.cumsum(pmf)
+    r = int(np.rint(2 * r_plus))
+    lower = cdf[r]
+    upper = 1 - (cdf[r - 1] if r > 0 else 0)
+    return float(np.clip(2 * min(lower, upper), 0, 1))
+
+def wilcoxon_signed_rank_batched(diffs: np.ndarray) -> np.ndarray:
+    """
+    Two-sided Wilcoxon signed-rank p-values for every row of a matrix of paired differences.
+
+    Missing pairs are NaN and zero differences are discarded, as in ``scipy.stats.wilcoxon``.
+    Rows of at most 50 pairs use the exact null distribution: a shared table for rows without
+    ties, and the null over the row's own mid-ranks for rows with tied |d| (common when both
+    trainers reach a Dice of 0 or 1), which is what the sign-flip enumeration of
+    ``scipy.stats.wilcoxon`` computes for up to 13 pairs. Larger rows use the normal
+    approximation with tie correction and no continuity correction.
+
+    Parameters:
+        diffs (np.ndarray): Array of shape (comparisons, subjects).
+
+    Returns:
+        np.ndarray: One p-value per row (NaN for rows without any non-zero pair).
+    """
+    d = np.where(diffs == 0, np.nan, diffs)
+    valid = ~np.isnan(d)
+    n = valid.sum(axis=1)
+    abs_d = np.abs(d)
+    ranks = rankdata(abs_d, axis=1, nan_policy="omit")
+    r_plus = np.where(d > 0, ranks, 0).sum(axis=1)
+
+    # Tie correction: sum of (t^3 - t) over the groups of equal |d| within each row
+    rows, cols = np.nonzero(valid)
+    groups, t = np.unique(np.stack([rows, abs_d[rows, cols]], axis=1), axis=0, return_counts=True)
+    tie_term = np.bincount(groups[:, 0].astype(int), weights=t ** 3 - t, minlength=len(d))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        se = np.sqrt((n * (n + 1) * (2 * n + 1) - tie_term / 2) / 24)
+        z = (r_plus - n * (n + 1) / 4) / se
+        pvalues = 2 * norm.sf(np.abs(z))
+
+    exact = (tie_term == 0) & ~np.any(diffs == 0, axis=1) & (n > 0) & (n <= 50)
+    for m in np.unique(n[exact]):
+        rows_m = exact & (n == m)
+        cdf = _signed_rank_null_cdf(int(m))
+        r = r_plus[rows_m].astype(int)
+        lower = cdf[r]
+        upper = 1 - np.where(r > 0, cdf[np.maximum(r - 1, 0)], 0)
+        pvalues[rows_m] = np.clip(2 * np.minimum(lower, upper), 0, 1)
+    for i in np.flatnonzero(~exact & (n > 0) & (n <= 50)):
+        pvalues[i] = _signed_rank_tied_pvalue(ranks[i][valid[i]], r_plus[i])
+    pvalues[n == 0] = np.nan
+    return pvalues
+
+def paired_permutation_batched(diffs: np.ndarray, n_permutations: int = 10000, seed: int = 0,
+                               chunk_size: int = 1000) -> np.ndarray:
+    """
+    Two-sided sign-flip permutation p-values for every row of a matrix of paired differences.
+
+    The statistic is the sum of the differences over the available pairs (NaN = missing).
+    The same random sign flips are shared by all rows, so each chunk of permutations is
+    evaluated for every comparison with a single matrix product.
+
+    Parameters:
+        diffs (np.ndarray): Array of shape (comparisons, subjects).
+        n_permutations (int): Number of random sign flips.
+        seed (int): Seed of the random generator.
+        chunk_size (int): Number of permutations evaluated per matrix product.
+
+    Returns:
+        np.ndarray: One p-value per row (NaN for rows without any pair).
+    """
+    d = np.nan_to_num(diffs, nan=0.0)
+    observed = np.abs(d.sum(axis=1))
+    exceed = np.zeros(len(d))
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_permutations, chunk_size):
+        size = min(chunk_size, n_permutations - start)
+        signs = rng.choice([-1.0, 1.0], size=(size, d.shape[1]))
+        permuted = np.abs(d @ signs.T)
+        exceed += (permuted >= observed[:, np.newaxis] - 1e-12).sum(axis=1)
+    pvalues = (exceed + 1) / (n_permutations + 1)
+    pvalues[(~np.isnan(diffs)).sum(axis=1) == 0] = np.nan
+    return pvalues
+
+def compute_paired_tests(results: dict, test: str = "wilcoxon", n_permutations: int = 10000, seed: int = 0):
+    """
+    Compute paired p-values comparing each non-baseline trainer against the best performing baseline
+    (highest mean Dice) for each ROI and dataset, aligning both on subject IDs.
+
+    All trainer x ROI x dataset comparisons are gathered into one matrix of per-subject Dice
+    differences and tested in a single batched pass, using either the Wilcoxon signed-rank test
+    (``test="wilcoxon"``) or a sign-flip permutation test (``test="permutation"``).
+    The p-value, the best baseline mean and the number of paired subjects are stored in the
+    results dictionary in place, under the same keys as ``compute_statistical_tests``.
+    """
+    if test not in ("wilcoxon", "permutation"):
+        raise ValueError(f"Unknown paired test: {test}")
+
+    best_baselines = {}
+    for trainer, rois in results.items():
+        if not is_baseline(trainer):
+            continue
+        for roi, dataset_metrics in rois.items():
+            for dataset, metrics in dataset_metrics.items():
+                current = best_baselines.get((roi, dataset))
+                if current is None or np.mean(metrics["dice"]) > np.mean(current["dice"]):
+                    best_baselines[(roi, dataset)] = metrics
+
+    comparisons = []
+    rows = []
     for trainer, rois in results.items():
         if is_baseline(trainer):
             continue
         for roi, dataset_metrics in rois.items():
             for dataset, metrics in dataset_metrics.items():
-                baseline_dice = []
-                baseline_means = []
-                for baseline_trainer, baseline_rois in results.items():
-                    if is_baseline(baseline_trainer) and roi in baseline_rois and dataset in baseline_rois[roi]:
-                        b_dice = baseline_rois[roi][dataset]["dice"]
-                        baseline_dice.extend(b_dice)
-                        baseline_means.append(np.mean(b_dice))
-                if baseline_dice and baseline_means:
-                    # Compute p-value using the Mann–Whitney U test
-                    stat, pvalue = mannwhitneyu(metrics["dice"], baseline_dice, alternative='two-sided')
-                    # Get the best performing baseline mean Dice score
-                    max_baseline = max(baseline_means)
-                    results[trainer][roi][dataset]["pvalue"] = pvalue
-                    results[trainer][roi][dataset]["max_baseline"] = max_baseline
+                reference = best_baselines.get((roi, dataset))
+                if reference is None:
+                    continue
+                if "subjects" not in metrics or "subjects" not in reference:
+                    logging.warning(f"No subject IDs for {trainer}/{roi}/{dataset}. Skipping paired test.")
+                    continue
+                reference_subjects = pd.Index(reference["subjects"])
+                trainer_subjects = pd.Index(metrics["subjects"])
+                if reference_subjects.has_duplicates or trainer_subjects.has_duplicates:
+                    logging.warning(f"Duplicate subject IDs for {trainer}/{roi}/{dataset} or its baseline. "
+                                    f"Skipping paired test.")
+                    continue
+                # Align the trainer's Dice values on the subjects of the reference baseline
+                index = reference_subjects.get_indexer(trainer_subjects)
+                aligned = np.full(len(reference["subjects"]), np.nan)
+                aligned[index[index >= 0]] = np.asarray(metrics["dice"], dtype=float)[index >= 0]
+                rows.append(aligned - np.asarray(reference["dice"], dtype=float))
+                comparisons.append((trainer, roi, dataset, np.mean(reference["dice"])))
+
+    if not comparisons:
+        return
+
+    diffs = np.full((len(rows), max(len(r) for r in rows)), np.nan)
+    for i, row in enumerate(rows):
+        diffs[i, :len(row)] = row
+
+    if test == "wilcoxon":
+        pvalues = wilcoxon_signed_rank_batched(diffs)
+    else:
+        pvalues = paired_permutation_batched(diffs, n_permutations=n_permutations, seed=seed)
+
+    n_paired = (~np.isnan(diffs)).sum(axis=1)
+    for (trainer, roi, dataset, max_baseline), pvalue, n in zip(comparisons, pvalues, n_paired):
+        results[trainer][roi][dataset]["pvalue"] = pvalue
+        results[trainer][roi][dataset]["max_baseline"] = max_baseline
+        results[trainer][roi][dataset]["n_paired"] = int(n)
 
 def determine_best_scores(results: dict, dataset_names: list, trainers: list, all_rois: list) -> dict:
     """
@@ -305,11 +707,15 @@ def main():
     }
     
     dataset_folders = get_dataset_folders(base_dir, selected_datasets, dataset_map)
+    cache_dir = None if args.no_cache else args.cache_dir
+    registry_path = os.path.join(output_folder, "results_registry.json")
+    registry = None if args.no_cache else load_registry(registry_path)
     
     results = {}
     dataset_names = []
     for dataset_path in dataset_folders:
-        dataset_name = process_dataset_folder(dataset_path, results)
+        dataset_name = process_dataset_folder(dataset_path, results, cache_dir=cache_dir,
+                                              max_workers=args.workers, registry=registry)
         if dataset_name not in dataset_names:
             dataset_names.append(dataset_name)
     
@@ -322,7 +728,12 @@ def main():
     trainers = sorted(list(results.keys()))
     
     # Compute statistical tests comparing each trainer to the baseline
-    compute_statistical_tests(results)
+    if args.test == "mannwhitneyu":
+        compute_statistical_tests(results, registry=registry)
+    else:
+        compute_paired_tests(results, test=args.test, n_permutations=args.permutations, seed=args.seed)
+    if registry is not None:
+        save_registry(registry, registry_path)
     
     # Determine the best trainer (highest mean Dice) for each ROI and dataset
     best_scores = determine_best_scores(results, dataset_names, trainers, all_rois)
@@ -1,17 +1,39 @@
+"""
+Remap a TotalSegmentator multi-label segmentation to the PSAT 13-label scheme.
+
+Usage:
+    python scripts/remap_labels.py <input_segmentation> <output_segmentation>
+    python scripts/remap_labels.py --input-dir <dir> --output-dir <dir> [--workers N] [--force]
+    python scripts/remap_labels.py --manifest <manifest.csv> [--workers N] [--force]
+
+Add ``--compression-level`` (0 for intermediate files) and ``--threads`` to control how
+the output is compressed (see ``nifti_writer.py``).
+
+In batch mode all files are remapped in a single process pool; outputs newer than their
+input are skipped unless ``--force`` is given. A manifest lists one ``input,output`` pair
+per line.
+
+The remapping is a single lookup-table gather over the volume, built once from
+``total_mapping`` and ``desired_mapping``; the output is written as uint8.
+"""
+
+import argparse
+import csv
+import logging
+import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
 import nibabel as nib
 import numpy as np
 
-if len(sys.argv) != 3:
-    print("Usage: remap_labels.py <input_segmentation> <output_segmentation>")
-    sys.exit(1)
-
-input_file = sys.argv[1]
-output_file = sys.argv[2]
-
-# Load the segmentation image
-img = nib.load(input_file)
-data = img.get_fdata().astype(np.int16)
+try:
+    from scripts.nifti_writer import DEFAULT_COMPRESSION_LEVEL, save_nifti
+except ImportError:  # executed as a script from the scripts folder
+    from nifti_writer import DEFAULT_COMPRESSION_LEVEL, save_nifti
 
 # Full TotalSegmentator mapping
 total_mapping = {
@@ -152,15 +174,197 @@ desired_mapping = {
     # Add additional mappings if needed.
 }
 
-# Create a new data array for the remapped segmentation.
-new_data = np.copy(data)
 
-# Iterate through each label in the TotalSegmentator mapping.
-for orig_label, structure in total_mapping.items():
-    # Determine the new label
-    new_label = desired_mapping.get(structure, 0)
-    new_data[data == orig_label] = new_label
+def build_lookup_table(total_mapping: dict = total_mapping, desired_mapping: dict = desired_mapping) -> np.ndarray:
+    """Build the array mapping each TotalSegmentator label to its PSAT label (0 if unmapped)."""
+    lut = np.zeros(max(total_mapping) + 1, dtype=np.uint8)
+    for orig_label, structure in total_mapping.items():
+        lut[orig_label] = desired_mapping.get(structure, 0)
+    return lut
+
+
+LOOKUP_TABLE = build_lookup_table()
+
+
+def load_label_array(img: nib.Nifti1Image) -> np.ndarray:
+    """Return the label array of an image in its on-disk integer dtype, avoiding a float64 copy."""
+    data = np.asanyarray(img.dataobj)
+    if not np.issubdtype(data.dtype, np.integer):
+        data = data.astype(np.int16)
+    return data
+
+
+def remap_array(data: np.ndarray, lut: np.ndarray = LOOKUP_TABLE, strict: bool = False) -> np.ndarray:
+    """Remap an integer label array with a single lookup-table gather.
+
+    Labels outside the lookup table are left unchanged, as the per-label loop this replaces
+    did, with a warning; the result then keeps the input dtype. With ``strict`` they raise a
+    ``ValueError`` instead.
+    """
+    if data.size == 0 or (data.min() >= 0 and data.max() < len(lut)):
+        return lut[data]
+    message = f"Labels must lie in [0, {len(lut) - 1}], got [{data.min()}, {data.max()}]"
+    if strict:
+        raise ValueError(message)
+    logging.warning(f"{message}; leaving the labels outside the lookup table unchanged")
+    outside = (data < 0) | (data >= len(lut))
+    remapped = lut[np.where(outside, 0, data)].astype(data.dtype)
+    remapped[outside] = data[outside]
+    return remapped
+
+
+def remap_image(img: nib.Nifti1Image, lut: np.ndarray = LOOKUP_TABLE) -> nib.Nifti1Image:
+    """Remap a segmentation image, keeping its affine and header and storing labels as uint8.
+
+    Labels outside the lookup table are kept, in the input dtype (see ``remap_array``).
+    """
+    remapped = remap_array(load_label_array(img), lut)
+    new_img = nib.Nifti1Image(remapped, img.affine, img.header)
+    new_img.set_data_dtype(remapped.dtype)
+    return new_img
+
+
+def remap_file(input_file: str, output_file: str, lut: np.ndarray = LOOKUP_TABLE,
+               compression_level: int = DEFAULT_COMPRESSION_LEVEL, threads: int = 1) -> None:
+    """Load a segmentation, remap its labels and save it with the same header and affine."""
+    save_nifti(remap_image(nib.load(input_file), lut), output_file,
+               compression_level=compression_level, threads=threads)
+
+
+def is_up_to_date(input_file: str, output_file: str) -> bool:
+    """Return True if the output exists and is at least as recent as the input."""
+    return os.path.exists(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(input_file)
+
+
+def jobs_from_directory(input_dir: str, output_dir: str) -> list:
+    """Pair every NIfTI file of ``input_dir`` with a ``.nii.gz`` output of the same name in ``output_dir``."""
+    jobs = []
+    for path in sorted(Path(input_dir).iterdir()):
+        if path.name.endswith(".nii.gz") or path.name.endswith(".nii"):
+            base = path.name[:-len(".nii.gz")] if path.name.endswith(".nii.gz") else path.name[:-len(".nii")]
+            jobs.append((str(path), str(Path(output_dir) / f"{base}.nii.gz")))
+    return jobs
+
+
+def jobs_from_manifest(manifest: str) -> list:
+    """Read ``input,output`` pairs from a manifest CSV (an ``input,output`` header line is optional)."""
+    with open(manifest, newline="") as f:
+        rows = [row for row in csv.reader(f) if row]
+    if rows and [c.strip() for c in rows[0]] == ["input", "output"]:
+        rows = rows[1:]
+    return [(row[0].strip(), row[1].strip()) for row in rows]
+
+
+def _remap_job(job: tuple, **save_kwargs) -> dict:
+    """Remap one (input, output) pair and report its status and timing."""
+    input_file, output_file = job
+    start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+        remap_file(input_file, output_file, **save_kwargs)
+        status, error = "done", None
+    except Exception as e:
+        status, error = "failed", f"{type(e).__name__}: {e}"
+    return {"input": input_file, "output": output_file, "status": status,
+            "seconds": time.perf_counter() - start, "error": error}
+
+
+def remap_batch(jobs: list, workers: int = 1, force: bool = False,
+                compression_level: int = DEFAULT_COMPRESSION_LEVEL, threads: int = 1) -> list:
+    """
+    Remap many segmentations in one process.
+
+    Parameters
+    ----------
+    jobs : list
+        ``(input, output)`` path pairs.
+    workers : int
+        Size of the process pool; 1 processes the files sequentially.
+    force : bool
+        Also remap files whose output is already up to date.
+    compression_level : int
+        gzip level of the outputs (0 for intermediate files).
+    threads : int
+        Compression threads per output file.
+
+    Returns
+    -------
+    list
+        One dict per job with ``input``, ``output``, ``status`` (``done``, ``skipped`` or
+        ``failed``), ``seconds`` and ``error``.
+    """
+    job_fn = partial(_remap_job, compression_level=compression_level, threads=threads)
+    reports = []
+    pending = []
+    for input_file, output_file in jobs:
+        if not force and is_up_to_date(input_file, output_file):
+            reports.append({"input": input_file, "output": output_file, "status": "skipped",
+                            "seconds": 0.0, "error": None})
+        else:
+            pending.append((input_file, output_file))
+
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(job_fn, pending)
+            for report in results:
+                _log_report(report)
+                reports.append(report)
+    else:
+        for job in pending:
+            report = job_fn(job)
+            _log_report(report)
+            reports.append(report)
+    return reports
+
+
+def _log_report(report: dict) -> None:
+    if report["status"] == "failed":
+        logging.error(f"Failed {report['input']} after {report['seconds']:.2f}s: {report['error']}")
+    else:
+        logging.info(f"Remapped {report['input']} -> {report['output']} in {report['seconds']:.2f}s")
+
+
+def parse_arguments(argv=None):
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Remap TotalSegmentator labels to the PSAT labeling scheme.")
+    parser.add_argument("input_segmentation", nargs="?", help="Single input segmentation.")
+    parser.add_argument("output_segmentation", nargs="?", help="Single output segmentation.")
+    parser.add_argument("--input-dir", help="Batch mode: directory of input segmentations.")
+    parser.add_argument("--output-dir", help="Batch mode: directory receiving the remapped segmentations.")
+    parser.add_argument("--manifest", help="Batch mode: CSV of input,output pairs.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Size of the process pool.")
+    parser.add_argument("--force", action="store_true", help="Remap files whose output is up to date.")
+    parser.add_argument("--compression-level", type=int, default=DEFAULT_COMPRESSION_LEVEL,
+                        help="gzip level of the outputs, 0 to skip compression.")
+    parser.add_argument("--threads", type=int, default=1, help="Compression threads per output file.")
+    args = parser.parse_args(argv)
+
+    single = args.input_segmentation is not None and args.output_segmentation is not None
+    directory = args.input_dir is not None and args.output_dir is not None
+    if sum([single, directory, args.manifest is not None]) != 1:
+        parser.error("give either <input_segmentation> <output_segmentation>, "
+                     "--input-dir and --output-dir, or --manifest")
+    return args
+
+
+def main(argv=None) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    args = parse_arguments(argv)
+    if args.input_segmentation is not None:
+        remap_file(args.input_segmentation, args.output_segmentation,
+                   compression_level=args.compression_level, threads=args.threads)
+        return
+
+    jobs = jobs_from_manifest(args.manifest) if args.manifest else jobs_from_directory(args.input_dir, args.output_dir)
+    start = time.perf_counter()
+    reports = remap_batch(jobs, workers=args.workers, force=args.force,
+                          compression_level=args.compression_level, threads=args.threads)
+    counts = {status: sum(r["status"] == status for r in reports) for status in ("done", "skipped", "failed")}
+    logging.info(f"{counts['done']} remapped, {counts['skipped']} up to date, {counts['failed']} failed "
+                 f"in {time.perf_counter() - start:.2f}s")
+    if counts["failed"]:
+        sys.exit(1)
+
 
-# Save the new segmentation with the same header and affine.
-new_img = nib.Nifti1Image(new_data, img.affine, img.header)
-nib.save(new_img, output_file)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Rasterize RTSTRUCT contours directly into a single PSAT multi-label volume on the CT grid.
+
+Instead of writing one compressed mask per structure (``dcmrtstruct2nii``) and merging them
+afterwards, the contours of every structure mapped to a PSAT label are filled slice by slice
+into one uint8 volume, written as a single ``.nii.gz`` per patient.
+
+Polygons are filled with the even-odd rule using a vectorized scanline: the crossings of all
+polygon edges with all pixel rows are computed at once and toggled into a difference array
+whose cumulative sum along the row gives the inside mask. Contours of the same structure on
+the same slice are combined with XOR, so inner contours cut holes.
+
+Usage:
+    python scripts/rtstruct_to_labelmap.py <rtstruct.dcm> <ct_dir> <output.nii.gz>
+
+Dependencies:
+    - pydicom
+    - nibabel
+    - numpy
+"""
+
+import argparse
+import logging
+import re
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+
+try:
+    from scripts.nifti_writer import save_nifti
+except ImportError:  # executed as a script from the scripts folder
+    from nifti_writer import save_nifti
+
+# PSAT labels, as in compute_metrics.py
+PSAT_LABELS = {
+    "Spleen": 1,
+    "Kidney-Right": 2,
+    "Kidney-Left": 3,
+    "Gall-Bladder": 4,
+    "Liver": 5,
+    "Stomach": 6,
+    "Pancreas": 7,
+    "Esophagus": 8,
+    "Small-Intestine": 9,
+    "Duodenum": 10,
+    "Bladder": 11,
+    "Prostate": 12,
+    "Spinal-Canal": 13,
+}
+
+# Additional ROI name spellings, compared after normalization (lowercase letters only)
+ROI_ALIASES = {
+    "kidneyr": 2, "rkidney": 2, "rightkidney": 2,
+    "kidneyl": 3, "lkidney": 3, "leftkidney": 3,
+    "gallbladder": 4,
+    "oesophagus": 8,
+    "smallbowel": 9, "bowelsmall": 9,
+    "urinarybladder": 11,
+    "spinalcord": 13,
+}
+
+
+def normalize_roi_name(name: str) -> str:
+    return re.sub(r"[^a-z]", "", name.lower())
+
+
+def psat_label(roi_name: str) -> int:
+    """Return the PSAT label of an RTSTRUCT ROI name, or 0 if the structure is not part of PSAT."""
+    key = normalize_roi_name(roi_name)
+    for name, label in PSAT_LABELS.items():
+        if normalize_roi_name(name) == key:
+            return label
+    return ROI_ALIASES.get(key, 0)
+
+
+def ct_geometry(headers: list) -> tuple:
+    """Sort CT slice headers along the slice normal and derive the voxel-to-patient (LPS) matrix.
+
+    Returns
+    -------
+    tuple
+        The sorted headers and the 4x4 matrix mapping (column, row, slice) indices to LPS mm.
+    """
+    orientation = np.array(headers[0].ImageOrientationPatient, dtype=float)
+    row_dir, col_dir = orientation[:3], orientation[3:]
+    normal = np.cross(row_dir, col_dir)
+    headers = sorted(headers, key=lambda ds: float(np.dot(normal, np.array(ds.ImagePositionPatient, dtype=float))))
+    origin = np.array(headers[0].ImagePositionPatient, dtype=float)
+    row_spacing, col_spacing = (float(v) for v in headers[0].PixelSpacing)
+    if len(headers) > 1:
+        slice_step = np.array(headers[-1].ImagePositionPatient, dtype=float) - origin
+        slice_step /= len(headers) - 1
+    else:
+        slice_step = normal * float(getattr(headers[0], "SliceThickness", 1.0))
+
+    matrix = np.eye(4)
+    matrix[:3, 0] = row_dir * col_spacing
+    matrix[:3, 1] = col_dir * row_spacing
+    matrix[:3, 2] = slice_step
+    matrix[:3, 3] = origin
+    return headers, matrix
+
+
+def fill_polygon(vertices: np.ndarray, shape: tuple) -> np.ndarray:
+    """Even-odd fill of a polygon given in (column, row) voxel coordinates.
+
+    Pixel centres lie at integer coordinates. Centres on the contour itself count as inside, so
+    a contour through pixel centres keeps all its boundary pixels on every side (the square
+    (1, 1)-(4, 3) fills columns 1 to 4 and rows 1 to 3). Returns a boolean mask of ``shape`` =
+    (columns, rows).
+    """
+    n_cols, n_rows = shape
+    x, y = vertices[:, 0], vertices[:, 1]
+    x1, y1, x2, y2 = x, y, np.roll(x, -1), np.roll(y, -1)
+    rows = np.arange(max(0, int(np.ceil(y.min()))), min(n_rows, int(np.floor(y.max())) + 1))
+    mask = np.zeros(shape, dtype=bool)
+    if len(rows) == 0:
+        return mask
+
+    # Crossings of every edge with every pixel row (half-open rule avoids double counting vertices)
+    ry = rows[:, np.newaxis].astype(float)
+    crosses = (y1 > ry) != (y2 > ry)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_cross = x1 + (ry - y1) * (x2 - x1) / (y2 - y1)
+    row_idx, edge_idx = np.nonzero(crosses)
+    # First pixel centre to the right of each crossing toggles the inside state
+    first_col = np.clip(np.ceil(x_cross[row_idx, edge_idx]).astype(int), 0, n_cols)
+    toggles = np.zeros((len(rows), n_cols + 1), dtype=np.int32)
+    np.add.at(toggles, (row_idx, first_col), 1)
+    inside = (np.cumsum(toggles, axis=1)[:, :n_cols] % 2).astype(bool)
+
+    # Pixel centres on the contour: on sloped edges where the crossing falls on a centre, and along horizontal edges
+    sloped = (y1 != y2) & (ry >= np.minimum(y1, y2)) & (ry <= np.maximum(y1, y2))
+    row_idx, edge_idx = np.nonzero(sloped)
+    cols = x_cross[row_idx, edge_idx]
+    on_centre = (np.abs(cols - np.round(cols)) < 1e-6) & (cols > -0.5) & (cols < n_cols - 0.5)
+    inside[row_idx[on_centre], np.round(cols[on_centre]).astype(int)] = True
+    row_idx, edge_idx = np.nonzero((y1 == y2) & (ry == y1))
+    for r, e in zip(row_idx, edge_idx):
+        lo, hi = sorted((x1[e], x2[e]))
+        inside[r, max(0, int(np.ceil(lo))):min(n_cols, int(np.floor(hi)) + 1)] = True
+    mask[:, rows] = inside.T
+    return mask
+
+
+def rasterize_rtstruct(rtstruct, ct_headers: list, label_fn=psat_label) -> tuple:
+    """Rasterize the contours of an RTSTRUCT dataset onto the CT grid.
+
+    Parameters
+    ----------
+    rtstruct : pydicom.Dataset
+        RTSTRUCT dataset.
+    ct_headers : list
+        Headers of the CT slices (pixel data is not needed).
+    label_fn : callable
+        Maps an ROI name to its label (0 to skip the structure).
+
+    Returns
+    -------
+    tuple
+        The uint8 label volume indexed (column, row, slice), the NIfTI (RAS) affine and the
+        list of ROI names that were not mapped to a label.
+    """
+    headers, lps_matrix = ct_geometry(ct_headers)
+    shape = (int(headers[0].Columns), int(headers[0].Rows), len(headers))
+    labels = np.zeros(shape, dtype=np.uint8)
+    to_voxel = np.linalg.inv(lps_matrix)
+
+    roi_names = {int(roi.ROINumber): str(roi.ROIName) for roi in rtstruct.StructureSetROISequence}
+    roi_labels = {number: label_fn(name) for number, name in roi_names.items()}
+    skipped = sorted(name for number, name in roi_names.items() if roi_labels[number] == 0)
+
+    # Paint in increasing label order so that overlaps resolve deterministically
+    roi_contours = sorted(rtstruct.ROIContourSequence, key=lambda rc: roi_labels.get(int(rc.ReferencedROINumber), 0))
+    for roi_contour in roi_contours:
+        label = roi_labels.get(int(roi_contour.ReferencedROINumber), 0)
+        if label == 0:
+            continue
+        slice_masks = {}
+        for contour in getattr(roi_contour, "ContourSequence", []):
+            points = np.asarray(contour.ContourData, dtype=float).reshape(-1, 3)
+            # Round away floating point noise so vertices on pixel centres are filled consistently
+            voxels = np.round((to_voxel @ np.c_[points, np.ones(len(points))].T).T[:, :3], 6)
+            k = int(np.round(voxels[:, 2].mean()))
+            if not 0 <= k < shape[2] or len(voxels) < 3:
+                continue
+            mask = fill_polygon(voxels[:, :2], shape[:2])
+            slice_masks[k] = slice_masks[k] ^ mask if k in slice_masks else mask
+        for k, mask in slice_masks.items():
+            labels[:, :, k][mask] = label
+
+    # DICOM patient coordinates are LPS, NIfTI world coordinates are RAS
+    affine = np.diag([-1.0, -1.0, 1.0, 1.0]) @ lps_matrix
+    return labels, affine, skipped
+
+
+def convert_to_labelmap(rtstruct_file: str, ct_dir: str, output_file: str, compression_level: int = 1,
+                        ct_headers: list = None) -> list:
+    """Rasterize an RTSTRUCT file onto its CT series and save the PSAT label map.
+
+    ``ct_headers`` may provide the CT geometry directly (e.g. from ``dicom_index.headers_from_index``),
+    in which case the CT files are not read.
+
+    Returns
+    -------
+    list
+        The ROI names that are not part of the PSAT labels.
+    """
+    import pydicom
+
+    if ct_headers is None:
+        ct_headers = [pydicom.dcmread(str(p), stop_before_pixels=True) for p in sorted(Path(ct_dir).glob("*.dcm"))]
+    if not ct_headers:
+        raise FileNotFoundError(f"No CT DICOM files in {ct_dir}")
+    labels, affine, skipped = rasterize_rtstruct(pydicom.dcmread(str(rtstruct_file)), ct_headers)
+    save_nifti(nib.Nifti1Image(labels, affine), str(output_file), compression_level=compression_level,
+               label_map=True)
+    return skipped
+
+
+def rtstruct_to_labelmap_dir(rtstruct_file: Path, ct_dir: Path, output_dir: Path, ct_headers: list = None) -> None:
+    """RTSTRUCT converter for ``convert_icans.py`` writing ``output_dir/psat_labels.nii.gz``."""
+    skipped = convert_to_labelmap(rtstruct_file, ct_dir, Path(output_dir) / "psat_labels.nii.gz",
+                                  ct_headers=ct_headers)
+    if skipped:
+        logging.info(f"Structures without PSAT label: {', '.join(skipped)}")
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Rasterize an RTSTRUCT into a PSAT multi-label volume.")
+    parser.add_argument("rtstruct", help="RTSTRUCT DICOM file.")
+    parser.add_argument("ct_dir", help="Folder of the referenced CT series.")
+    parser.add_argument("output", help="Output label map (.nii.gz).")
+    args = parser.parse_args()
+    skipped = convert_to_labelmap(args.rtstruct, args.ct_dir, args.output)
+    if skipped:
+        logging.info(f"Structures without PSAT label: {', '.join(skipped)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,9 @@
 #
 # Usage:
 #   ./segment_folder.sh /path/to/input_folder /path/to/output_folder
+#
+# See scripts/run_totalsegmentator.py for a resumable Python orchestrator
+# with per-case timing, exit status and memory-bounded concurrency.
 
 # Check for two arguments
 if [ "$#" -ne 2 ]; then
@@ -51,7 +54,7 @@ process_file() {
     mkdir -p "$FILE_TMP_DIR"
 
     # Run TotalSegmentator generating all classes with multi-label output
-    if ! TotalSegmentator -i "$file" -o "$FILE_TMP_DIR" --ml; then
+    if ! TotalSegmentator -i "$file" -o "$FILE_TMP_DIR/$base.nii" --ml; then
         echo "TotalSegmentator failed for $file; skipping."
         return
     fi
@@ -61,19 +64,14 @@ process_file() {
     ls -l "$FILE_TMP_DIR"
 
     # Find the segmentation file produced by TotalSegmentator.
-    local SEG_FILE=$(find "$TMP_DIR" -maxdepth 1 -name "$base.nii" | head -n 1)
+    local SEG_FILE=$(find "$FILE_TMP_DIR" -maxdepth 1 -name "$base.nii" | head -n 1)
     if [ -z "$SEG_FILE" ]; then
         echo "No segmentation file found for $file; skipping."
         return
     fi
 
-    # Run the Python script to remap labels
-    if ! python3 scripts/remap_labels.py "$SEG_FILE" "$OUTPUT_FOLDER/${base}.nii.gz"; then
-        echo "Label remapping failed for $file; skipping."
-        return
-    fi
-
-    echo "Saved remapped segmentation as ${base}.nii.gz in $OUTPUT_FOLDER"
+    # Queue the segmentation for label remapping, done for all files in one process below
+    echo "$SEG_FILE,$OUTPUT_FOLDER/${base}.nii.gz" >> "$TMP_DIR/remap_manifest.csv"
 }
 
 export -f process_file
@@ -83,6 +81,13 @@ export OUTPUT_FOLDER
 # Loop over all nii.gz files in the input folder and process them in parallel
 find "$INPUT_FOLDER" -name "*.nii.gz" -print0 | xargs -0 -n 1 -P 4 bash -c 'process_file "$@"' _
 
+# Remap all segmentations to the custom label mapping in a single process
+if [ -f "$TMP_DIR/remap_manifest.csv" ]; then
+    if ! python3 scripts/remap_labels.py --manifest "$TMP_DIR/remap_manifest.csv" --workers 4; then
+        echo "Label remapping failed for some files."
+    fi
+fi
+
 # Clean up temporary files
 rm -rf "$TMP_DIR"
 echo "Processing complete."
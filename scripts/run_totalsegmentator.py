@@ -0,0 +1,211 @@
+"""
+Resumable, instrumented orchestrator for baseline TotalSegmentator runs.
+
+Replaces ``run_TotalSegmentator.sh``: every ``*.nii.gz`` of the input folder is segmented
+with an external segmenter command, remapped to the PSAT labels and written to the output
+folder. Compared to the shell script:
+
+- concurrency is bounded by both the CPU count and the available memory,
+- a JSON job manifest records timing and exit status per case, so reruns skip the cases
+  that already completed (unless their input changed),
+- each case runs in its own temporary directory, removed once the case is done.
+
+Usage:
+    python scripts/run_totalsegmentator.py <input_folder> <output_folder> [--workers N]
+        [--mem-per-job-gb 8] [--segmenter-cmd "TotalSegmentator -i {input} -o {output} --ml"]
+
+The segmenter command is a template receiving ``{input}`` (the CT volume) and ``{output}``
+(the multi-label segmentation file it must write), which allows testing with a dummy command.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shlex
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+try:
+    from scripts.nifti_writer import DEFAULT_COMPRESSION_LEVEL
+    from scripts.remap_labels import remap_file
+except ImportError:  # executed as a script from the scripts folder
+    from nifti_writer import DEFAULT_COMPRESSION_LEVEL
+    from remap_labels import remap_file
+
+DEFAULT_SEGMENTER_CMD = "TotalSegmentator -i {input} -o {output} --ml"
+MANIFEST_NAME = ".segmentation_manifest.json"
+
+
+def available_memory_bytes() -> int:
+    """Return the memory available for new processes, in bytes."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def default_concurrency(mem_per_job_gb: float) -> int:
+    """Number of concurrent cases allowed by the CPU count and the available memory."""
+    by_memory = int(available_memory_bytes() // (mem_per_job_gb * 1024 ** 3))
+    return max(1, min(os.cpu_count() or 1, by_memory))
+
+
+def load_manifest(path: Path) -> dict:
+    """Load the job manifest, or start an empty one."""
+    if path.exists():
+        try:
+            return json.loads(path.read_text())
+        except ValueError as e:
+            logging.warning(f"Ignoring unreadable manifest {path}: {e}")
+    return {}
+
+
+def save_manifest(manifest: dict, path: Path) -> None:
+    """Atomically write the job manifest."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=1, sort_keys=True))
+    os.replace(tmp_path, path)
+
+
+def input_fingerprint(path: Path) -> list:
+    st = path.stat()
+    return [st.st_mtime_ns, st.st_size]
+
+
+def is_completed(entry: dict, input_file: Path, output_file: Path) -> bool:
+    """A case is complete if it succeeded on the same input and its output still exists."""
+    return (
+        entry is not None
+        and entry.get("status") == "done"
+        and entry.get("input_fingerprint") == input_fingerprint(input_file)
+        and output_file.exists()
+    )
+
+
+def process_case(input_file: Path, output_file: Path, segmenter_cmd: str,
+                 compression_level: int = DEFAULT_COMPRESSION_LEVEL) -> dict:
+    """Segment and remap one case in its own temporary directory.
+
+    Returns
+    -------
+    dict
+        Manifest entry with ``status``, ``exit_code``, timings and the error message if any.
+    """
+    case = input_file.name[: -len(".nii.gz")]
+    entry = {"input": str(input_file), "output": str(output_file),
+             "input_fingerprint": input_fingerprint(input_file), "exit_code": None, "error": None}
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix=f"psat_{case}_") as tmp_dir:
+        # Uncompressed intermediate: it is read back once and deleted
+        seg_file = Path(tmp_dir) / f"{case}.nii"
+        cmd = [arg.format(input=input_file, output=seg_file) for arg in shlex.split(segmenter_cmd)]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        entry["exit_code"] = proc.returncode
+        entry["segmentation_seconds"] = round(time.perf_counter() - start, 3)
+        if proc.returncode != 0:
+            entry["status"] = "failed"
+            entry["error"] = proc.stderr.strip()[-2000:] or f"segmenter exited with {proc.returncode}"
+        elif not seg_file.exists():
+            entry["status"] = "failed"
+            entry["error"] = f"segmenter did not write {seg_file.name}"
+        else:
+            try:
+                output_file.parent.mkdir(parents=True, exist_ok=True)
+                remap_file(str(seg_file), str(output_file), compression_level=compression_level)
+                entry["status"] = "done"
+            except Exception as e:
+                entry["status"] = "failed"
+                entry["error"] = f"{type(e).__name__}: {e}"
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def run(input_folder: str, output_folder: str, segmenter_cmd: str = DEFAULT_SEGMENTER_CMD,
+        workers: int = None, mem_per_job_gb: float = 8.0, force: bool = False,
+        compression_level: int = DEFAULT_COMPRESSION_LEVEL) -> dict:
+    """Segment every ``*.nii.gz`` of ``input_folder`` that is not already completed.
+
+    Manifest entries of cases whose input no longer exists are dropped, so that they are not
+    reported as failures forever.
+
+    Returns
+    -------
+    dict
+        The updated manifest, keyed by case name.
+    """
+    output_dir = Path(output_folder)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+
+    input_files = sorted(Path(input_folder).glob("*.nii.gz"))
+    cases = {input_file.name[: -len(".nii.gz")] for input_file in input_files}
+    removed = sorted(case for case in manifest if case not in cases)
+    if removed:
+        logging.info(f"Dropping {len(removed)} manifest entries without input: {', '.join(removed)}")
+        for case in removed:
+            del manifest[case]
+        save_manifest(manifest, manifest_path)
+
+    pending = []
+    for input_file in input_files:
+        case = input_file.name[: -len(".nii.gz")]
+        output_file = output_dir / input_file.name
+        if not force and is_completed(manifest.get(case), input_file, output_file):
+            continue
+        pending.append((case, input_file, output_file))
+
+    workers = workers or default_concurrency(mem_per_job_gb)
+    logging.info(f"{len(pending)} cases to segment ({len(manifest)} in manifest), {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(process_case, input_file, output_file, segmenter_cmd, compression_level): case
+            for case, input_file, output_file in pending
+        }
+        for future in as_completed(futures):
+            case = futures[future]
+            entry = future.result()
+            manifest[case] = entry
+            save_manifest(manifest, manifest_path)
+            if entry["status"] == "done":
+                logging.info(f"{case}: done in {entry['seconds']:.1f}s")
+            else:
+                logging.error(f"{case}: failed (exit code {entry['exit_code']}) in {entry['seconds']:.1f}s: "
+                              f"{entry['error']}")
+    return manifest
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Run TotalSegmentator on a folder and remap to PSAT labels.")
+    parser.add_argument("input_folder", help="Folder of CT volumes (*.nii.gz).")
+    parser.add_argument("output_folder", help="Folder receiving the PSAT label maps and the job manifest.")
+    parser.add_argument("--segmenter-cmd", default=DEFAULT_SEGMENTER_CMD,
+                        help="Segmenter command template with {input} and {output} placeholders.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Concurrent cases (default: bounded by CPU count and available memory).")
+    parser.add_argument("--mem-per-job-gb", type=float, default=8.0,
+                        help="Memory budget of one case, used to bound the default concurrency.")
+    parser.add_argument("--compression-level", type=int, default=DEFAULT_COMPRESSION_LEVEL,
+                        help="gzip level of the output label maps.")
+    parser.add_argument("--force", action="store_true", help="Segment completed cases again.")
+    args = parser.parse_args()
+
+    manifest = run(args.input_folder, args.output_folder, args.segmenter_cmd, args.workers,
+                   args.mem_per_job_gb, args.force, args.compression_level)
+    failed = sorted(case for case, entry in manifest.items() if entry["status"] != "done")
+    if failed:
+        logging.error(f"{len(failed)} cases failed: {', '.join(failed)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
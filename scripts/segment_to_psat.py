@@ -0,0 +1,110 @@
+"""
+Segment CT volumes with TotalSegmentator and write PSAT label maps, without temporary files.
+
+The TotalSegmentator multi-label result is kept in memory, remapped to the PSAT 13-label
+scheme with the lookup table of ``remap_labels.py`` and only the final label map is written.
+
+Usage:
+    python scripts/segment_to_psat.py <input.nii.gz> <output.nii.gz> [--device gpu] [--fast]
+    python scripts/segment_to_psat.py <input_dir> <output_dir> [--device gpu] [--fast]
+
+Dependencies:
+    - nibabel
+    - numpy
+    - TotalSegmentator
+"""
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Callable
+
+import nibabel as nib
+import numpy as np
+
+try:
+    from scripts.nifti_writer import DEFAULT_COMPRESSION_LEVEL, save_nifti
+    from scripts.remap_labels import LOOKUP_TABLE, remap_image
+except ImportError:  # executed as a script from the scripts folder
+    from nifti_writer import DEFAULT_COMPRESSION_LEVEL, save_nifti
+    from remap_labels import LOOKUP_TABLE, remap_image
+
+
+def run_totalsegmentator(img: nib.Nifti1Image, device: str = "gpu", fast: bool = False) -> nib.Nifti1Image:
+    """Run TotalSegmentator on an in-memory image and return its multi-label segmentation."""
+    from totalsegmentator.python_api import totalsegmentator
+
+    return totalsegmentator(img, None, ml=True, fast=fast, device=device, quiet=True)
+
+
+def segment_to_psat(
+    input_file: str,
+    output_file: str,
+    segment_fn: Callable[[nib.Nifti1Image], nib.Nifti1Image] = run_totalsegmentator,
+    lut: np.ndarray = LOOKUP_TABLE,
+    compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+    threads: int = 1,
+) -> None:
+    """Segment one CT volume and save its PSAT label map.
+
+    Parameters
+    ----------
+    input_file : str
+        CT volume (NIfTI).
+    output_file : str
+        Output PSAT label map (uint8 NIfTI).
+    segment_fn : callable
+        Maps a CT image to a TotalSegmentator multi-label image, ``run_totalsegmentator`` by default.
+    lut : numpy.ndarray
+        TotalSegmentator-to-PSAT lookup table.
+    compression_level : int
+        gzip level of the output (0 for intermediate files).
+    threads : int
+        Compression threads.
+    """
+    segmentation = segment_fn(nib.load(input_file))
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    save_nifti(remap_image(segmentation, lut), output_file, compression_level=compression_level, threads=threads)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Segment CT volumes with TotalSegmentator into PSAT label maps.")
+    parser.add_argument("input", help="CT volume or directory of CT volumes (*.nii.gz).")
+    parser.add_argument("output", help="Output label map or directory.")
+    parser.add_argument("--device", default="gpu", help="TotalSegmentator device (gpu, cpu, mps).")
+    parser.add_argument("--fast", action="store_true", help="Use the fast (3mm) TotalSegmentator model.")
+    parser.add_argument("--compression-level", type=int, default=DEFAULT_COMPRESSION_LEVEL,
+                        help="gzip level of the outputs, 0 to skip compression.")
+    parser.add_argument("--threads", type=int, default=1, help="Compression threads.")
+    args = parser.parse_args()
+
+    def segment_fn(img):
+        return run_totalsegmentator(img, device=args.device, fast=args.fast)
+
+    input_path = Path(args.input)
+    if input_path.is_dir():
+        jobs = [(f, Path(args.output) / f.name) for f in sorted(input_path.glob("*.nii.gz"))]
+    else:
+        jobs = [(input_path, Path(args.output))]
+
+    failures = 0
+    for input_file, output_file in jobs:
+        start = time.perf_counter()
+        try:
+            segment_to_psat(str(input_file), str(output_file), segment_fn=segment_fn,
+                            compression_level=args.compression_level, threads=args.threads)
+        except Exception as e:
+            logging.error(f"Segmentation failed for {input_file}: {e}")
+            failures += 1
+            continue
+        logging.info(f"Saved {output_file} in {time.perf_counter() - start:.1f}s")
+    if failures:
+        logging.error(f"{failures} of {len(jobs)} segmentations failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Long-lived segmentation workers that load a model once and then pull volumes from a queue.
+
+Running ``TotalSegmentator`` or ``nnUNetv2_predict`` once per volume reloads the weights
+and re-initializes the runtime for every case; on CPU this fixed cost is a large share of
+the per-case time. Here each worker process loads the model a single time and then
+segments the ``(input, output)`` jobs it receives until the queue is drained.
+
+Any nnU-Net v2 results folder can be served: the installed PSAT checkpoints, or a
+TotalSegmentator task folder (e.g. the 3mm ``total`` model) combined with ``--remap`` to
+convert its labels to the PSAT scheme.
+
+Usage:
+    python scripts/segmentation_worker.py <model_folder> <input_dir> <output_dir>
+        [--folds 0] [--checkpoint checkpoint_final.pth] [--device cuda] [--workers 1] [--remap]
+"""
+
+import argparse
+import logging
+import multiprocessing
+import queue
+import time
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterable, List, Tuple
+
+try:
+    from scripts.remap_labels import LOOKUP_TABLE
+except ImportError:  # executed as a script from the scripts folder
+    from remap_labels import LOOKUP_TABLE
+
+
+def load_nnunet_model(model_folder: str, folds: Tuple = (0,), checkpoint: str = "checkpoint_final.pth",
+                      device: str = "cuda", remap: bool = False) -> Callable[[str, str], None]:
+    """Load an nnU-Net v2 model once and return a ``predict(input_file, output_file)`` function.
+
+    Parameters
+    ----------
+    model_folder : str
+        nnU-Net results folder (``<trainer>__<plans>__<configuration>``).
+    folds : tuple
+        Folds to ensemble.
+    checkpoint : str
+        Checkpoint file name inside each fold folder.
+    device : str
+        ``cuda``, ``cpu`` or ``mps``.
+    remap : bool
+        Remap TotalSegmentator labels to the PSAT scheme before writing.
+    """
+    import torch
+    from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
+
+    predictor = nnUNetPredictor(device=torch.device(device), verbose=False, allow_tqdm=False)
+    predictor.initialize_from_trained_model_folder(model_folder, use_folds=folds, checkpoint_name=checkpoint)
+    reader_writer = predictor.plans_manager.image_reader_writer_class()
+
+    def predict(input_file: str, output_file: str) -> None:
+        image, properties = reader_writer.read_images([input_file])
+        segmentation = predictor.predict_single_npy_array(image, properties, None, None, False)
+        if remap:
+            segmentation = LOOKUP_TABLE[segmentation]
+        reader_writer.write_seg(segmentation, output_file, properties)
+
+    return predict
+
+
+def run_worker(load_model: Callable[[], Callable[[str, str], None]], job_queue, result_queue) -> None:
+    """Load the model once, then segment jobs from ``job_queue`` until a ``None`` sentinel arrives.
+
+    A report dict (``input``, ``output``, ``status``, ``seconds``, ``error``) is put on
+    ``result_queue`` for every job.
+    """
+    start = time.perf_counter()
+    predict = load_model()
+    logging.info(f"Model loaded in {time.perf_counter() - start:.1f}s")
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        input_file, output_file = job
+        start = time.perf_counter()
+        try:
+            Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+            predict(input_file, output_file)
+            status, error = "done", None
+        except Exception as e:
+            status, error = "failed", f"{type(e).__name__}: {e}"
+        result_queue.put({"input": input_file, "output": output_file, "status": status,
+                          "seconds": time.perf_counter() - start, "error": error})
+
+
+def segment_with_workers(jobs: Iterable[Tuple[str, str]], load_model: Callable, num_workers: int = 1,
+                         start_method: str = "spawn") -> List[dict]:
+    """Segment ``(input, output)`` jobs with ``num_workers`` persistent worker processes.
+
+    ``load_model`` must be picklable (e.g. a ``functools.partial`` of a module-level
+    function); it runs once in every worker.
+
+    Returns
+    -------
+    list
+        One report per finished job. Jobs left unfinished because all workers died are
+        reported as ``failed``.
+    """
+    jobs = list(jobs)
+    ctx = multiprocessing.get_context(start_method)
+    job_queue, result_queue = ctx.Queue(), ctx.Queue()
+    for job in jobs:
+        job_queue.put(job)
+    for _ in range(num_workers):
+        job_queue.put(None)
+
+    workers = [ctx.Process(target=run_worker, args=(load_model, job_queue, result_queue))
+               for _ in range(num_workers)]
+    for worker in workers:
+        worker.start()
+
+    reports = []
+    while len(reports) < len(jobs):
+        try:
+            report = result_queue.get(timeout=1.0)
+        except queue.Empty:
+            if not any(worker.is_alive() for worker in workers):
+                break
+            continue
+        logging.info(f"{report['input']}: {report['status']} in {report['seconds']:.1f}s")
+        reports.append(report)
+    for worker in workers:
+        worker.join()
+
+    finished = {report["input"] for report in reports}
+    reports += [{"input": i, "output": o, "status": "failed", "seconds": 0.0, "error": "worker died"}
+                for i, o in jobs if i not in finished]
+    return reports
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Segment a folder with persistent nnU-Net workers.")
+    parser.add_argument("model_folder", help="nnU-Net v2 results folder of the model.")
+    parser.add_argument("input_dir", help="Folder of input volumes (*.nii.gz, nnU-Net channel suffixes allowed).")
+    parser.add_argument("output_dir", help="Folder receiving the segmentations.")
+    parser.add_argument("--folds", default="0", help="Comma-separated folds to ensemble, or 'all'.")
+    parser.add_argument("--checkpoint", default="checkpoint_final.pth", help="Checkpoint file name.")
+    parser.add_argument("--device", default="cuda", help="cuda, cpu or mps.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of persistent worker processes.")
+    parser.add_argument("--remap", action="store_true", help="Remap TotalSegmentator labels to PSAT labels.")
+    args = parser.parse_args()
+
+    folds = ("all",) if args.folds == "all" else tuple(int(f) for f in args.folds.split(","))
+    load_model = partial(load_nnunet_model, args.model_folder, folds=folds, checkpoint=args.checkpoint,
+                         device=args.device, remap=args.remap)
+    jobs = []
+    for input_file in sorted(Path(args.input_dir).glob("*.nii.gz")):
+        case = input_file.name[: -len(".nii.gz")]
+        case = case[: -len("_0000")] if case.endswith("_0000") else case
+        jobs.append((str(input_file), str(Path(args.output_dir) / f"{case}.nii.gz")))
+
+    reports = segment_with_workers(jobs, load_model, num_workers=args.workers)
+    failed = [r for r in reports if r["status"] != "done"]
+    for report in failed:
+        logging.error(f"{report['input']}: {report['error']}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
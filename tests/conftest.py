@@ -0,0 +1,130 @@
+"""Synthetic DICOM fixtures shared by the conversion tests."""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2"
+RT_STRUCTURE_SET_STORAGE = "1.2.840.10008.5.1.4.1.1.481.3"
+
+
+def _base_dataset(pydicom, sop_class_uid, modality, patient_id, study_uid, series_uid, frame_uid,
+                  age="010Y", sex="M"):
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = sop_class_uid
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = sop_class_uid
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Modality = modality
+    ds.PatientID = patient_id
+    ds.PatientName = patient_id
+    ds.PatientAge = age
+    ds.PatientSex = sex
+    ds.StudyInstanceUID = study_uid
+    ds.SeriesInstanceUID = series_uid
+    ds.FrameOfReferenceUID = frame_uid
+    return ds
+
+
+def write_ct_series(ct_dir, patient_id="P1", shape=(8, 10, 4), spacing=(0.8, 0.7, 2.5),
+                    origin=(-10.0, -20.0, 30.0), age="010Y", sex="M", study_uid=None, values=None):
+    """Write a CT series of ``shape`` = (rows, columns, slices) with one file per slice.
+
+    Files are written in reverse slice order with shuffled names so that readers must sort by
+    position. Returns a dict with the UIDs and the voxel array (rows, columns, slices).
+    """
+    pydicom = pytest.importorskip("pydicom")
+    from pydicom.uid import generate_uid
+
+    ct_dir.mkdir(parents=True, exist_ok=True)
+    study_uid = study_uid or generate_uid()
+    series_uid, frame_uid = generate_uid(), generate_uid()
+    rows, cols, slices = shape
+    if values is None:
+        values = np.arange(rows * cols * slices, dtype=np.int16).reshape(shape)
+    for k in range(slices):
+        ds = _base_dataset(pydicom, CT_IMAGE_STORAGE, "CT", patient_id, study_uid, series_uid, frame_uid, age, sex)
+        ds.InstanceNumber = k + 1
+        ds.ImagePositionPatient = [origin[0], origin[1], origin[2] + k * spacing[2]]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelSpacing = [spacing[0], spacing[1]]
+        ds.SliceThickness = spacing[2]
+        ds.Rows, ds.Columns = rows, cols
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated = ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 1
+        ds.RescaleSlope, ds.RescaleIntercept = 1, 0
+        ds.PixelData = np.ascontiguousarray(values[:, :, k]).astype(np.int16).tobytes()
+        ds.save_as(ct_dir / f"IMG{(slices - k) * 7 % 97:04d}.dcm", enforce_file_format=True)
+    return {"study_uid": study_uid, "series_uid": series_uid, "frame_uid": frame_uid, "values": values,
+            "spacing": spacing, "origin": origin}
+
+
+def write_rtstruct(path, ct, contours, patient_id="P1"):
+    """Write an RTSTRUCT referencing the ``ct`` series returned by ``write_ct_series``.
+
+    ``contours`` maps ROI names to lists of ``(slice_index, [(column, row), ...])`` polygons
+    given in voxel coordinates.
+    """
+    pydicom = pytest.importorskip("pydicom")
+    from pydicom.dataset import Dataset
+    from pydicom.sequence import Sequence
+    from pydicom.uid import generate_uid
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    ds = _base_dataset(pydicom, RT_STRUCTURE_SET_STORAGE, "RTSTRUCT", patient_id, ct["study_uid"],
+                       generate_uid(), ct["frame_uid"])
+    ds.StructureSetLabel = "synthetic"
+    dx, dy, dz = ct["spacing"][1], ct["spacing"][0], ct["spacing"][2]
+    ox, oy, oz = ct["origin"]
+    roi_seq, contour_seq = [], []
+    for number, (name, polygons) in enumerate(contours.items(), start=1):
+        roi = Dataset()
+        roi.ROINumber = number
+        roi.ROIName = name
+        roi.ReferencedFrameOfReferenceUID = ct["frame_uid"]
+        roi_seq.append(roi)
+        roi_contour = Dataset()
+        roi_contour.ReferencedROINumber = number
+        items = []
+        for k, polygon in polygons:
+            item = Dataset()
+            item.ContourGeometricType = "CLOSED_PLANAR"
+            item.NumberOfContourPoints = len(polygon)
+            item.ContourData = [v for c, r in polygon for v in (ox + c * dx, oy + r * dy, oz + k * dz)]
+            items.append(item)
+        roi_contour.ContourSequence = Sequence(items)
+        contour_seq.append(roi_contour)
+    ds.StructureSetROISequence = Sequence(roi_seq)
+    ds.ROIContourSequence = Sequence(contour_seq)
+    ds.save_as(path, enforce_file_format=True)
+    return path
+
+
+@pytest.fixture
+def synthetic_patient(tmp_path):
+    """Factory writing ``<root>/<patient_id>/CT`` and ``<root>/<patient_id>/RTSTRUCT`` fixtures."""
+
+    def make(patient_id="P1", root=None, contours=None, **ct_kwargs):
+        patient_dir = (root or tmp_path / "dicom") / patient_id
+        ct = write_ct_series(patient_dir / "CT", patient_id=patient_id, **ct_kwargs)
+        if contours is None:
+            contours = {"Liver": [(1, [(2, 2), (6, 2), (6, 5), (2, 5)])]}
+        write_rtstruct(patient_dir / "RTSTRUCT" / "rtstruct.dcm", ct, contours, patient_id=patient_id)
+        return patient_dir, ct
+
+    return make
+
+
+@pytest.fixture
+def dicom_writers():
+    """``write_ct_series`` and ``write_rtstruct``, for tests laying out their own DICOM folders."""
+    return SimpleNamespace(write_ct_series=write_ct_series, write_rtstruct=write_rtstruct)
@@ -0,0 +1,37 @@
+import json
+import os
+import sys
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+pytest.importorskip('torch')
+pytest.importorskip('batchgenerators')
+# The benchmark needs nnunetv2 < 2.6 (nnUNetDataset) with the files of nnUNet/dataloading copied into it
+if not hasattr(pytest.importorskip('nnunetv2.training.dataloading.nnunet_dataset'), 'nnUNetDataset'):
+    pytest.skip('nnunetv2 without nnUNetDataset (the loaders target nnunetv2 < 2.6)', allow_module_level=True)
+pytest.importorskip('nnunetv2.training.dataloading.pediatric_oversampling_dataloader')
+
+import scripts.benchmark_dataloader as benchmark_module
+
+
+def test_benchmark_smoke(tmp_path, monkeypatch):
+    # The shipped plans, shrunk to a tiny 3d_fullres configuration
+    plans, _, dataset_json = benchmark_module.load_plans_configuration(benchmark_module.DEFAULT_PLANS)
+    plans['configurations']['3d_fullres'].update(patch_size=[32, 32, 32], median_image_size_in_voxels=[40, 40, 40],
+                                                 batch_size=2)
+    (tmp_path / 'nnUNetPlans.json').write_text(json.dumps(plans))
+    (tmp_path / 'dataset.json').write_text(json.dumps(dataset_json))
+
+    output = tmp_path / 'results.csv'
+    monkeypatch.setattr(sys, 'argv', ['benchmark_dataloader.py', '--plans', str(tmp_path / 'nnUNetPlans.json'),
+                                      '--num-cases', '2', '--batches', '1', '--processes', '0',
+                                      '--work-dir', str(tmp_path), '--output', str(output)])
+    benchmark_module.main()
+
+    df = pd.read_csv(output)
+    assert len(df) == len(benchmark_module.VARIANTS)
+    assert (df['batches_per_s'] > 0).all()
+    # chunk reads count as the case load of the chunked variant
+    assert (df.loc[df['data'] == 'chunked', 'case load_ms'] > 0).all()
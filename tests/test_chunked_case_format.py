@@ -0,0 +1,54 @@
+import os
+import sys
+import numpy as np
+
+# The dataloading modules are meant to be copied into nnunetv2; the chunked format only needs numpy and zlib
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'nnUNet', 'dataloading')))
+
+from chunked_case_format import ChunkedCase, convert_npz_case, is_chunked_folder, read_chunked_header, \
+    write_chunked_case
+from patch_buffers import crop_and_pad_into
+
+
+def test_read_into_matches_crop_and_pad(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(2, 13, 9, 7)).astype(np.float32)
+    seg = rng.integers(-1, 4, size=(1, 13, 9, 7)).astype(np.int8)
+    path = str(tmp_path / 'case.chk')
+    write_chunked_case(path, {'data': data, 'seg': seg}, chunk_shape=(4, 5, 3))
+    case = ChunkedCase(path)
+    np.testing.assert_array_equal(case.read('data'), data)
+
+    patch_size = np.array([6, 8, 4])
+    out, expected = np.full((2, *patch_size), 123, np.float32), np.empty((2, *patch_size), np.float32)
+    seg_out, seg_expected = np.full((1, *patch_size), 123, np.int16), np.empty((1, *patch_size), np.int16)
+    for _ in range(50):
+        # bboxes overlap the case, as in the data loaders
+        lbs = [int(rng.integers(1 - p, s)) for s, p in zip(data.shape[1:], patch_size)]
+        ubs = [lb + p for lb, p in zip(lbs, patch_size)]
+        case.read_into('data', out, lbs, ubs, 0)
+        case.read_into('seg', seg_out, lbs, ubs, -1)
+        crop_and_pad_into(expected, data, lbs, ubs, 0)
+        crop_and_pad_into(seg_expected, seg, lbs, ubs, -1)
+        np.testing.assert_array_equal(out, expected)
+        np.testing.assert_array_equal(seg_out, seg_expected)
+
+
+def test_convert_npz_and_header_only_shapes(tmp_path):
+    data = np.arange(3 * 10 * 6 * 4, dtype=np.float32).reshape(3, 10, 6, 4)
+    seg = np.zeros((1, 10, 6, 4), dtype=np.int8)
+    npz_file = str(tmp_path / 'case_001.npz')
+    np.savez_compressed(npz_file, data=data, seg=seg)
+    assert not is_chunked_folder(str(tmp_path))
+
+    path = convert_npz_case(npz_file)
+    assert path == str(tmp_path / 'case_001.chk')
+    assert is_chunked_folder(str(tmp_path))
+    header = read_chunked_header(path)
+    assert header['arrays']['data']['shape'] == [3, 10, 6, 4]
+    assert header['arrays']['seg']['shape'] == [1, 10, 6, 4]
+    np.testing.assert_array_equal(ChunkedCase(path).read('data'), data)
+
+    # a newer npz makes the chunked file stale
+    os.utime(npz_file, (os.path.getmtime(path) + 10,) * 2)
+    assert not is_chunked_folder(str(tmp_path))
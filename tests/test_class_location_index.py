@@ -0,0 +1,46 @@
+import os
+import pickle
+import sys
+import numpy as np
+
+# The dataloading modules are meant to be copied into nnunetv2; the index only needs numpy
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'nnUNet', 'dataloading')))
+
+from class_location_index import ClassLocationIndex, build_class_location_index
+
+
+def write_case(folder, case, class_locations):
+    np.savez(folder / f'{case}.npz', data=np.zeros((1, 2, 2, 2)), seg=np.zeros((1, 2, 2, 2)))
+    with open(folder / f'{case}.pkl', 'wb') as f:
+        pickle.dump({'class_locations': class_locations}, f)
+
+
+def test_class_location_index_roundtrip(tmp_path):
+    rng = np.random.default_rng(0)
+    cases = {
+        'caseA': {1: np.c_[np.zeros(5, int), rng.integers(0, 300, (5, 3))], 2: np.zeros((0, 4), int),
+                  (1, 2): np.c_[np.zeros(3, int), rng.integers(0, 300, (3, 3))]},
+        'caseB': {1: np.c_[np.zeros(2, int), rng.integers(0, 300, (2, 3))]},
+        'caseC': {1: np.zeros((0, 4), int), 2: np.c_[np.zeros(4, int), rng.integers(0, 300, (4, 3))]},
+    }
+    for case, locations in cases.items():
+        write_case(tmp_path, case, locations)
+
+    folder = build_class_location_index(str(tmp_path))
+    index = ClassLocationIndex(folder)
+    assert index.cases == ['caseA', 'caseB', 'caseC'] and index.dim == 3
+    for case, locations in cases.items():
+        compact = index[case]
+        for c in index.classes:
+            expected = locations.get(c, np.zeros((0, 4), int))[:, 1:]
+            assert compact[c].dtype == np.uint16 and not compact[c].flags.writeable
+            np.testing.assert_array_equal(compact[c], expected)
+
+    np.random.seed(0)
+    assert any((index.sample('caseA', 1) == row).all() for row in cases['caseA'][1][:, 1:])
+    assert index.sample('caseA', 2) is None
+
+    # Pickled indexes (e.g. sent to augmenter workers) reopen the memory maps instead of copying the arrays
+    payload = pickle.dumps(index)
+    assert len(payload) < 500
+    np.testing.assert_array_equal(pickle.loads(payload)['caseC'][2], cases['caseC'][2][:, 1:])
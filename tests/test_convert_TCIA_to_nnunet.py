@@ -0,0 +1,70 @@
+import json
+import os
+import sys
+import numpy as np
+import nibabel as nib
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.convert_TCIA_to_nnunet import convert_dataset
+
+pytest.importorskip('pydicom')
+
+
+@pytest.fixture
+def tcia_subject(dicom_writers):
+    """Factory writing a subject in the TCIA download layout and returning its meta.csv rows."""
+
+    def write(root, subject_id, split, values=None):
+        study = f'./Pediatric-CT-SEG/{subject_id}/10-09-2009-NA-CT-1'
+        ct = dicom_writers.write_ct_series(root / study / '3.000000-CT-1', patient_id=subject_id, values=values)
+        dicom_writers.write_rtstruct(root / study / '2.000000-RTSTRUCT-1' / '1-1.dcm', ct,
+                                     {'Liver': [(1, [(2, 2), (6, 2), (6, 5), (2, 5)])]}, patient_id=subject_id)
+        return [
+            {'Subject ID': subject_id, 'Modality': 'RTSTRUCT', 'File Location': f'{study}/2.000000-RTSTRUCT-1',
+             'split': split},
+            {'Subject ID': subject_id, 'Modality': 'CT', 'File Location': f'{study}/3.000000-CT-1', 'split': split},
+        ]
+
+    return write
+
+
+def test_convert_dataset_layout_and_rerun(tmp_path, tcia_subject):
+    root = tmp_path / 'tcia'
+    values = (np.arange(8 * 10 * 4).reshape(8, 10, 4) - 1000).astype(np.int16)
+    rows = (tcia_subject(root, 'Pediatric-CT-SEG-A', 'train', values)
+            + tcia_subject(root, 'Pediatric-CT-SEG-B', 'val')
+            + tcia_subject(root, 'Pediatric-CT-SEG-C', 'test'))
+    meta = tmp_path / 'meta.csv'
+    pd.DataFrame(rows).to_csv(meta, index=False)
+    out = tmp_path / 'Dataset500_TCIA'
+
+    manifest = convert_dataset(str(meta), str(root), str(out), workers=2)
+    assert all(e['status'] == 'done' for e in manifest.values())
+    assert sorted(os.listdir(out / 'imagesTr')) == ['Pediatric-CT-SEG-A_0000.nii.gz', 'Pediatric-CT-SEG-B_0000.nii.gz']
+    assert os.listdir(out / 'labelsTs') == ['Pediatric-CT-SEG-C.nii.gz']
+
+    image = nib.load(out / 'imagesTr' / 'Pediatric-CT-SEG-A_0000.nii.gz')
+    label = nib.load(out / 'labelsTr' / 'Pediatric-CT-SEG-A.nii.gz')
+    # Image and label share the (column, row, slice) grid and affine
+    np.testing.assert_array_equal(np.asanyarray(image.dataobj), values.transpose(1, 0, 2))
+    np.testing.assert_allclose(image.affine, label.affine)
+    assert (np.asanyarray(label.dataobj)[2:6, 2:5, 1] == 5).all()
+
+    dataset = json.loads((out / 'dataset.json').read_text())
+    assert dataset['numTraining'] == 2 and dataset['labels']['Liver'] == 5
+    assert json.loads((out / 'splits_final.json').read_text()) == [
+        {'train': ['Pediatric-CT-SEG-A'], 'val': ['Pediatric-CT-SEG-B']}]
+
+    # Unchanged cases are skipped; moving a case to the test split converts it again
+    rows[2]['split'] = rows[3]['split'] = 'test'
+    pd.DataFrame(rows).to_csv(meta, index=False)
+    previous = dict(manifest)
+    manifest = convert_dataset(str(meta), str(root), str(out), workers=2)
+    assert manifest['Pediatric-CT-SEG-A'] == previous['Pediatric-CT-SEG-A']
+    assert manifest['Pediatric-CT-SEG-C'] == previous['Pediatric-CT-SEG-C']
+    assert manifest['Pediatric-CT-SEG-B']['split'] == 'test'
+    assert os.listdir(out / 'imagesTr') == ['Pediatric-CT-SEG-A_0000.nii.gz']
+    assert json.loads((out / 'dataset.json').read_text())['numTraining'] == 1
@@ -0,0 +1,46 @@
+import os
+import sys
+import numpy as np
+import nibabel as nib
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.convert_icans import convert_all, MANIFEST_NAME
+
+pydicom = pytest.importorskip('pydicom')
+
+
+def stub_dcm2niix(ct_dir, output_dir):
+    # Stand-in for dcm2niix: stack the slices of the synthetic series
+    slices = sorted((pydicom.dcmread(p) for p in ct_dir.glob('*.dcm')), key=lambda ds: ds.ImagePositionPatient[2])
+    volume = np.stack([ds.pixel_array for ds in slices], axis=-1)
+    nib.save(nib.Nifti1Image(volume, np.eye(4)), output_dir / 'ct.nii.gz')
+
+
+def stub_dcmrtstruct2nii(rtstruct_file, ct_dir, output_dir, ct_headers=None):
+    for roi in pydicom.dcmread(rtstruct_file).StructureSetROISequence:
+        nib.save(nib.Nifti1Image(np.zeros((2, 2, 2), np.uint8), np.eye(4)), output_dir / f'{roi.ROIName}.nii.gz')
+
+
+def test_convert_all_parallel_and_resumable(tmp_path, synthetic_patient):
+    root = tmp_path / 'archive'
+    synthetic_patient('P1', root=root)
+    synthetic_patient('P2', root=root, contours={'Spleen': [(0, [(1, 1), (3, 1), (3, 3)])]})
+    (root / 'P3' / 'CT').mkdir(parents=True)  # broken patient without images
+    out = tmp_path / 'out'
+
+    manifest = convert_all(str(root), str(out), workers=2,
+                           ct_converter=stub_dcm2niix, rtstruct_converter=stub_dcmrtstruct2nii)
+    assert manifest['P1']['status'] == 'done'
+    assert manifest['P3']['status'] == 'failed'
+    assert 'No CT DICOM files' in manifest['P3']['error']
+    assert nib.load(out / 'P1' / 'ct.nii.gz').shape == (8, 10, 4)
+    assert (out / 'P2' / 'segmentations' / 'Spleen.nii.gz').exists()
+    # Only complete patient folders and the manifest are left behind
+    assert sorted(os.listdir(out)) == [MANIFEST_NAME, 'P1', 'P2']
+
+    previous = dict(manifest)
+    manifest = convert_all(str(root), str(out), workers=2,
+                           ct_converter=stub_dcm2niix, rtstruct_converter=stub_dcmrtstruct2nii)
+    assert manifest['P1'] == previous['P1'] and manifest['P2'] == previous['P2']
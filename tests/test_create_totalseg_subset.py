@@ -57,4 +57,62 @@ class TestCreateTotalSegSubset:
         for subdir in subdirs:
             for img_id in image_ids:
                 assert (new_base / subdir / f"{img_id}_something.nii.gz").exists()
-            assert not (new_base / subdir / "otherfile.nii.gz").exists()
\ No newline at end of file
+            assert not (new_base / subdir / "otherfile.nii.gz").exists()
+
+    def test_prefix_index_matches_like_startswith(self):
+        from scripts.create_totalseg_subset import build_prefix_index, match_image_id
+        image_ids = ["s0001", "s00012", "case7"]
+        index = build_prefix_index(image_ids)
+        for name in ["s0001_0000.nii.gz", "s00012.nii.gz", "case7.nii.gz", "s0002.nii.gz", "case"]:
+            expected = any(name.startswith(i) for i in image_ids)
+            assert (match_image_id(name, index) is not None) == expected
+
+    @pytest.mark.parametrize("mode", ["hardlink", "symlink", "reflink", "copy"])
+    def test_copy_selected_files_link_modes(self, tmp_path, mode):
+        original_base, new_base = tmp_path / "original", tmp_path / "new"
+        create_directory_structure(original_base, ["imagesTr"])
+        create_directory_structure(new_base, ["imagesTr"])
+        source = original_base / "imagesTr" / "s0001_0000.nii.gz"
+        source.write_text("image")
+        # Reruns replace existing files
+        for _ in range(2):
+            assert copy_selected_files(original_base, new_base, ["imagesTr"], ["s0001"], mode=mode) == 1
+        target = new_base / "imagesTr" / "s0001_0000.nii.gz"
+        assert target.read_text() == "image"
+        assert target.is_symlink() == (mode == "symlink")
+        if mode == "hardlink":
+            assert target.stat().st_ino == source.stat().st_ino
+
+    def test_reflink_without_fcntl_copies(self, tmp_path, monkeypatch):
+        from scripts.create_totalseg_subset import materialize_file
+        # Platforms without fcntl (Windows): importing it fails
+        monkeypatch.setitem(sys.modules, "fcntl", None)
+        source, target = tmp_path / "source.nii.gz", tmp_path / "target.nii.gz"
+        source.write_text("image")
+        materialize_file(source, target, mode="reflink")
+        assert target.read_text() == "image" and not target.is_symlink()
+
+    def test_materialize_subset_incremental(self, tmp_path):
+        from scripts.create_totalseg_subset import materialize_subset
+        original_base, new_base = tmp_path / "original", tmp_path / "new"
+        create_directory_structure(original_base, ["imagesTr", "labelsTr"])
+        for image_id in ["s0001", "s0002"]:
+            (original_base / "imagesTr" / f"{image_id}_0000.nii.gz").write_text(f"image {image_id}")
+            (original_base / "labelsTr" / f"{image_id}.nii.gz").write_text(f"label {image_id}")
+        subdirs = ["imagesTr", "labelsTr"]
+
+        report = materialize_subset(original_base, new_base, subdirs, ["s0001", "s0002"], checksum=True)
+        assert report["transferred"] == 4 and report["skipped"] == 0
+        assert report["transferred_bytes"] == 4 * len("image s0001")
+
+        # Touched but unchanged file is skipped through its checksum, changed file is transferred
+        os.utime(original_base / "labelsTr" / "s0001.nii.gz", ns=(0, 0))
+        (original_base / "imagesTr" / "s0002_0000.nii.gz").write_text("new image s0002")
+        report = materialize_subset(original_base, new_base, subdirs, ["s0001", "s0002"], checksum=True)
+        assert (report["transferred"], report["skipped"]) == (1, 3)
+        assert (new_base / "imagesTr" / "s0002_0000.nii.gz").read_text() == "new image s0002"
+
+        # IDs that left the subset are pruned
+        report = materialize_subset(original_base, new_base, subdirs, ["s0001"], prune=True)
+        assert (report["transferred"], report["skipped"], report["pruned"]) == (0, 2, 2)
+        assert sorted(os.listdir(new_base / "imagesTr")) == ["s0001_0000.nii.gz"]
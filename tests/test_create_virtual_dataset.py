@@ -0,0 +1,58 @@
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.create_virtual_dataset import adopt_intensity_properties, create_virtual_dataset, plans_differences
+
+PLANS_DIR = Path(__file__).resolve().parents[1] / 'nnUNet' / 'preprocessing'
+
+
+def make_preprocessed(root, name, case_ids):
+    folder = root / name
+    folder.mkdir()
+    for f in ('nnUNetPlans.json', 'dataset.json'):
+        shutil.copy(PLANS_DIR / name / f, folder / f)
+    (folder / 'nnUNetPlans_3d_fullres').mkdir()
+    (folder / 'gt_segmentations').mkdir()
+    for case_id in case_ids:
+        for suffix in ('.npz', '.pkl'):
+            (folder / 'nnUNetPlans_3d_fullres' / f'{case_id}{suffix}').write_text(f'{name} {case_id}')
+        (folder / 'gt_segmentations' / f'{case_id}.nii.gz').write_text('gt')
+    return folder
+
+
+def load_repository_plans(name):
+    return json.loads((PLANS_DIR / name / 'nnUNetPlans.json').read_text())
+
+
+def test_plans_differences_on_repository_plans():
+    target = load_repository_plans('Dataset797_TotalSegmentator_plus_TCIA')
+    assert plans_differences(target, target) == []
+    # Same spacing (up to float32 rounding) but a different CT normalization
+    differences = plans_differences(target, load_repository_plans('Dataset297_TotalSegmentator'))
+    assert differences and all(d.startswith('channel 0 intensity') for d in differences)
+    assert any(d.startswith('spacing') for d in plans_differences(target, load_repository_plans('Dataset500_TCIA')))
+
+
+def test_create_virtual_dataset_links_compatible_cases(tmp_path):
+    ts = make_preprocessed(tmp_path, 'Dataset297_TotalSegmentator', ['s0001', 's0002'])
+    tcia = make_preprocessed(tmp_path, 'Dataset500_TCIA', ['Pediatric-CT-SEG-A'])
+    target = make_preprocessed(tmp_path, 'Dataset797_TotalSegmentator_plus_TCIA', [])
+    case_ids = ['s0001', 's0002', 'Pediatric-CT-SEG-A']
+
+    manifest = create_virtual_dataset(str(target), [str(ts), str(tcia)], case_ids)
+    assert manifest['cases'] == {} and manifest['to_preprocess'] == case_ids
+
+    adopt_intensity_properties(target, ts)
+    manifest = create_virtual_dataset(str(target), [str(ts), str(tcia)], case_ids)
+    assert manifest['sources'][str(ts)]['compatible'] and not manifest['sources'][str(tcia)]['compatible']
+    assert sorted(manifest['cases']) == ['s0001', 's0002']
+    assert manifest['to_preprocess'] == ['Pediatric-CT-SEG-A']
+    linked = target / 'nnUNetPlans_3d_fullres' / 's0001.npz'
+    assert linked.is_symlink() and linked.read_text() == 'Dataset297_TotalSegmentator s0001'
+    assert (target / 'gt_segmentations' / 's0002.nii.gz').is_symlink()
+    assert json.loads((target / 'virtual_dataset_manifest.json').read_text()) == manifest
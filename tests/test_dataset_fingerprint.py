@@ -0,0 +1,90 @@
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import nibabel as nib
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import scripts.dataset_fingerprint as dataset_fingerprint
+from scripts.dataset_fingerprint import case_record, intensity_sketch, merge_intensity_sketches, merge_records, update_records
+
+
+def load_nibabel(image_files, seg_file, dataset_json):
+    data = np.stack([np.asanyarray(nib.load(f).dataobj) for f in image_files])
+    seg = np.asanyarray(nib.load(seg_file).dataobj)[np.newaxis]
+    return data, seg, list(nib.load(image_files[0]).header.get_zooms())
+
+
+def write_case(raw_dir, case_id, seed):
+    rng = np.random.default_rng(seed)
+    image = np.zeros((12, 10, 8), np.int16)
+    image[2:10, 1:9, 1:7] = rng.integers(-1000, 1500, size=(8, 8, 6))
+    label = np.zeros(image.shape, np.uint8)
+    label[3:8, 2:7, 2:5] = 1
+    nib.save(nib.Nifti1Image(image, np.diag([0.8, 0.8, 2.0, 1])), raw_dir / 'imagesTr' / f'{case_id}_0000.nii.gz')
+    nib.save(nib.Nifti1Image(label, np.eye(4)), raw_dir / 'labelsTr' / f'{case_id}.nii.gz')
+    return image[label > 0]
+
+
+def test_sketch_percentiles_match_numpy_for_integer_intensities():
+    values = np.random.default_rng(0).integers(-1024, 3000, size=50000)
+    stats = merge_intensity_sketches([intensity_sketch(values)])
+    for key, q in [('percentile_00_5', 0.5), ('median', 50), ('percentile_99_5', 99.5)]:
+        assert stats[key] == np.percentile(values, q, method='inverted_cdf')
+    np.testing.assert_allclose([stats['mean'], stats['std']], [values.mean(), values.std()])
+    assert (stats['min'], stats['max']) == (values.min(), values.max())
+
+    # Each case weighs the same, whatever its number of foreground voxels
+    small, large = np.full(10, 100), np.full(1000, -100)
+    merged = merge_intensity_sketches([intensity_sketch(small), intensity_sketch(large)])
+    assert merged['mean'] == 0 and merged['std'] == 100
+
+
+def test_case_record_crops_to_nonzero():
+    data = np.zeros((1, 6, 6, 6))
+    data[0, 1:4, 2:5, 0:6] = 5
+    seg = np.zeros((1, 6, 6, 6), np.uint8)
+    seg[0, 2, 3, 3] = 1
+    record = case_record(data, seg, [1, 1, 2])
+    assert record['shape_after_crop'] == [3, 3, 6]
+    assert record['relative_size_after_cropping'] == 54 / 216
+    assert record['intensities']['0']['count'] == 1
+
+
+def test_update_records_is_incremental_and_mergeable(tmp_path, monkeypatch):
+    raw = tmp_path / 'Dataset297'
+    for sub in ('imagesTr', 'labelsTr'):
+        (raw / sub).mkdir(parents=True)
+    (raw / 'dataset.json').write_text(json.dumps({'channel_names': {'0': 'CT'}, 'file_ending': '.nii.gz'}))
+    foreground = [write_case(raw, f's000{i}', i) for i in range(3)]
+
+    records = update_records(str(raw), num_processes=1, load_fn=load_nibabel)
+    fingerprint = merge_records(list(records.values()))
+    assert fingerprint['shapes_after_crop'] == [[8, 8, 6]] * 3
+    np.testing.assert_allclose(fingerprint['spacings'][0], [0.8, 0.8, 2.0])
+    expected_mean = np.mean([f.mean() for f in foreground])
+    np.testing.assert_allclose(fingerprint['foreground_intensity_properties_per_channel']['0']['mean'], expected_mean)
+
+    # A new case is the only one analysed on rerun
+    analysed = []
+    original = dataset_fingerprint._analyze
+    # Threads instead of processes so that the patched analysis function is seen
+    monkeypatch.setattr(dataset_fingerprint, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(dataset_fingerprint, '_analyze', lambda files, *a: analysed.append(files) or original(files, *a))
+    write_case(raw, 's0003', 3)
+    records = update_records(str(raw), num_processes=1, load_fn=load_nibabel)
+    assert len(records) == 4 and [os.path.basename(f['label']) for f in analysed] == ['s0003.nii.gz']
+
+    # A merged dataset reuses the records of its source through an imported cache
+    merged = tmp_path / 'Dataset797'
+    for sub in ('imagesTr', 'labelsTr'):
+        (merged / sub).mkdir(parents=True)
+        for f in (raw / sub).iterdir():
+            (merged / sub / f.name).write_bytes(f.read_bytes())
+    (merged / 'dataset.json').write_text((raw / 'dataset.json').read_text())
+    analysed.clear()
+    merged_records = update_records(str(merged), import_caches=[raw / 'fingerprint_cache.json'], load_fn=load_nibabel)
+    assert analysed == [] and merged_records == records
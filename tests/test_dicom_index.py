@@ -0,0 +1,84 @@
+import os
+import sys
+import numpy as np
+import nibabel as nib
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+pytest.importorskip('pydicom')
+
+import scripts.dicom_index as dicom_index
+from scripts.dicom_index import age_in_years, build_metadata, files_under, series_files, update_index
+from scripts.convert_icans import convert_all
+from scripts.rtstruct_to_labelmap import rtstruct_to_labelmap_dir
+
+
+def stub_dcm2niix(ct_dir, output_dir):
+    nib.save(nib.Nifti1Image(np.zeros((2, 2, 2), np.int16), np.eye(4)), output_dir / 'ct.nii.gz')
+
+
+def test_update_index_is_incremental(tmp_path, synthetic_patient, monkeypatch):
+    root = tmp_path / 'archive'
+    _, ct = synthetic_patient('P1', root=root)
+    synthetic_patient('P2', root=root, age='018M', sex='F')
+    index_path = tmp_path / 'index.csv'
+
+    index = update_index(str(root), str(index_path), workers=2)
+    assert len(index) == 10
+    assert set(index['Modality']) == {'CT', 'RTSTRUCT'}
+    ordered = series_files(index, ct['series_uid'])
+    positions = index.set_index('path').loc[ordered, 'slice_position']
+    assert np.all(np.diff(positions) > 0)
+
+    # A rerun only parses the modified file
+    read = []
+    original = dicom_index.read_header
+    monkeypatch.setattr(dicom_index, 'read_header', lambda p: read.append(p) or original(p))
+    touched = ordered[0]
+    os.utime(touched, ns=(0, 0))
+    again = update_index(str(root), str(index_path), workers=2)
+    assert read == [touched]
+    pd.testing.assert_frame_equal(again.drop(columns='mtime_ns'), index.drop(columns='mtime_ns'))
+
+    metadata = build_metadata(again)
+    assert list(metadata['Subject ID']) == ['P1', 'P2']
+    assert list(metadata['StudyAge']) == [10, 1]
+    assert list(metadata['Sex']) == ['M', 'F']
+    assert age_in_years('045Y') == 45 and age_in_years(None) is None
+
+
+def test_conversion_uses_index(tmp_path, synthetic_patient):
+    root = tmp_path / 'archive'
+    patient_dir, _ = synthetic_patient('P1', root=root, contours={'Liver': [(1, [(2, 2), (6, 2), (6, 5), (2, 5)])]})
+    reference = tmp_path / 'reference'
+    reference.mkdir()
+    rtstruct_to_labelmap_dir(patient_dir / 'RTSTRUCT' / 'rtstruct.dcm', patient_dir / 'CT', reference)
+
+    out = tmp_path / 'out'
+    index_path = tmp_path / 'index.csv'
+    manifest = convert_all(str(root), str(out), workers=1, ct_converter=stub_dcm2niix,
+                           rtstruct_converter=rtstruct_to_labelmap_dir, index_path=str(index_path))
+    assert manifest['P1']['status'] == 'done'
+    assert manifest['P1']['input_fingerprint'][0] == len(files_under(update_index(str(root)), patient_dir))
+    expected = nib.load(reference / 'psat_labels.nii.gz')
+    converted = nib.load(out / 'P1' / 'segmentations' / 'psat_labels.nii.gz')
+    np.testing.assert_array_equal(np.asanyarray(converted.dataobj), np.asanyarray(expected.dataobj))
+    np.testing.assert_allclose(converted.affine, expected.affine)
+
+
+def test_wrapped_converter_receives_ct_headers(tmp_path, synthetic_patient):
+    from scripts.convert_icans import convert_patient
+
+    root = tmp_path / 'archive'
+    patient_dir, _ = synthetic_patient('P1', root=root)
+    received = {}
+
+    def wrapped_converter(*args, **kwargs):
+        received.update(kwargs)
+
+    entry = convert_patient(patient_dir, tmp_path / 'out', ct_converter=stub_dcm2niix,
+                            rtstruct_converter=wrapped_converter, patient_index=update_index(str(root)))
+    assert entry['status'] == 'done'
+    assert len(received['ct_headers']) == len(list((patient_dir / 'CT').glob('*.dcm')))
@@ -2,8 +2,12 @@ import os
 import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from scripts.get_results import escape_latex, is_baseline, compute_statistical_tests, determine_best_scores
+from scripts.get_results import (escape_latex, is_baseline, compute_statistical_tests, determine_best_scores,
+                                 load_metrics_csv, process_dataset_folder, load_registry, save_registry,
+                                 compute_paired_tests, wilcoxon_signed_rank_batched)
 import numpy as np
+import pandas as pd
+from scipy.stats import mannwhitneyu, wilcoxon
 
 
 def test_escape_latex():
@@ -26,3 +30,146 @@ def test_compute_statistical_tests_and_best_scores():
 
     best = determine_best_scores(results, ['dataset'], ['Baseline_TotalSegmentator', 'NewModel'], ['ROI'])
     assert best['ROI']['dataset'] == 'NewModel'
+
+
+def test_compute_statistical_tests_matches_pairwise_calls():
+    rng = np.random.default_rng(0)
+    results = {
+        'A_TotalSegmentator': {'ROI': {'dataset': {'dice': rng.random(6)}}},
+        'B_ARTPLAN': {'ROI': {'dataset': {'dice': rng.random(12)}}},
+    }
+    for i, n in enumerate([4, 4, 12, 12, 7]):
+        results[f'Model{i}'] = {'ROI': {'dataset': {'dice': np.round(rng.random(n), 1)}}}
+    compute_statistical_tests(results)
+
+    pool = np.concatenate([results['A_TotalSegmentator']['ROI']['dataset']['dice'],
+                           results['B_ARTPLAN']['ROI']['dataset']['dice']])
+    for i in range(5):
+        rec = results[f'Model{i}']['ROI']['dataset']
+        assert rec['pvalue'] == mannwhitneyu(rec['dice'], pool, alternative='two-sided').pvalue
+        assert rec['max_baseline'] == max(np.mean(results[b]['ROI']['dataset']['dice'])
+                                          for b in ['A_TotalSegmentator', 'B_ARTPLAN'])
+
+
+def test_compute_statistical_tests_skips_empty_baseline_pools():
+    results = {
+        'Empty_TotalSegmentator': {'ROI': {'dataset': {'dice': np.array([])}, 'other': {'dice': np.array([])}}},
+        'Base_ARTPLAN': {'ROI': {'other': {'dice': np.array([0.6, 0.7])}}},
+        'NewModel': {'ROI': {'dataset': {'dice': np.array([0.9, 0.8])}, 'other': {'dice': np.array([0.9, 0.8])}}},
+    }
+    compute_statistical_tests(results)
+    assert 'pvalue' not in results['NewModel']['ROI']['dataset']
+    assert 'max_baseline' not in results['NewModel']['ROI']['dataset']
+    # The empty baseline neither enters the pool nor the best baseline mean
+    assert results['NewModel']['ROI']['other']['max_baseline'] == np.mean([0.6, 0.7])
+    assert results['NewModel']['ROI']['other']['pvalue'] == \
+        mannwhitneyu([0.9, 0.8], [0.6, 0.7], alternative='two-sided').pvalue
+
+
+def _write_metrics(path, dice):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame({'subject': [f's{i}' for i in range(len(dice))], 'dice-Spleen': dice}).to_csv(path, index=False)
+
+
+def test_load_metrics_csv_uses_cache_until_file_changes(tmp_path):
+    csv = tmp_path / 'patient_wise_metrics.csv'
+    cache_dir = tmp_path / 'cache'
+    _write_metrics(csv, [0.5, 0.6])
+    first = load_metrics_csv(str(csv), str(cache_dir))
+    assert len(list(cache_dir.iterdir())) == 1
+    assert load_metrics_csv(str(csv), str(cache_dir)).equals(first)
+
+    _write_metrics(csv, [0.5, 0.6, 0.7])
+    os.utime(csv, ns=(1, 1))
+    assert len(load_metrics_csv(str(csv), str(cache_dir))) == 3
+
+
+def test_process_dataset_folder_reads_all_trainers(tmp_path):
+    dataset = tmp_path / 'Dataset500_TCIA'
+    _write_metrics(dataset / 'TrainerA' / 'patient_wise_metrics.csv', [0.8, 0.9])
+    _write_metrics(dataset / 'TrainerB' / 'patient_wise_metrics.csv', [0.7, np.nan])
+    (dataset / 'NoMetrics').mkdir()
+    results = {}
+    name = process_dataset_folder(str(dataset), results, cache_dir=str(tmp_path / 'cache'), max_workers=2)
+    assert name == 'Dataset500_TCIA'
+    assert sorted(results) == ['TrainerA', 'TrainerB']
+    assert list(results['TrainerB']['Sple']['Dataset500_TCIA']['dice']) == [0.7]
+
+
+def test_registry_reuses_unchanged_comparisons(tmp_path):
+    dataset = tmp_path / 'Dataset500_TCIA'
+    _write_metrics(dataset / 'Base_TotalSegmentator' / 'patient_wise_metrics.csv', [0.7, 0.8, 0.75])
+    _write_metrics(dataset / 'NewModel' / 'patient_wise_metrics.csv', [0.9, 0.95, 0.92])
+    registry_path = str(tmp_path / 'registry.json')
+
+    def run():
+        registry = load_registry(registry_path)
+        results = {}
+        process_dataset_folder(str(dataset), results, registry=registry)
+        compute_statistical_tests(results, registry=registry)
+        save_registry(registry, registry_path)
+        return results, registry
+
+    results, registry = run()
+    assert sorted(registry['trainers']['Dataset500_TCIA']) == ['Base_TotalSegmentator', 'NewModel']
+    # Tamper with the stored p-value: an unchanged tree must reuse it
+    registry['comparisons']['Dataset500_TCIA']['NewModel']['Sple']['pvalue'] = 0.123
+    save_registry(registry, registry_path)
+    results, _ = run()
+    assert results['NewModel']['Sple']['Dataset500_TCIA']['pvalue'] == 0.123
+
+    # A changed baseline invalidates the comparison
+    _write_metrics(dataset / 'Base_TotalSegmentator' / 'patient_wise_metrics.csv', [0.7, 0.8, 0.75, 0.6])
+    results, _ = run()
+    assert results['NewModel']['Sple']['Dataset500_TCIA']['pvalue'] != 0.123
+
+
+def test_wilcoxon_signed_rank_batched_matches_scipy():
+    rng = np.random.default_rng(1)
+    diffs = rng.normal(0.02, 0.05, (6, 20))
+    diffs[0, 15:] = np.nan
+    pvalues = wilcoxon_signed_rank_batched(diffs)
+    for row, pvalue in zip(diffs, pvalues):
+        assert np.isclose(pvalue, wilcoxon(row[~np.isnan(row)]).pvalue)
+
+
+def test_wilcoxon_signed_rank_batched_matches_scipy_with_ties_and_zeros():
+    rng = np.random.default_rng(2)
+    # Dice differences on a coarse grid: many tied |d| and zeros (both trainers at 0 or 1)
+    diffs = rng.choice([-0.2, -0.1, 0.0, 0.1, 0.2, 0.3], size=(8, 9))
+    diffs[0, :] = [0.1, 0.0, 0.1, -0.2, 0.3] + [np.nan] * 4
+    diffs[1, 6:] = np.nan
+    pvalues = wilcoxon_signed_rank_batched(diffs)
+    for row, pvalue in zip(diffs, pvalues):
+        assert np.isclose(pvalue, wilcoxon(row[~np.isnan(row)]).pvalue)
+
+
+def test_compute_paired_tests_aligns_subjects():
+    subjects = np.array([f's{i}' for i in range(10)])
+    baseline = np.linspace(0.5, 0.6, 10)
+    results = {
+        'Base_TotalSegmentator': {'ROI': {'dataset': {'dice': baseline, 'subjects': subjects}}},
+        # Same subjects in reverse order, each improved by a distinct margin
+        'NewModel': {'ROI': {'dataset': {'dice': (baseline + np.linspace(0.1, 0.2, 10))[::-1],
+                                         'subjects': subjects[::-1]}}},
+    }
+    for test in ['wilcoxon', 'permutation']:
+        compute_paired_tests(results, test=test, n_permutations=2000)
+        rec = results['NewModel']['ROI']['dataset']
+        assert rec['n_paired'] == 10
+        assert rec['pvalue'] < 0.01
+        assert rec['max_baseline'] == np.mean(baseline)
+
+
+def test_compute_paired_tests_skips_duplicate_subjects():
+    results = {
+        'Base_TotalSegmentator': {'ROI': {'a': {'dice': np.array([0.5, 0.6, 0.7]),
+                                                'subjects': np.array(['s0', 's1', 's1'])},
+                                          'b': {'dice': np.array([0.5, 0.6, 0.7]),
+                                                'subjects': np.array(['s0', 's1', 's2'])}}},
+        'NewModel': {'ROI': {'a': {'dice': np.array([0.8, 0.9, 0.7]), 'subjects': np.array(['s0', 's1', 's2'])},
+                             'b': {'dice': np.array([0.8, 0.9, 0.7]), 'subjects': np.array(['s0', 's0', 's2'])}}},
+    }
+    compute_paired_tests(results)
+    assert 'pvalue' not in results['NewModel']['ROI']['a']
+    assert 'pvalue' not in results['NewModel']['ROI']['b']
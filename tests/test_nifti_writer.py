@@ -0,0 +1,56 @@
+import gzip
+import os
+import sys
+import numpy as np
+import nibabel as nib
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.nifti_writer import save_nifti
+
+
+@pytest.fixture
+def label_img():
+    data = np.random.default_rng(0).integers(0, 14, size=(32, 32, 24)).astype(np.int16)
+    return nib.Nifti1Image(data, np.diag([1.5, 1.5, 3.0, 1.0]))
+
+
+@pytest.mark.parametrize('name, level, threads', [
+    ('out.nii.gz', 1, 1),
+    ('out.nii.gz', 6, 4),
+    ('out.nii.gz', None, 1),
+    ('out.nii', None, 1),
+])
+def test_save_nifti_round_trip(tmp_path, label_img, name, level, threads):
+    path = tmp_path / name
+    save_nifti(label_img, str(path), compression_level=level, threads=threads, label_map=True, block_size=4096)
+    out = nib.load(path)
+    assert out.get_data_dtype() == np.uint8
+    np.testing.assert_array_equal(np.asanyarray(out.dataobj), np.asanyarray(label_img.dataobj))
+    assert os.listdir(tmp_path) == [name]
+
+
+def test_threaded_blocks_form_a_valid_gzip_stream(tmp_path, label_img):
+    save_nifti(label_img, str(tmp_path / 'out.nii.gz'), threads=4, block_size=1024)
+    with gzip.open(tmp_path / 'out.nii.gz') as f:
+        assert f.read() == label_img.to_bytes()
+
+
+def test_label_map_rejects_out_of_range_values(tmp_path):
+    img = nib.Nifti1Image(np.full((2, 2, 2), 300, dtype=np.int16), np.eye(4))
+    with pytest.raises(ValueError):
+        save_nifti(img, str(tmp_path / 'out.nii.gz'), label_map=True)
+
+
+def test_failed_write_removes_temporary_file(tmp_path, label_img, monkeypatch):
+    import scripts.nifti_writer as nifti_writer
+
+    def failing_blocks(*args, **kwargs):
+        yield b'partial'
+        raise OSError('disk full')
+
+    monkeypatch.setattr(nifti_writer, 'gzip_blocks', failing_blocks)
+    with pytest.raises(OSError):
+        save_nifti(label_img, str(tmp_path / 'out.nii.gz'))
+    assert os.listdir(tmp_path) == []
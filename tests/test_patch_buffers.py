@@ -0,0 +1,35 @@
+import os
+import sys
+import numpy as np
+
+# The dataloading modules are meant to be copied into nnunetv2; the buffer helpers only need numpy
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'nnUNet', 'dataloading')))
+
+from patch_buffers import crop_and_pad_into
+
+
+def reference_crop_and_pad(array, bbox_lbs, bbox_ubs, pad_value):
+    # Slicing and padding as in nnU-Net's data loaders
+    shape = array.shape[1:]
+    valid_lbs = np.clip(bbox_lbs, a_min=0, a_max=None)
+    valid_ubs = np.minimum(shape, bbox_ubs)
+    crop = array[(slice(None),) + tuple(slice(i, j) for i, j in zip(valid_lbs, valid_ubs))]
+    padding = ((0, 0),) + tuple((-min(0, bbox_lbs[i]), max(bbox_ubs[i] - shape[i], 0)) for i in range(len(shape)))
+    return np.pad(crop, padding, 'constant', constant_values=pad_value)
+
+
+def test_crop_and_pad_into_matches_pad():
+    rng = np.random.default_rng(0)
+    array = rng.normal(size=(2, 9, 7, 5)).astype(np.float32)
+    seg = rng.integers(0, 4, size=(1, 9, 7, 5)).astype(np.int16)
+    patch_size = np.array([6, 8, 4])
+    out = np.full((2, *patch_size), 123, np.float32)
+    seg_out = np.full((1, *patch_size), 123, np.int16)
+    for _ in range(50):
+        lbs = [int(rng.integers(-4, s)) for s in array.shape[1:]]
+        ubs = [lb + p for lb, p in zip(lbs, patch_size)]
+        # Buffers are reused without being cleared between calls
+        crop_and_pad_into(out, array, lbs, ubs, 0)
+        crop_and_pad_into(seg_out, seg, lbs, ubs, -1)
+        np.testing.assert_array_equal(out, reference_crop_and_pad(array, lbs, ubs, 0))
+        np.testing.assert_array_equal(seg_out, reference_crop_and_pad(seg, lbs, ubs, -1))
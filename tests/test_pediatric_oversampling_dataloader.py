@@ -0,0 +1,143 @@
+import importlib.util
+import os
+import pickle
+import sys
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('nnunetv2')
+pytest.importorskip('batchgenerators')
+# The loader targets the nnU-Net 2.5 dataset API, nnunetv2 >= 2.6 replaced nnUNetDataset
+if not hasattr(pytest.importorskip('nnunetv2.training.dataloading.nnunet_dataset'), 'nnUNetDataset'):
+    pytest.skip('nnunetv2 without nnUNetDataset (the loader targets nnunetv2 < 2.6)', allow_module_level=True)
+
+# The dataloading modules are meant to be copied into nnunetv2/training/dataloading, where the loader imports its
+# helpers from. Register this repository's helpers under those names and load the loader from this repository
+DATALOADING = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'nnUNet', 'dataloading'))
+sys.path.insert(0, DATALOADING)
+
+import chunked_case_format
+import class_location_index
+import patch_buffers
+import pediatric_sampling
+
+for module in (chunked_case_format, class_location_index, patch_buffers, pediatric_sampling):
+    sys.modules[f'nnunetv2.training.dataloading.{module.__name__}'] = module
+spec = importlib.util.spec_from_file_location('pediatric_oversampling_dataloader',
+                                              os.path.join(DATALOADING, 'pediatric_oversampling_dataloader.py'))
+pediatric_oversampling_dataloader = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pediatric_oversampling_dataloader)
+nnUNetDataLoaderPediatric = pediatric_oversampling_dataloader.nnUNetDataLoaderPediatric
+
+SHAPE = (12, 10, 8)
+PATCH_SIZE = (6, 6, 4)
+
+
+class StubLabelManager(object):
+    all_labels = [0, 1]
+    has_ignore_label = False
+
+
+class StubDataset(object):
+    # In-memory stand-in for nnUNetDataset: cases with distinct values so that a batch tells where it came from
+    def __init__(self, folder, n_cases=4):
+        self.dataset = {f'case{i}': {'data_file': os.path.join(folder, f'case{i}.npz')} for i in range(n_cases)}
+        self.property_loads = 0
+
+    def keys(self):
+        return self.dataset.keys()
+
+    def __getitem__(self, key):
+        self.property_loads += 1
+        return {'properties': {'class_locations': {1: np.array([[0, 6, 5, 4]])}}}
+
+    def load_case(self, key):
+        value = int(key[-1])
+        data = np.full((1, *SHAPE), value, np.float32)
+        seg = np.full((1, *SHAPE), value % 2, np.int16)
+        return data, seg, self[key]['properties']
+
+
+def stub_transforms(image, segmentation):
+    return {'image': image * 2, 'segmentation': segmentation.clone()}
+
+
+def make_loader(tmp_path, transforms=None):
+    return nnUNetDataLoaderPediatric(StubDataset(str(tmp_path)), 2, PATCH_SIZE, PATCH_SIZE, StubLabelManager(),
+                                     oversample_foreground_percent=0.5, transforms=transforms)
+
+
+def test_buffers_are_reused_and_batches_without_transforms_are_copies(tmp_path):
+    loader = make_loader(tmp_path)
+    first = loader.generate_train_batch()
+    data_buffer, seg_buffer = loader._data_buffer, loader._seg_buffer
+    assert first['data'].shape == (2, 1, *PATCH_SIZE) and first['seg'].shape == (2, 1, *PATCH_SIZE)
+    assert not np.shares_memory(first['data'], data_buffer) and not np.shares_memory(first['seg'], seg_buffer)
+    first_data = first['data'].copy()
+
+    second = loader.generate_train_batch()
+    assert loader._data_buffer is data_buffer and loader._seg_buffer is seg_buffer
+    # the second batch overwrote the buffers, not the first batch
+    assert np.array_equal(first['data'], first_data)
+    for j, key in enumerate(second['keys']):
+        assert (second['data'][j] == int(key[-1])).all()
+    assert len(second['properties']) == 2
+
+
+def test_transformed_batches_do_not_alias_the_buffers(tmp_path):
+    loader = make_loader(tmp_path, transforms=stub_transforms)
+    batch = loader.generate_train_batch()
+    assert isinstance(batch['data'], torch.Tensor) and batch['data'].shape == (2, 1, *PATCH_SIZE)
+    assert not np.shares_memory(batch['data'].numpy(), loader._data_buffer)
+    assert not np.shares_memory(batch['target'].numpy(), loader._seg_buffer)
+    data, target = batch['data'].clone(), batch['target'].clone()
+    loader.generate_train_batch()
+    assert torch.equal(batch['data'], data) and torch.equal(batch['target'], target)
+    for j, key in enumerate(batch['keys']):
+        assert (batch['data'][j] == 2 * int(key[-1])).all()
+
+
+def write_preprocessed_cases(folder, dataset):
+    # .npz and properties pickles as written by nnU-Net's preprocessing, for the class location index
+    for key in dataset.keys():
+        data, seg, properties = dataset.load_case(key)
+        np.savez(os.path.join(folder, f'{key}.npz'), data=data, seg=seg)
+        with open(os.path.join(folder, f'{key}.pkl'), 'wb') as f:
+            pickle.dump(properties, f)
+
+
+def test_class_location_index_skips_the_properties(tmp_path):
+    dataset = StubDataset(str(tmp_path))
+    write_preprocessed_cases(str(tmp_path), dataset)
+    index_folder = class_location_index.build_class_location_index(str(tmp_path))
+    for transforms in (None, stub_transforms):
+        loader = nnUNetDataLoaderPediatric(dataset, 2, PATCH_SIZE, PATCH_SIZE, StubLabelManager(),
+                                           oversample_foreground_percent=0.5, transforms=transforms,
+                                           class_location_index=index_folder)
+        dataset.property_loads = 0
+        batch = loader.generate_train_batch()
+        assert dataset.property_loads == 0 and 'properties' not in batch
+        if transforms is None:
+            for j, key in enumerate(batch['keys']):
+                assert (batch['data'][j] == int(key[-1])).all()
+
+
+def test_stale_class_location_index_is_rejected(tmp_path):
+    write_preprocessed_cases(str(tmp_path), StubDataset(str(tmp_path), n_cases=3))
+    index_folder = class_location_index.build_class_location_index(str(tmp_path))
+    with pytest.raises(ValueError, match='rebuild it'):
+        nnUNetDataLoaderPediatric(StubDataset(str(tmp_path), n_cases=4), 2, PATCH_SIZE, PATCH_SIZE,
+                                  StubLabelManager(), class_location_index=index_folder)
+
+
+def test_class_location_index_older_than_the_properties_is_rejected(tmp_path):
+    dataset = StubDataset(str(tmp_path))
+    write_preprocessed_cases(str(tmp_path), dataset)
+    index_folder = class_location_index.build_class_location_index(str(tmp_path))
+    # case2 is preprocessed again after the index was built
+    index_mtime = os.path.getmtime(os.path.join(index_folder, 'index.json'))
+    os.utime(os.path.join(str(tmp_path), 'case2.pkl'), (index_mtime + 10, index_mtime + 10))
+    with pytest.raises(ValueError, match='older than the properties of case2'):
+        nnUNetDataLoaderPediatric(dataset, 2, PATCH_SIZE, PATCH_SIZE, StubLabelManager(),
+                                  class_location_index=index_folder)
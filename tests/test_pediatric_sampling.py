@@ -0,0 +1,120 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+# The dataloading modules are meant to be copied into nnunetv2; the sampling helpers only need numpy
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'nnUNet', 'dataloading')))
+
+from pediatric_sampling import AliasSampler, GlobalBatchSampler, cohort_weights, load_case_weights, rank_batch_sizes, \
+    split_cohorts
+
+
+def test_alias_sampler_matches_weights():
+    weights = np.array([0.5, 3.0, 0.0, 1.5, 5.0])
+    sampler = AliasSampler(weights)
+    draws = sampler.sample(200000, rng=np.random.default_rng(0))
+    frequencies = np.bincount(draws, minlength=len(weights)) / len(draws)
+    np.testing.assert_allclose(frequencies, weights / weights.sum(), atol=5e-3)
+    assert frequencies[2] == 0
+
+    np.random.seed(1)
+    first = sampler.sample(8)
+    np.random.seed(1)
+    assert np.array_equal(sampler.sample(8), first)
+
+    with pytest.raises(ValueError):
+        AliasSampler([0, 0])
+
+
+def test_cohort_weights_keep_pediatric_ratio():
+    files = ['/p/s0001.npz', '/p/Pediatric-CT-SEG-A.npz', '/p/s0002.npz', '/p/s0003.npz', '/p/Pediatric-CT-SEG-B.npz']
+    is_pediatric = split_cohorts(files)
+    assert is_pediatric.tolist() == [False, True, False, False, True]
+
+    # Same expected pediatric share as drawing ratio * n_pediatric pediatric cases against the adult cases
+    weights = cohort_weights(is_pediatric, 4.0)
+    assert weights[is_pediatric].sum() / weights.sum() == pytest.approx(8 / 11)
+    np.testing.assert_allclose(weights[is_pediatric], [4, 4])
+
+    # Arbitrary case weights only redistribute the draws within a cohort
+    weighted = cohort_weights(is_pediatric, 4.0, [1, 3, 1, 2, 1])
+    assert weighted[is_pediatric].sum() / weighted.sum() == pytest.approx(8 / 11)
+    np.testing.assert_allclose(weighted[is_pediatric], [6, 2])
+    np.testing.assert_allclose(weighted[~is_pediatric], [0.75, 0.75, 1.5])
+
+    # Cohorts without cases get no weight
+    assert cohort_weights(np.zeros(3, bool), 4.0).tolist() == [1, 1, 1]
+
+
+def test_load_case_weights(tmp_path):
+    csv_file = tmp_path / 'meta.csv'
+    pd.DataFrame({'image_id': ['s0001', 's0002'], 'age': [30, 70], 'weight': [1.0, 2.5]}).to_csv(csv_file, index=False)
+    assert load_case_weights(str(csv_file)) == {'s0001': 1.0, 's0002': 2.5}
+
+
+def test_rank_batch_sizes_match_trainer_split():
+    for global_batch_size, world_size in [(2, 2), (5, 2), (7, 3), (8, 8)]:
+        # nnUNetTrainer._set_batch_size_and_oversample
+        expected = [global_batch_size // world_size] * world_size
+        expected = [b + 1 if b * world_size + i < global_batch_size else b for i, b in enumerate(expected)]
+        assert rank_batch_sizes(global_batch_size, world_size) == expected
+    with pytest.raises(ValueError):
+        rank_batch_sizes(2, 4)
+
+
+def test_global_batch_sampler_splits_steps_without_duplicates():
+    is_pediatric = np.array([True] * 6 + [False] * 30)
+    world_size, global_batch_size = 3, 8
+    samplers = [GlobalBatchSampler(is_pediatric, 4.0, global_batch_size, world_size, rank, seed=7)
+                for rank in range(world_size)]
+    share = samplers[0].pediatric_share
+    assert share == pytest.approx(24 / 54)
+    pediatric_counts = []
+    for step in range(2000):
+        parts = [sampler.sample(step) for sampler in samplers]
+        assert [len(p) for p in parts] == rank_batch_sizes(global_batch_size, world_size)
+        batch = np.concatenate(parts)
+        assert len(np.unique(batch)) == global_batch_size
+        pediatric_counts.append(is_pediatric[batch].sum())
+    # floor or ceil of the expected number of pediatric cases, with the right mean
+    assert set(pediatric_counts) <= {3, 4}
+    assert np.mean(pediatric_counts) / global_batch_size == pytest.approx(share, abs=0.01)
+    # a different seed gives different batches
+    assert not np.array_equal(GlobalBatchSampler(is_pediatric, 4.0, 8, seed=8).global_batch(0),
+                              samplers[0].global_batch(0))
+
+
+def _gloo_worker(rank, world_size, init_file, results):
+    import torch.distributed as dist
+    dist.init_process_group('gloo', init_method=f'file://{init_file}', rank=rank, world_size=world_size)
+    is_pediatric = np.array([True] * 4 + [False] * 20)
+    sampler = GlobalBatchSampler(is_pediatric, 4.0, 5, dist.get_world_size(), dist.get_rank(), seed=3)
+    local = [sampler.sample(step).tolist() for step in range(50)]
+    gathered = [None] * world_size
+    dist.all_gather_object(gathered, local)
+    if rank == 0:
+        results.put(gathered)
+    dist.destroy_process_group()
+
+
+def test_global_batch_sampler_gloo(tmp_path):
+    pytest.importorskip('torch')
+    import torch.multiprocessing as mp
+    world_size = 2
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_gloo_worker, args=(rank, world_size, str(tmp_path / 'init'), results))
+                 for rank in range(world_size)]
+    for process in processes:
+        process.start()
+    gathered = results.get(timeout=120)
+    for process in processes:
+        process.join(timeout=120)
+        assert process.exitcode == 0
+    reference = GlobalBatchSampler(np.array([True] * 4 + [False] * 20), 4.0, 5, seed=3)
+    for step in range(50):
+        batch = gathered[0][step] + gathered[1][step]
+        assert len(set(batch)) == 5
+        assert batch == reference.global_batch(step).tolist()
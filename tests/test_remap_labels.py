@@ -0,0 +1,85 @@
+import os
+import sys
+import numpy as np
+import nibabel as nib
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.remap_labels import total_mapping, desired_mapping, build_lookup_table, remap_array, remap_file
+
+
+def _loop_remap(data):
+    # Reference implementation: one full-volume comparison per TotalSegmentator label
+    new_data = np.copy(data)
+    for orig_label, structure in total_mapping.items():
+        new_data[data == orig_label] = desired_mapping.get(structure, 0)
+    return new_data
+
+
+def test_lookup_table_matches_loop_remap():
+    data = np.random.default_rng(0).integers(0, 118, size=(8, 9, 10)).astype(np.int16)
+    remapped = remap_array(data, build_lookup_table())
+    assert remapped.dtype == np.uint8
+    np.testing.assert_array_equal(remapped, _loop_remap(data))
+
+
+def test_remap_array_keeps_unknown_labels_unless_strict():
+    data = np.array([0, 5, 200, 300], dtype=np.int16)
+    remapped = remap_array(data)
+    assert remapped.dtype == np.int16
+    assert remapped.tolist() == [0, 5, 200, 300]
+    with pytest.raises(ValueError):
+        remap_array(data, strict=True)
+
+
+def test_remap_file_writes_uint8(tmp_path):
+    data = np.zeros((4, 4, 4), dtype=np.uint8)
+    data[0, 0, 0] = 5   # liver
+    data[1, 1, 1] = 21  # urinary_bladder
+    data[2, 2, 2] = 90  # brain, unmapped
+    affine = np.diag([1.5, 1.5, 3.0, 1.0])
+    nib.save(nib.Nifti1Image(data, affine), tmp_path / 'seg.nii.gz')
+    remap_file(str(tmp_path / 'seg.nii.gz'), str(tmp_path / 'out.nii.gz'))
+    out = nib.load(tmp_path / 'out.nii.gz')
+    assert out.get_data_dtype() == np.uint8
+    np.testing.assert_array_equal(out.affine, affine)
+    result = np.asanyarray(out.dataobj)
+    assert (result[0, 0, 0], result[1, 1, 1], result[2, 2, 2]) == (5, 11, 0)
+
+
+def test_remap_batch_skips_up_to_date_and_reports_failures(tmp_path):
+    from scripts.remap_labels import jobs_from_directory, remap_batch
+
+    in_dir, out_dir = tmp_path / 'in', tmp_path / 'out'
+    in_dir.mkdir()
+    for name in ['a', 'b']:
+        nib.save(nib.Nifti1Image(np.full((3, 3, 3), 5, dtype=np.uint8), np.eye(4)), in_dir / f'{name}.nii.gz')
+    (in_dir / 'broken.nii.gz').write_bytes(b'not a nifti')
+
+    jobs = jobs_from_directory(str(in_dir), str(out_dir))
+    reports = {os.path.basename(r['input']): r for r in remap_batch(jobs, workers=2)}
+    assert reports['a.nii.gz']['status'] == 'done'
+    assert reports['broken.nii.gz']['status'] == 'failed'
+    assert (out_dir / 'b.nii.gz').exists()
+
+    reports = {os.path.basename(r['input']): r['status'] for r in remap_batch(jobs, workers=2)}
+    assert reports == {'a.nii.gz': 'skipped', 'b.nii.gz': 'skipped', 'broken.nii.gz': 'failed'}
+
+
+def test_remap_manifest_mode(tmp_path):
+    from scripts.remap_labels import jobs_from_manifest, main
+
+    nib.save(nib.Nifti1Image(np.full((3, 3, 3), 21, dtype=np.uint8), np.eye(4)), tmp_path / 'a.nii.gz')
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text(f"input,output\n{tmp_path / 'a.nii.gz'},{tmp_path / 'out' / 'a_psat.nii.gz'}\n\n")
+    assert jobs_from_manifest(str(manifest)) == [(str(tmp_path / 'a.nii.gz'), str(tmp_path / 'out' / 'a_psat.nii.gz'))]
+
+    main(['--manifest', str(manifest), '--workers', '1'])
+    assert np.all(np.asanyarray(nib.load(tmp_path / 'out' / 'a_psat.nii.gz').dataobj) == 11)
+
+    # a missing input fails the run
+    manifest.write_text(f"{tmp_path / 'missing.nii.gz'},{tmp_path / 'out' / 'missing.nii.gz'}\n")
+    with pytest.raises(SystemExit) as e:
+        main(['--manifest', str(manifest), '--workers', '1'])
+    assert e.value.code == 1
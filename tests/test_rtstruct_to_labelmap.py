@@ -0,0 +1,67 @@
+import os
+import sys
+import numpy as np
+import nibabel as nib
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.rtstruct_to_labelmap import convert_to_labelmap, fill_polygon, psat_label
+
+
+def test_psat_label_normalizes_roi_names():
+    assert psat_label('Kidney_R') == 2
+    assert psat_label('gall-bladder') == 4
+    assert psat_label('Small Intestine') == 9
+    assert psat_label('Rectum') == 0
+
+
+def test_fill_polygon_even_odd():
+    # Vertices on pixel centres: the boundary pixels are kept on every side
+    square = np.array([(1, 1), (4, 1), (4, 3), (1, 3)], dtype=float)
+    mask = fill_polygon(square, (6, 5))
+    expected = np.zeros((6, 5), dtype=bool)
+    expected[1:5, 1:4] = True
+    np.testing.assert_array_equal(mask, expected)
+
+    # Same result whatever the orientation of the contour, and symmetric for a symmetric shape
+    np.testing.assert_array_equal(fill_polygon(square[::-1], (6, 5)), expected)
+    diamond = np.array([(3, 0), (6, 3), (3, 6), (0, 3)], dtype=float)
+    mask = fill_polygon(diamond, (7, 7))
+    np.testing.assert_array_equal(mask, mask[::-1, :])
+    np.testing.assert_array_equal(mask, mask[:, ::-1])
+    np.testing.assert_array_equal(mask, mask.T)
+    assert mask[3, 0] and mask[6, 3] and mask[0, 3] and mask[3, 6] and mask.sum() == 25
+
+    # Vertices between pixel centres only cover the centres inside
+    expected = np.zeros((6, 5), dtype=bool)
+    expected[2:5, 2:4] = True
+    np.testing.assert_array_equal(fill_polygon(square + 0.5, (6, 5)), expected)
+
+
+def test_convert_to_labelmap_on_ct_grid(tmp_path, synthetic_patient):
+    contours = {
+        'Liver': [(1, [(2, 2), (6, 2), (6, 5), (2, 5)])],
+        # Outer and inner contour on the same slice: the inner one is a hole
+        'Kidney_R': [(3, [(0, 0), (8, 0), (8, 7), (0, 7)]), (3, [(3, 3), (5, 3), (5, 5), (3, 5)])],
+        'Rectum': [(2, [(0, 0), (3, 0), (3, 3)])],
+    }
+    patient_dir, ct = synthetic_patient(contours=contours)
+    out = tmp_path / 'labels.nii.gz'
+    skipped = convert_to_labelmap(patient_dir / 'RTSTRUCT' / 'rtstruct.dcm', patient_dir / 'CT', out)
+    assert skipped == ['Rectum']
+
+    img = nib.load(out)
+    labels = np.asanyarray(img.dataobj)
+    assert img.get_data_dtype() == np.uint8
+    assert labels.shape == (10, 8, 4)  # (columns, rows, slices)
+    assert set(np.unique(labels[:, :, 1])) == {0, 5}
+    assert (labels[2:6, 2:5, 1] == 5).all()
+    assert (labels[:, :, 2] == 0).all()
+    assert labels[1, 1, 3] == 2 and labels[3, 3, 3] == 0
+
+    # Voxel (column 2, row 2, slice 1) lies at the LPS position written in the contour, in RAS
+    x = ct['origin'][0] + 2 * ct['spacing'][1]
+    y = ct['origin'][1] + 2 * ct['spacing'][0]
+    z = ct['origin'][2] + 1 * ct['spacing'][2]
+    np.testing.assert_allclose(img.affine @ [2, 2, 1, 1], [-x, -y, z, 1], atol=1e-4)
@@ -0,0 +1,58 @@
+import json
+import os
+import sys
+import numpy as np
+import nibabel as nib
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.run_totalsegmentator import run, MANIFEST_NAME
+
+# Dummy segmenter: labels every voxel above 0 HU as liver (TotalSegmentator label 5)
+# and fails for inputs whose name contains "bad"
+DUMMY_SEGMENTER = '''
+import sys
+import nibabel as nib
+import numpy as np
+src, dst = sys.argv[1], sys.argv[2]
+if "bad" in src:
+    sys.exit(3)
+img = nib.load(src)
+nib.save(nib.Nifti1Image((np.asanyarray(img.dataobj) > 0).astype(np.uint8) * 5, img.affine), dst)
+'''
+
+
+def _setup(tmp_path):
+    in_dir = tmp_path / 'in'
+    in_dir.mkdir()
+    for name in ['case1', 'case2', 'bad_case']:
+        nib.save(nib.Nifti1Image(np.full((3, 3, 3), 50, dtype=np.int16), np.eye(4)), in_dir / f'{name}.nii.gz')
+    script = tmp_path / 'dummy_segmenter.py'
+    script.write_text(DUMMY_SEGMENTER)
+    return in_dir, f'{sys.executable} {script} {{input}} {{output}}'
+
+
+def test_run_records_manifest_and_skips_completed_cases(tmp_path):
+    in_dir, cmd = _setup(tmp_path)
+    out_dir = tmp_path / 'out'
+    manifest = run(str(in_dir), str(out_dir), segmenter_cmd=cmd, workers=2)
+
+    assert manifest['case1']['status'] == 'done'
+    assert manifest['case1']['exit_code'] == 0
+    assert manifest['bad_case']['status'] == 'failed'
+    assert manifest['bad_case']['exit_code'] == 3
+    assert (np.asanyarray(nib.load(out_dir / 'case2.nii.gz').dataobj) == 5).all()
+    assert json.loads((out_dir / MANIFEST_NAME).read_text()).keys() == manifest.keys()
+
+    # Rerun: completed cases keep their entries, failed ones are retried
+    previous = dict(manifest)
+    manifest = run(str(in_dir), str(out_dir), segmenter_cmd=cmd, workers=2)
+    assert manifest['case1'] == previous['case1']
+    assert manifest['case2'] == previous['case2']
+    assert manifest['bad_case']['status'] == 'failed'
+
+    # A removed input no longer counts as a failure
+    (in_dir / 'bad_case.nii.gz').unlink()
+    manifest = run(str(in_dir), str(out_dir), segmenter_cmd=cmd, workers=2)
+    assert sorted(manifest) == ['case1', 'case2']
+    assert 'bad_case' not in json.loads((out_dir / MANIFEST_NAME).read_text())
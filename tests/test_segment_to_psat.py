@@ -0,0 +1,51 @@
+import os
+import sys
+import numpy as np
+import nibabel as nib
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import scripts.segment_to_psat as segment_module
+from scripts.segment_to_psat import segment_to_psat
+
+
+def fake_totalsegmentator(img):
+    # Stand-in model: everything above 100 HU is "liver" (5), everything below -500 HU is "brain" (90)
+    ct = np.asanyarray(img.dataobj)
+    seg = np.zeros(ct.shape, dtype=np.uint8)
+    seg[ct > 100] = 5
+    seg[ct < -500] = 90
+    return nib.Nifti1Image(seg, img.affine)
+
+
+def test_segment_to_psat_writes_only_final_label_map(tmp_path):
+    ct = np.zeros((4, 4, 4), dtype=np.int16)
+    ct[:2] = 200
+    ct[3] = -1000
+    affine = np.diag([0.8, 0.8, 2.0, 1.0])
+    nib.save(nib.Nifti1Image(ct, affine), tmp_path / 'ct.nii.gz')
+
+    segment_to_psat(str(tmp_path / 'ct.nii.gz'), str(tmp_path / 'out' / 'ct.nii.gz'),
+                    segment_fn=fake_totalsegmentator)
+
+    assert sorted(os.listdir(tmp_path / 'out')) == ['ct.nii.gz']
+    out = nib.load(tmp_path / 'out' / 'ct.nii.gz')
+    assert out.get_data_dtype() == np.uint8
+    np.testing.assert_allclose(out.affine, affine, rtol=1e-6)
+    labels = np.asanyarray(out.dataobj)
+    assert (labels[:2] == 5).all()
+    assert (labels[2:] == 0).all()
+
+
+def test_main_exits_with_error_when_a_case_fails(tmp_path, monkeypatch):
+    (tmp_path / 'in').mkdir()
+    nib.save(nib.Nifti1Image(np.zeros((4, 4, 4), dtype=np.int16), np.eye(4)), tmp_path / 'in' / 'good.nii.gz')
+    (tmp_path / 'in' / 'broken.nii.gz').write_bytes(b'not a nifti')
+    monkeypatch.setattr(segment_module, 'run_totalsegmentator', lambda img, **kwargs: fake_totalsegmentator(img))
+    monkeypatch.setattr(sys, 'argv', ['segment_to_psat.py', str(tmp_path / 'in'), str(tmp_path / 'out')])
+
+    with pytest.raises(SystemExit) as e:
+        segment_module.main()
+    assert e.value.code == 1
+    assert os.listdir(tmp_path / 'out') == ['good.nii.gz']
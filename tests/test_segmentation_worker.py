@@ -0,0 +1,41 @@
+import os
+import sys
+from functools import partial
+import numpy as np
+import nibabel as nib
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.segmentation_worker import segment_with_workers
+
+
+def load_threshold_model(load_log, threshold=0):
+    """Tiny local model: labels voxels above ``threshold`` as 1. Every load is logged."""
+    with open(load_log, 'a') as f:
+        f.write('loaded\n')
+
+    def predict(input_file, output_file):
+        img = nib.load(input_file)
+        seg = (np.asanyarray(img.dataobj) > threshold).astype(np.uint8)
+        nib.save(nib.Nifti1Image(seg, img.affine), output_file)
+
+    return predict
+
+
+def test_workers_load_model_once_and_drain_queue(tmp_path):
+    jobs = []
+    for i in range(5):
+        path = tmp_path / f'case{i}.nii.gz'
+        nib.save(nib.Nifti1Image(np.full((2, 2, 2), i, dtype=np.int16), np.eye(4)), path)
+        jobs.append((str(path), str(tmp_path / 'out' / f'case{i}.nii.gz')))
+    jobs.append((str(tmp_path / 'missing.nii.gz'), str(tmp_path / 'out' / 'missing.nii.gz')))
+
+    load_log = tmp_path / 'loads.txt'
+    reports = segment_with_workers(jobs, partial(load_threshold_model, str(load_log), threshold=2), num_workers=2)
+
+    status = {os.path.basename(r['input']): r['status'] for r in reports}
+    assert status.pop('missing.nii.gz') == 'failed'
+    assert set(status.values()) == {'done'}
+    assert load_log.read_text().count('loaded') == 2
+    assert np.asanyarray(nib.load(tmp_path / 'out' / 'case4.nii.gz').dataobj).all()
+    assert not np.asanyarray(nib.load(tmp_path / 'out' / 'case1.nii.gz').dataobj).any()
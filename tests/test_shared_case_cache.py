@@ -0,0 +1,129 @@
+import multiprocessing
+import os
+import sys
+import numpy as np
+import pytest
+
+# The dataloading modules are meant to be copied into nnunetv2; the cache only needs numpy and multiprocessing
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'nnUNet', 'dataloading')))
+
+from shared_case_cache import CachedCaseDataset, SharedCaseCache
+
+pytestmark = pytest.mark.skipif(not os.path.isdir('/dev/shm'), reason='POSIX shared memory required')
+
+
+def case_arrays(key, size=1000):
+    value = int(key[-1])
+    return np.full((1, size), value, np.float32), np.full((1, size), value, np.int16)
+
+
+class CountingDataset(object):
+    def __init__(self):
+        self.loads = 0
+
+    def keys(self):
+        return ['case1', 'case2', 'case3']
+
+    def __getitem__(self, key):
+        return {'properties': {'key': key}}
+
+    def load_case(self, key):
+        self.loads += 1
+        data, seg = case_arrays(key)
+        return data, seg, self[key]['properties']
+
+
+def worker(cache, key, queue):
+    # A worker process publishes a case that the parent then reads
+    data, seg = case_arrays(key)
+    queue.put(cache.put(key, data, seg))
+
+
+def test_shared_case_cache_budget_lru_and_processes():
+    case_bytes = 1000 * 4 + 1000 * 2
+    cache = SharedCaseCache(budget_bytes=2 * case_bytes)
+    try:
+        ctx = multiprocessing.get_context('fork')
+        queue = ctx.Queue()
+        process = ctx.Process(target=worker, args=(cache, 'case1', queue))
+        process.start()
+        assert queue.get(timeout=30)
+        process.join()
+        assert process.exitcode == 0
+
+        # The segment outlives the worker that created it
+        data, seg = cache.get('case1')
+        assert data.dtype == np.float32 and (data == 1).all() and (seg == 1).all()
+        assert not data.flags.writeable
+
+        dataset = CachedCaseDataset(CountingDataset(), cache)
+        assert dataset.load_case('case1')[2] == {'key': 'case1'} and dataset.loads == 0
+        dataset.load_case('case2')
+        dataset.load_case('case1')  # case2 is now the least recently used entry
+        dataset.load_case('case3')
+        assert dataset.loads == 2
+        assert 'case2' not in cache and 'case1' in cache and 'case3' in cache
+        assert cache.used_bytes <= cache.budget_bytes
+
+        # Cases larger than the budget are not cached
+        assert not cache.put('big', np.zeros(3 * case_bytes, np.uint8))
+    finally:
+        names = [e['name'] for e in cache._entries.values()]
+        del data, seg
+        cache.close()
+    assert len(cache) == 0
+    assert not any(os.path.exists(f'/dev/shm/{name}') for name in names)
+
+
+def create_and_crash(queue):
+    # The creating process ends with an exception, without calling close
+    cache = SharedCaseCache(budget_bytes=10 ** 6)
+    cache.put('case1', *case_arrays('case1'))
+    queue.put(cache._prefix)
+    raise RuntimeError('training crashed')
+
+
+def test_segments_are_unlinked_when_the_creating_process_exits_without_close():
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=create_and_crash, args=(queue,))
+    process.start()
+    prefix = queue.get(timeout=60)
+    process.join()
+    assert process.exitcode != 0
+    assert not any(n.startswith(prefix + '_') for n in os.listdir('/dev/shm'))
+
+
+def test_get_releases_evicted_segments():
+    case_bytes = 1000 * 4 + 1000 * 2
+    cache = SharedCaseCache(budget_bytes=case_bytes)
+    reader = SharedCaseCache.__new__(SharedCaseCache)
+    reader.__dict__.update(cache.__getstate__())
+    try:
+        cache.put('case1', *case_arrays('case1'))
+        assert reader.get('case1') is not None
+        cache.put('case2', *case_arrays('case2'))  # evicts case1
+        assert reader.get('case2') is not None
+        assert len(reader._attached) == 1
+    finally:
+        reader._release_evicted()
+        cache.close()
+
+
+def test_eviction_keeps_running_size_and_headroom():
+    case_bytes = 1000 * 4 + 1000 * 2
+    cache = SharedCaseCache(budget_bytes=10 * case_bytes, eviction_headroom=0.3)
+    try:
+        for i in range(10):
+            cache.put(f'case{i}', *case_arrays(f'case{i}'))
+        assert len(cache) == 10 and cache.used_bytes == 10 * case_bytes
+        generation = cache._generation.value
+        cache.get('case0')  # case1 to case3 are now the least recently used entries
+        cache.put('case10', *case_arrays('case0'))
+        # evicted down to 70% of the budget before adding the new case
+        assert 'case0' in cache and 'case4' in cache and not any(f'case{i}' in cache for i in (1, 2, 3))
+        assert cache._generation.value == generation + 1
+        assert cache.used_bytes == sum(e['nbytes'] for e in cache._entries.values()) == 8 * case_bytes
+    finally:
+        cache.close()
+    assert cache.used_bytes == 0